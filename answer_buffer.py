@@ -0,0 +1,225 @@
+"""Отложенная запись ответов на карточки.
+
+Ответ не пишется в базу в обработчике сообщения: он попадает в буфер в
+памяти, а фоновый поток записывает накопленные ответы одной транзакцией
+(handlers_db.record_answers) раз в ANSWER_FLUSH_INTERVAL секунд или как
+только их наберётся ANSWER_FLUSH_SIZE. При остановке бота буфер
+записывается полностью (close).
+
+Через тот же буфер записываются пропуски карточек: пропущенное слово
+ненадолго откладывается. Пока событие не записано, слово не выбирается
+снова (ShownCards).
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import metrics
+import scheduler
+from handlers_db import AnswerEvent, record_answers
+
+# Настройки буфера ответов
+answer_flush_interval = float(os.getenv("ANSWER_FLUSH_INTERVAL", "1"))
+answer_flush_size = int(os.getenv("ANSWER_FLUSH_SIZE", "500"))
+answer_max_pending = int(os.getenv("ANSWER_MAX_PENDING", "100000"))
+shown_max_users = int(os.getenv("SHOWN_MAX_USERS", "100000"))
+
+logger = logging.getLogger(__name__)
+
+class AnswerBuffer:
+    """Буфер событий с записью пачками в фоновом потоке.
+
+    Если запись не удалась, события возвращаются в буфер и записываются
+    следующей пачкой; пока база недоступна, в буфере хранится не больше
+    max_pending событий, самые старые отбрасываются. done(events)
+    вызывается для событий, которые записаны или отброшены.
+    """
+
+    def __init__(self, flush=record_answers, flush_size=answer_flush_size,
+                 interval=answer_flush_interval, max_pending=answer_max_pending, done=None):
+        self._flush = flush
+        self._done = done
+        self.flush_size = flush_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self._events = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, name="answer-buffer", daemon=True)
+        self._thread.start()
+
+    def add(self, event):
+        with self._cond:
+            if not self._closed:
+                self._events.append(event)
+                if len(self._events) >= self.flush_size:
+                    self._cond.notify()
+                return
+        # Буфер уже закрыт: записываем сразу
+        try:
+            self._flush([event])
+        finally:
+            self._finish([event])
+
+    def pending(self):
+        """Сколько событий ждут записи."""
+        with self._cond:
+            return len(self._events)
+
+    def close(self):
+        """Записывает оставшиеся события и останавливает поток."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or len(self._events) >= self.flush_size,
+                                    self.interval)
+                events, self._events = self._events, []
+                closed = self._closed
+
+            if events and not self._write(events, closed) and not closed:
+                # База недоступна: ждём до следующей попытки
+                with self._cond:
+                    self._cond.wait_for(lambda: self._closed, self.interval)
+            if closed:
+                return
+
+    def _write(self, events, closed):
+        try:
+            self._flush(events)
+            self._finish(events)
+            return True
+        except Exception as e:
+            logger.error("Ошибка при записи ответов (%d): %s", len(events), e)
+        if closed:
+            logger.error("Ответы не записаны: %d", len(events))
+            self._finish(events)
+            return False
+        with self._cond:
+            self._events[:0] = events
+            dropped = self._events[:max(0, len(self._events) - self.max_pending)]
+            del self._events[:len(dropped)]
+        if dropped:
+            logger.warning("Буфер ответов переполнен, отброшено: %d", len(dropped))
+            self._finish(dropped)
+        return False
+
+    def _finish(self, events):
+        if self._done is not None:
+            self._done(events)
+
+class ShownCards:
+    """Карточки, показанные пользователям, и слова, ждущие записи.
+
+    Ответ попадает в базу только при записи буфера, а до того время
+    повторения слова в базе старое, и выбор по due_at вернул бы его снова.
+    Поэтому из выбора исключаются слова с событиями, ждущими записи
+    (forget снимает исключение), и карточка, которая сейчас на экране.
+    Памяти нужно по одной карточке на пользователя и по слову на
+    незаписанное событие.
+    """
+
+    def __init__(self, max_users=shown_max_users):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        # users.id -> данные повторения показанной и ещё не завершённой карточки
+        self._current = OrderedDict()
+        # users.id -> {user_words.id: число незаписанных событий}
+        self._pending = {}
+
+    def show(self, review):
+        """Запоминает показанную карточку; возвращает прежнюю, если её пропустили."""
+        user_id = review["user_id"]
+        with self._lock:
+            previous = self._current.pop(user_id, None)
+            self._current[user_id] = review
+            while len(self._current) > self.max_users:
+                self._current.popitem(last=False)
+        if previous is not None and previous["user_word_id"] != review["user_word_id"]:
+            return previous
+        return None
+
+    def finish(self, user_id, user_word_id):
+        """Карточка завершена: её событие ждёт записи в базу."""
+        with self._lock:
+            current = self._current.get(user_id)
+            if current is not None and current["user_word_id"] == user_word_id:
+                del self._current[user_id]
+            words = self._pending.setdefault(user_id, {})
+            words[user_word_id] = words.get(user_word_id, 0) + 1
+
+    def forget(self, events):
+        """Снимает исключение со слов, события которых записаны (или отброшены)."""
+        with self._lock:
+            for event in events:
+                words = self._pending.get(event.user_id)
+                if words is None or event.user_word_id not in words:
+                    continue
+                words[event.user_word_id] -= 1
+                if not words[event.user_word_id]:
+                    del words[event.user_word_id]
+                if not words:
+                    del self._pending[event.user_id]
+
+    def excluded(self, user_id, current=True):
+        """id слов, которые сейчас не нужно выбирать; current - вместе с показанной карточкой."""
+        with self._lock:
+            excluded = set(self._pending.get(user_id, ()))
+            review = self._current.get(user_id) if current else None
+        if review is not None:
+            excluded.add(review["user_word_id"])
+        return excluded
+
+shown = ShownCards()
+
+buffer = AnswerBuffer(done=shown.forget)
+atexit.register(buffer.close)
+metrics.gauge("answer_buffer_pending", "Ответы, ждущие записи в базу", buffer.pending)
+
+def record_answer(review, quality, attempts):
+    """Записывает ответ на карточку и назначает следующее повторение слова.
+
+    review - данные карточки из handlers_db.get_due_cards, quality - оценка
+    ответа (scheduler.quality_from_attempts), attempts - сколько попыток
+    потрачено. Запись в базу происходит позже, пачкой.
+    """
+    ease, interval, streak = scheduler.review(review["ease"], review["interval"], review["streak"], quality)
+    # Слово не выбирается снова, пока ответ не записан
+    shown.finish(review["user_id"], review["user_word_id"])
+    buffer.add(AnswerEvent(
+        review["user_id"], review["user_word_id"], quality >= scheduler.MIN_PASSING_QUALITY,
+        attempts, quality, ease, interval, streak, datetime.now(timezone.utc)
+    ))
+
+def record_skip(review):
+    """Откладывает пропущенную карточку на scheduler.SKIP_DELAY_MINUTES.
+
+    Параметры повторения слова не меняются, в журнал ответов и статистику
+    пропуск не попадает.
+    """
+    shown.finish(review["user_id"], review["user_word_id"])
+    buffer.add(AnswerEvent(
+        review["user_id"], review["user_word_id"], False, 0, None,
+        review["ease"], review["interval"], review["streak"], datetime.now(timezone.utc), True
+    ))
+
+def mark_shown(review):
+    """Отмечает, что карточка review показана; прежняя незавершённая считается пропущенной."""
+    skipped = shown.show(review)
+    if skipped is not None:
+        record_skip(skipped)
+
+def excluded_words(user_id, current=True):
+    """Слова пользователя, которые не нужно выбирать для карточек (см. ShownCards)."""
+    return shown.excluded(user_id, current) if user_id is not None else set()
+
+def close():
+    """Дописывает буфер ответов; вызывается при остановке бота."""
+    buffer.close()
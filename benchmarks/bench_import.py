@@ -0,0 +1,62 @@
+"""Скорость и память импорта списка слов (handlers_db.import_words).
+
+Запуск из корня проекта (нужна доступная PostgreSQL из .env):
+
+    python -m benchmarks.bench_import [--sizes 100000 1000000]
+
+Пары слов генерируются на лету, как при чтении большого файла. Данные
+создаются во временной схеме, которая удаляется по завершении.
+"""
+import argparse
+import os
+import time
+import tracemalloc
+
+SCHEMA = "bench_import"
+BENCH_CID = 1
+
+# Соединения пула работают во временной схеме; расширения вроде pg_trgm - в public
+os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA},public"
+
+from connection_db import close_pool, create_connection
+from handlers_db import create_schema, import_words
+
+def generate_pairs(size):
+    for n in range(size):
+        yield f"word{n}", f"слово{n}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    conn = create_connection()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            cur.execute(f"CREATE SCHEMA {SCHEMA}")
+            create_schema(cur)
+
+            print(f"{'pairs':>10} {'seconds':>10} {'pairs/s':>10} {'peak, KiB':>10}")
+            for size in args.sizes:
+                cur.execute("TRUNCATE user_words, words, users RESTART IDENTITY CASCADE")
+                cur.execute("INSERT INTO users (user_id, user_name) VALUES (%s, 'bench')", (BENCH_CID,))
+
+                tracemalloc.start()
+                start = time.perf_counter()
+                read, added, linked = import_words(generate_pairs(size), cid=BENCH_CID)
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                assert read == added == linked == size
+                print(f"{size:>10} {elapsed:>10.2f} {size / elapsed:>10.0f} {peak / 1024:>10.0f}")
+    finally:
+        close_pool()
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Сравнение выборки карточек: ORDER BY RANDOM() и выборка по порядковым номерам.
+
+Запуск из корня проекта (нужна доступная PostgreSQL из .env):
+
+    python -m benchmarks.bench_random_words [--sizes 100 10000 1000000] [--repeat 200]
+
+Данные создаются во временной схеме, которая удаляется по завершении.
+"""
+import argparse
+import statistics
+import time
+
+from connection_db import create_connection
+from handlers_db import create_schema, draw_random_words
+
+SCHEMA = "bench_random_words"
+BENCH_CID = 1
+
+# Запрос, которым карточки выбирались раньше
+LEGACY_QUERY = """
+    SELECT target_word, translate_word
+    FROM words
+    JOIN user_words ON words.id = user_words.word_id
+    JOIN users ON users.id = user_words.user_id
+    WHERE users.user_id = %s
+    ORDER BY RANDOM()
+    LIMIT %s;
+"""
+
+def legacy_random_words(cur, cid, limit=4):
+    cur.execute(LEGACY_QUERY, (cid, limit))
+    return cur.fetchall()
+
+def fill(cur, size):
+    """Создаёт пользователя со словарём из size слов."""
+    cur.execute("TRUNCATE user_words, words, users RESTART IDENTITY CASCADE")
+    cur.execute("INSERT INTO users (user_id, user_name) VALUES (%s, 'bench')", (BENCH_CID,))
+    cur.execute("""
+        INSERT INTO words (target_word, translate_word)
+        SELECT 'Word' || n, 'Слово' || n FROM generate_series(1, %s) AS n
+    """, (size,))
+    cur.execute("""
+        INSERT INTO user_words (user_id, word_id)
+        SELECT 1, id FROM words ORDER BY id
+    """)
+    cur.execute("ANALYZE users; ANALYZE words; ANALYZE user_words;")
+
+def measure(cur, draw, repeat):
+    """Возвращает времена выборки одной карточки в миллисекундах."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        words = draw(cur, BENCH_CID, 4)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert len(words) == 4
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    conn = create_connection()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            cur.execute(f"CREATE SCHEMA {SCHEMA}")
+            cur.execute(f"SET search_path TO {SCHEMA}, public")
+            create_schema(cur)
+
+            print(f"{'rows':>10} {'method':>10} {'p50, ms':>10} {'p95, ms':>10} {'mean, ms':>10}")
+            for size in args.sizes:
+                fill(cur, size)
+                for name, draw in (("random()", legacy_random_words), ("ordinal", draw_random_words)):
+                    timings = sorted(measure(cur, draw, args.repeat))
+                    p50 = timings[len(timings) // 2]
+                    p95 = timings[int(len(timings) * 0.95) - 1]
+                    print(f"{size:>10} {name:>10} {p50:>10.3f} {p95:>10.3f} "
+                          f"{statistics.mean(timings):>10.3f}")
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.close()
+
+if __name__ == "__main__":
+    main()
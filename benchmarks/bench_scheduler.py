@@ -0,0 +1,69 @@
+"""Пропускная способность планировщика повторений (scheduler.review).
+
+Запуск из корня проекта (база данных не нужна):
+
+    python -m benchmarks.bench_scheduler [--answers 2000000] [--words 100 10000 1000000]
+
+Для каждого размера словаря из --words замер выполняется отдельно.
+
+Моделирует очередь повторений в памяти: куча по времени повторения
+заменяет индекс (user_id, due_at), поэтому выбор следующего слова стоит
+O(log n), как и в базе. Ответы генерируются случайно: чем больше слово
+повторяли подряд, тем чаще на него отвечают правильно.
+"""
+import argparse
+import heapq
+import random
+import time
+
+import scheduler
+
+DAY = 24 * 60 * 60
+
+def simulate(answers, words, seed):
+    """Проигрывает answers ответов на словаре из words слов.
+
+    Возвращает (время в секундах, доля правильных ответов).
+    """
+    rng = random.Random(seed)
+    # (время повторения, id слова); параметры слова - в отдельном списке
+    queue = [(0.0, word_id) for word_id in range(words)]
+    state = [(scheduler.DEFAULT_EASE, 0.0, 0)] * words
+    now = 0.0
+    correct = 0
+
+    start = time.perf_counter()
+    for _ in range(answers):
+        due_at, word_id = heapq.heappop(queue)
+        now = max(now, due_at)
+        ease, interval, streak = state[word_id]
+
+        attempts = 0
+        while attempts < 3 and rng.random() > 0.6 + 0.08 * min(streak, 4):
+            attempts += 1
+        success = attempts < 3
+        correct += success
+
+        quality = scheduler.quality_from_attempts(success, attempts)
+        ease, interval, streak = scheduler.review(ease, interval, streak, quality)
+        state[word_id] = (ease, interval, streak)
+        heapq.heappush(queue, (now + interval * DAY, word_id))
+        # Пользователь отвечает примерно раз в 10 секунд
+        now += 10
+    elapsed = time.perf_counter() - start
+    return elapsed, correct / answers
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--answers", type=int, default=2_000_000)
+    parser.add_argument("--words", type=int, nargs="+", default=[100, 10_000, 1_000_000])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'words':>10} {'answers':>10} {'answers/s':>12} {'correct':>8}")
+    for words in args.words:
+        elapsed, accuracy = simulate(args.answers, words, args.seed)
+        print(f"{words:>10} {args.answers:>10} {args.answers / elapsed:>12.0f} {accuracy:>8.1%}")
+
+if __name__ == "__main__":
+    main()
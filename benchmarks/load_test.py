@@ -0,0 +1,358 @@
+"""Нагрузочный тест бота: синтетические пользователи и заглушка Bot API.
+
+Запуск из корня проекта (нужны программы сервера PostgreSQL - initdb и
+pg_ctl - в PATH или в каталоге PG_BIN, и расширение pg_trgm; initdb не
+запускается от root):
+
+    python -m benchmarks.load_test [--users 50] [--cycles 5] [--words 1000]
+
+Каждый пользователь в своём потоке отправляет /start, проходит --cycles
+карточек (отвечает случайным вариантом, пока карточка не завершится, и
+просит следующую), добавляет новое слово с переводом и удаляет его.
+Обновления передаются обработчикам main.py так же, как в режиме вебхука,
+а все запросы бота к Telegram уходят в локальную заглушку Bot API, из
+ответов которой пользователи берут варианты на клавиатуре.
+
+База из .env не используется: тест запускает собственный временный
+кластер PostgreSQL (initdb во временном каталоге, доступ через
+unix-сокет), создаёт в нём таблицы через migrate.py и удаляет кластер по
+завершении. Поэтому синтетические пользователи и слова не могут попасть
+в рабочую базу.
+
+Результат - пропускная способность, задержка ответа (от передачи
+обновления боту до получения заглушкой Bot API нужного сообщения, p50/p95/
+p99) и время самих обработчиков по видам обновлений, число запросов к
+базе на обновление.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+BOT_ID = 123456
+FIRST_CHAT_ID = 10_000_000
+
+class DisposablePostgres:
+    """Временный кластер PostgreSQL: создаётся в start() и удаляется в stop()."""
+
+    def __init__(self, bin_dir=None):
+        self.bin_dir = bin_dir or os.getenv("PG_BIN") or self._find_bin_dir()
+        self.root = None
+        self.port = None
+
+    @staticmethod
+    def _find_bin_dir():
+        if shutil.which("initdb"):
+            return os.path.dirname(shutil.which("initdb"))
+        # Debian и Ubuntu не добавляют initdb в PATH
+        candidates = sorted(glob("/usr/lib/postgresql/*/bin/initdb"))
+        if candidates:
+            return os.path.dirname(candidates[-1])
+        raise SystemExit("Не найден initdb: установите сервер PostgreSQL или укажите каталог в PG_BIN")
+
+    def _run(self, program, *args):
+        subprocess.run([os.path.join(self.bin_dir, program), *args], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+    def start(self):
+        self.root = tempfile.mkdtemp(prefix="load_test_pg_")
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        data = os.path.join(self.root, "data")
+        try:
+            self._run("initdb", "-D", data, "-U", "postgres", "-A", "trust", "-E", "UTF8", "--no-sync")
+            # Только unix-сокет в каталоге кластера; надёжность записи тесту не нужна
+            options = f"-p {self.port} -k {self.root} -c listen_addresses='' -c fsync=off"
+            self._run("pg_ctl", "-D", data, "-l", os.path.join(self.root, "server.log"),
+                      "-o", options, "-w", "start")
+        except BaseException:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+            raise
+
+    def stop(self):
+        if self.root is None:
+            return
+        try:
+            self._run("pg_ctl", "-D", os.path.join(self.root, "data"), "-m", "immediate", "-w", "stop")
+        finally:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+
+    def environ(self):
+        """Настройки подключения для connection_db."""
+        return {
+            "DB_NAME": "postgres", "DB_USER": "postgres", "DB_PASSWORD": "",
+            "DB_HOST": self.root, "DB_PORT": str(self.port)
+        }
+
+class FakeBotApi:
+    """Заглушка Bot API: отвечает на методы бота и запоминает отправленные сообщения."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.calls = Counter()
+        self._messages = defaultdict(list)
+        self._message_id = 0
+        self._cond = threading.Condition()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_port}/bot{{0}}/{{1}}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def message_count(self, chat_id):
+        with self._cond:
+            return len(self._messages[chat_id])
+
+    def wait_message(self, chat_id, after, match=None, timeout=10):
+        """Ждёт сообщение в чат с номером больше after, подходящее под match.
+
+        Возвращает первое такое сообщение или None.
+        """
+        def found():
+            return next((message for message in self._messages[chat_id][after:]
+                         if match is None or match(message)), None)
+
+        with self._cond:
+            self._cond.wait_for(lambda: found() is not None, timeout)
+            return found()
+
+    def _record(self, method, params):
+        chat_id = int(params.get("chat_id", 0))
+        keyboard = []
+        if params.get("reply_markup"):
+            markup = json.loads(params["reply_markup"])
+            keyboard = [button["text"] for row in markup.get("keyboard", []) for button in row]
+        with self._cond:
+            self.calls[method] += 1
+            self._message_id += 1
+            message = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+            if method == "sendSticker":
+                message["sticker"] = {
+                    "file_id": "fake-sticker", "file_unique_id": "fake-sticker",
+                    "type": "regular", "width": 512, "height": 512,
+                    "is_animated": False, "is_video": False
+                }
+            else:
+                message["text"] = params.get("text", "")
+            self._messages[chat_id].append({"text": params.get("text"), "keyboard": keyboard,
+                                            "delivered_at": time.perf_counter()})
+            self._cond.notify_all()
+        return message
+
+    def _result(self, method, params):
+        if method == "getMe":
+            with self._cond:
+                self.calls[method] += 1
+            return {"id": BOT_ID, "is_bot": True, "first_name": "LoadTest", "username": "load_test_bot"}
+        if method in ("sendMessage", "sendSticker"):
+            return self._record(method, params)
+        with self._cond:
+            self.calls[method] += 1
+        return True
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                url = urlsplit(self.path)
+                method = url.path.rsplit("/", 1)[-1]
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                body = json.dumps({"ok": True, "result": api._result(method, params)}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+class VirtualUser:
+    """Пользователь, который проходит сценарий и замеряет обработку своих обновлений."""
+
+    def __init__(self, index, bot, api, commands, latencies, handler_times, errors):
+        self.chat_id = FIRST_CHAT_ID + index
+        self.bot = bot
+        self.api = api
+        self.commands = commands
+        self.latencies = latencies
+        self.handler_times = handler_times
+        self.errors = errors
+        self._update_id = index * 1_000_000
+
+    def send(self, kind, text, match=None):
+        """Отправляет боту сообщение и ждёт ответа, подходящего под match.
+
+        Задержка считается до получения ответа заглушкой Bot API: часть
+        сообщений бот отправляет после возврата из обработчика. Возвращает
+        ответ или None.
+        """
+        from telebot import types
+
+        self._update_id += 1
+        update = types.Update.de_json({
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._update_id,
+                "date": int(time.time()),
+                "chat": {"id": self.chat_id, "type": "private", "username": f"load{self.chat_id}"},
+                "from": {"id": self.chat_id, "is_bot": False, "first_name": "Load"},
+                "text": text
+            }
+        })
+        before = self.api.message_count(self.chat_id)
+        start = time.perf_counter()
+        self.bot.process_new_updates([update])
+        self.handler_times[kind].append((time.perf_counter() - start) * 1000)
+
+        reply = self.api.wait_message(self.chat_id, before, match)
+        if reply is None:
+            self.errors[kind] += 1
+        else:
+            self.latencies[kind].append((reply["delivered_at"] - start) * 1000)
+        return reply
+
+    def send_for_card(self, kind, text):
+        """Как send, но ждёт карточку (или сообщение, что слов нет), а не первый ответ."""
+        import bot_logic
+
+        return self.send(kind, text, lambda message: bot_logic.Command.NEXT in message["keyboard"]
+                         or message["text"] == bot_logic.NO_WORDS_TEXT)
+
+    def answer_card(self, card):
+        options = [text for text in card["keyboard"] if text not in self.commands]
+        random.shuffle(options)
+        for option in options:
+            reply = self.send("answer", option)
+            if reply is None or not (reply["text"] or "").startswith("❌"):
+                return
+
+    def run(self, cycles):
+        from bot_logic import Command
+
+        # На /start бот отвечает стикером, приветствием и только затем карточкой
+        card = self.send_for_card("start", "/start")
+        for _ in range(cycles):
+            if card and Command.NEXT in card["keyboard"]:
+                self.answer_card(card)
+            card = self.send_for_card("next", Command.NEXT)
+
+        word = f"Loadword{self.chat_id}"
+        self.send("add", Command.ADD_WORD)
+        self.send("add", word)
+        self.send("add", "Нагрузка")
+        self.send("delete", Command.DELETE_WORD)
+        self.send("delete", word)
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+def report(latencies, handler_times, errors, elapsed, queries):
+    total = sum(len(values) for values in handler_times.values())
+    print(f"Обновлений: {total} за {elapsed:.1f} с, {total / elapsed:.1f} обновлений/с, "
+          f"{queries / total:.2f} запросов к базе на обновление")
+    print("Задержка ответа (до Bot API) и время обработчика, мс:")
+    print(f"{'kind':>8} {'count':>7} {'p50':>7} {'p95':>7} {'p99':>7} "
+          f"{'handler p50':>12} {'handler p95':>12} {'errors':>7}")
+    rows = {kind: (latencies[kind], handler_times[kind]) for kind in handler_times}
+    rows["all"] = ([value for values in latencies.values() for value in values],
+                   [value for values in handler_times.values() for value in values])
+    for kind, (values, handler) in rows.items():
+        values, handler = sorted(values) or [float("nan")], sorted(handler)
+        failed = sum(errors.values()) if kind == "all" else errors[kind]
+        print(f"{kind:>8} {len(handler):>7} {percentile(values, 0.5):>7.1f} "
+              f"{percentile(values, 0.95):>7.1f} {percentile(values, 0.99):>7.1f} "
+              f"{percentile(handler, 0.5):>12.1f} {percentile(handler, 0.95):>12.1f} {failed:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--words", type=int, default=1000, help="размер общего словаря")
+    args = parser.parse_args()
+
+    server = DisposablePostgres()
+    server.start()
+    api = FakeBotApi()
+    api.start()
+
+    # Настройки бота: заглушка вместо Telegram, обработка обновлений в
+    # вызывающем потоке (как в режиме вебхука), без ограничений Telegram
+    os.environ["TELEGRAM_API_URL"] = api.url
+    os.environ["TOKEN"] = f"{BOT_ID}:LOADTEST"
+    os.environ["BOT_MODE"] = "webhook"
+    os.environ.setdefault("OUTBOX_CHAT_RATE", "1000")
+    os.environ.setdefault("OUTBOX_CHAT_BURST", "1000")
+    os.environ.setdefault("OUTBOX_GLOBAL_RATE", "100000")
+    # До импорта connection_db: load_dotenv не заменяет уже заданные переменные
+    os.environ.update(server.environ())
+
+    from connection_db import close_pool, query_count
+
+    try:
+        # Таблицы и общий словарь - как перед запуском бота
+        from migrate import migrate
+        migrate()
+
+        import answer_buffer
+        import main as bot_main
+        from bot_logic import Command
+        from handlers_db import import_words
+
+        import_words((f"Word{n}", f"Слово{n}") for n in range(args.words))
+
+        commands = {Command.NEXT, Command.ADD_WORD, Command.DELETE_WORD}
+        latencies = defaultdict(list)
+        handler_times = defaultdict(list)
+        errors = Counter()
+        users = [VirtualUser(i, bot_main.bot, api, commands, latencies, handler_times, errors)
+                 for i in range(args.users)]
+
+        queries = query_count()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as executor:
+            for future in [executor.submit(user.run, args.cycles) for user in users]:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        # Запросы, отложенные обработчиками, тоже относятся к обновлениям
+        bot_main.outbox.close()
+        answer_buffer.close()
+        report(latencies, handler_times, errors, elapsed, query_count() - queries)
+        print("Вызовы Bot API: " + ", ".join(f"{method} {count}" for method, count in sorted(api.calls.items())))
+    finally:
+        api.stop()
+        close_pool()
+        server.stop()
+
+if __name__ == "__main__":
+    main()
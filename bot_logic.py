@@ -0,0 +1,214 @@
+"""Общая логика бота для синхронного (main.py) и асинхронного (main_async.py) запуска.
+
+Здесь нет обращений к Telegram и базе данных: только команды, состояния,
+клавиатуры, тексты ответов и решения, которые принимают обработчики.
+"""
+import random
+
+from telebot import types
+from telebot.handler_backends import State, StatesGroup
+
+import scheduler
+from handlers_db import RelationStatus
+
+# Определение команд
+class Command:
+    ADD_WORD = "Добавить слово ➕"
+    DELETE_WORD = "Удалить слово 🔙"
+    NEXT = "Следующее слово ➡️"
+
+# Определение состояний
+class MyStates(StatesGroup):
+    target_word = State()
+    translate_word = State()
+    other_words = State()
+    adding_new_word = State()
+    saving_new_word = State()
+    deleting_word = State()
+
+# Сколько слов нужно для карточки и сколько попыток на ответ
+CARD_SIZE = 4
+MAX_ATTEMPTS = 3
+
+NO_WORDS_TEXT = "Нет доступных слов!\nДобавьте новые через 'Добавить слово ➕'."
+RESTART_TEXT = "Ошибка! Начните заново со /start."
+NO_QUIZ_DATA_TEXT = "Ошибка! Попробуй снова начать со /start."
+NO_WORD_TO_SAVE_TEXT = "Ошибка: не найдено слово для сохранения. Начните заново."
+SAVE_WORD_FAILED_TEXT = "Не удалось сохранить слово. Попробуйте добавить его ещё раз."
+MAIN_MENU_TEXT = "Выберите дальнейшее действие:"
+ASK_NEW_WORD_TEXT = "Введите слово, которое вы хотите добавить, на английском:"
+ASK_WORD_TO_DELETE_TEXT = "Введите слово, которое хотите удалить, на английском:"
+IMPORT_UNSUPPORTED_TEXT = ("Пришлите список слов файлом .csv, .tsv или .txt (экспорт Anki): "
+                           "в каждой строке слово и перевод.")
+IMPORT_TOO_LARGE_TEXT = "Файл слишком большой: бот может скачать файл не больше 20 МБ."
+IMPORT_FAILED_TEXT = "Не удалось прочитать файл. Проверьте, что в каждой строке слово и перевод."
+
+# Файлы со словами, которые можно прислать боту, и предел скачивания Bot API
+IMPORT_EXTENSIONS = (".csv", ".tsv", ".txt")
+IMPORT_MAX_BYTES = 20 * 1024 * 1024
+
+def welcome_text(first_name, bot_name):
+    """Текст приветствия по /start."""
+    return (f"Приветствую, {first_name}!\nЯ {bot_name}! "
+            f"Начнём учить язык 🇬🇧\nУ тебя есть возможность использовать тренажёр,\nкак конструктор, "
+            f"и собирать свою собственную базу для обучения.\nДля этого воспользуйся инструментами:\n"
+            f"- добавить слово ➕\n"
+            f"- удалить слово 🔙\n"
+            f"Приступим ⬇️")
+
+def make_card(words):
+    """Собирает карточку из слов (target_word, translate_word).
+
+    Первое слово загадывается, остальные становятся неправильными
+    вариантами. Возвращает (target_word, translate_word, текст, клавиатура)
+    или None, если слов не хватает.
+    """
+    if not words or len(words) < CARD_SIZE:
+        return None
+
+    # Извлекаем целевое слово и другие варианты
+    target_word, translate_word = words[0]
+    other_words = [w[0] for w in words[1:]]
+
+    # Перемешиваем варианты
+    options = other_words + [target_word]
+    random.shuffle(options)
+
+    # Создаем клавиатуру
+    markup = types.ReplyKeyboardMarkup(row_width=2)
+    buttons = [types.KeyboardButton(option) for option in options]
+    buttons.append(types.KeyboardButton(Command.NEXT))
+    buttons.append(types.KeyboardButton(Command.ADD_WORD))
+    buttons.append(types.KeyboardButton(Command.DELETE_WORD))
+    markup.add(*buttons)
+
+    text = f"Выбери перевод слова:\n🇷🇺 {translate_word}"
+    return target_word, translate_word, text, markup
+
+def main_menu_markup():
+    """Клавиатура основного меню."""
+    markup = types.ReplyKeyboardMarkup(row_width=2)
+    buttons = [
+        types.KeyboardButton(Command.ADD_WORD),
+        types.KeyboardButton(Command.DELETE_WORD),
+        types.KeyboardButton(Command.NEXT)
+    ]
+    markup.add(*buttons)
+    return markup
+
+def check_answer(user_response, data):
+    """Проверяет ответ на карточку и обновляет данные состояния.
+
+    Возвращает (текст ответа, оценка). Оценка (scheduler.quality_from_attempts)
+    есть только у завершённой карточки - после правильного ответа или
+    исчерпанных попыток; такая карточка очищает data.
+    """
+    target_word = data.get("target_word")
+    translate_word = data.get("translate_word")
+
+    attempts = data.get("attempts", 0)
+
+    # Если пользователь ответил правильно
+    if user_response.strip().lower() == target_word.strip().lower():
+        data.clear()
+        return (f"✅ Правильно!\n{target_word} => {translate_word}!",
+                scheduler.quality_from_attempts(True, attempts))
+
+    # Если пользователь ответил неправильно
+    attempts += 1
+    data["attempts"] = attempts
+    if attempts < MAX_ATTEMPTS:
+        return (f"❌ Неправильно! Попробуй снова.\nПеревод слова: {translate_word}\n"
+                f"Попытка {attempts} из {MAX_ATTEMPTS}."), None
+
+    data.clear()
+    return (f"К сожалению, вы исчерпали попытки.\nПравильный перевод: {target_word}",
+            scheduler.quality_from_attempts(False, attempts))
+
+def stats_text(stats):
+    """Текст статистики ответов по /stats; stats - (ответов, правильных, попыток)."""
+    if not stats or not stats[0]:
+        return "Вы ещё не отвечали на карточки."
+    answers, correct, attempts = stats
+    return (f"Карточек пройдено: {answers}\n"
+            f"Правильных ответов: {correct} ({correct * 100 // answers}%)\n"
+            f"Попыток на карточку в среднем: {attempts / answers:.1f}")
+
+def check_import_document(document):
+    """Текст отказа, если файл нельзя импортировать, иначе None."""
+    if not (document.file_name or "").lower().endswith(IMPORT_EXTENSIONS):
+        return IMPORT_UNSUPPORTED_TEXT
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        return IMPORT_TOO_LARGE_TEXT
+    return None
+
+def import_reply(result):
+    """Ответ после импорта файла; result - результат handlers_db.import_words."""
+    if result is None:
+        return RESTART_TEXT
+    read, added, linked = result
+    if not read:
+        return IMPORT_FAILED_TEXT
+    return (f"Прочитано слов: {read}\n"
+            f"Добавлено в ваш словарь: {linked}\n"
+            f"Из них новых в общем словаре: {added}")
+
+def add_word_reply(status, target_word):
+    """Ответ на ввод слова для добавления.
+
+    Возвращает (текст, показать ли меню) или None, если слова нет в словаре
+    и нужно спросить перевод.
+    """
+    if status == RelationStatus.EXISTS:
+        return "Такое слово уже есть в вашем словаре.", True
+    if status == RelationStatus.ADDED:
+        return f"Слово добавлено '{target_word}' успешно добавлено.", False
+    if status == RelationStatus.UNKNOWN_USER:
+        return RESTART_TEXT, False
+    return None
+
+def did_you_mean_text(suggestions):
+    return "Возможно, вы имели в виду: " + ", ".join(suggestions) + "?"
+
+def suggestions_markup(suggestions):
+    """Клавиатура с похожими словами или None, если их нет."""
+    if not suggestions:
+        return None
+    markup = types.ReplyKeyboardMarkup(row_width=2)
+    markup.add(*[types.KeyboardButton(word) for word in suggestions])
+    return markup
+
+def ask_translation_text(target_word, suggestions=()):
+    """Просьба ввести перевод; с похожими словами из словаря - и предложение выбрать одно из них."""
+    if not suggestions:
+        return f"Теперь введите перевод для слова '{target_word}':"
+    return (f"Слова '{target_word}' ещё нет в словаре. {did_you_mean_text(suggestions)}\n"
+            f"Выберите слово на клавиатуре или введите перевод для '{target_word}':")
+
+def add_suggestion_reply(status, target_word):
+    """Ответ после выбора похожего слова вместо ввода перевода."""
+    reply = add_word_reply(status, target_word)
+    return reply[0] if reply else NO_WORD_TO_SAVE_TEXT
+
+def save_word_reply(status, target_word, translate_word):
+    """Ответ после сохранения нового слова с переводом."""
+    if status == RelationStatus.UNKNOWN_USER:
+        return RESTART_TEXT
+    if status == RelationStatus.UNKNOWN_WORD:
+        return SAVE_WORD_FAILED_TEXT
+    return f"Слово '{target_word}' и перевод '{translate_word}' успешно добавлены."
+
+def delete_word_reply(status, word_to_delete, suggestions=()):
+    """Ответ на удаление слова.
+
+    Возвращает (текст, сбросить ли состояние). Состояние сбрасывается,
+    только если слова нет в общем словаре и похожих слов в словаре
+    пользователя тоже нет.
+    """
+    if status == RelationStatus.DELETED:
+        return f"Слово '{word_to_delete}' успешно удалено.", False
+    if suggestions:
+        return f"Слово не найдено в вашем словаре. {did_you_mean_text(suggestions)}", False
+    if status == RelationStatus.NOT_IN_DICTIONARY:
+        return "Слово не найдено в вашем словаре.", False
+    return "Слово не найдено в вашем словаре.", True
@@ -0,0 +1,154 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Настройки кэша
+cache_ttl = float(os.getenv("CACHE_TTL", "300"))
+cache_max_users = int(os.getenv("CACHE_MAX_USERS", "100000"))
+cache_max_bytes = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+cache_max_vocabulary = int(os.getenv("CACHE_MAX_VOCABULARY", "20000"))
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с временем жизни записей.
+
+    Вытесняет самые давно использованные записи, когда число записей
+    превышает max_entries или их суммарный размер - max_bytes. Размер
+    записи передаётся при сохранении. Каждое invalidate увеличивает
+    поколение ключа, поэтому значение, прочитанное из базы до
+    инвалидации, не попадёт в кэш (см. generation и set).
+    """
+
+    def __init__(self, max_entries, max_bytes=None, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key: (value, size, expires_at)
+        self._data = OrderedDict()
+        self._generations = {}
+        # Растёт при очистке _generations, чтобы старые поколения стали недействительны
+        self._epoch = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, _, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, key):
+        """Номер поколения ключа; передаётся в set после чтения из базы."""
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def set(self, key, value, size=0, generation=None):
+        """Сохраняет значение, если ключ не инвалидировали после generation."""
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(key, 0)):
+                return False
+            if key in self._data:
+                self._remove(key)
+            expires_at = time.monotonic() + self.ttl if self.ttl else None
+            self._data[key] = (value, size, expires_at)
+            self.bytes += size
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self.bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._data)))
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            if len(self._generations) >= self.max_entries:
+                self._generations.clear()
+                self._epoch += 1
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._generations.clear()
+            self._epoch += 1
+            self._data.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+def vocabulary_size(words):
+    """Примерный объём словаря в памяти, байт."""
+    size = sys.getsizeof(words)
+    for pair in words:
+        size += sys.getsizeof(pair) + sum(sys.getsizeof(item) for item in pair)
+    return size
+
+# chat id -> users.id
+user_ids = LRUCache(max_entries=cache_max_users, ttl=cache_ttl)
+
+# users.id -> кортеж (target_word, translate_word) всех слов пользователя
+vocabularies = LRUCache(max_entries=cache_max_users, max_bytes=cache_max_bytes, ttl=cache_ttl)
+
+# Функции, которые вызываются при сбросе словаря: fn(user_id), fn(None) - сброс всех
+_invalidation_listeners = []
+
+def add_invalidation_listener(listener):
+    """Подписывает listener на сброс словарей (например, очередь карточек)."""
+    _invalidation_listeners.append(listener)
+
+def get_user_id(cid):
+    return user_ids.get(cid)
+
+def set_user_id(cid, user_id):
+    if user_id is not None:
+        user_ids.set(cid, user_id)
+
+def get_vocabulary(user_id):
+    return vocabularies.get(user_id)
+
+def vocabulary_generation(user_id):
+    return vocabularies.generation(user_id)
+
+def set_vocabulary(user_id, words, generation=None):
+    """Кэширует словарь пользователя, если он не больше cache_max_vocabulary."""
+    if len(words) > cache_max_vocabulary:
+        return False
+    words = tuple(words)
+    return vocabularies.set(user_id, words, vocabulary_size(words), generation)
+
+def invalidate_vocabulary(user_id):
+    """Сбрасывает словарь пользователя после изменения user_words."""
+    if user_id is not None:
+        vocabularies.invalidate(user_id)
+        for listener in _invalidation_listeners:
+            listener(user_id)
+
+def clear_vocabularies():
+    """Сбрасывает словари всех пользователей (например, после смены переводов)."""
+    vocabularies.clear()
+    for listener in _invalidation_listeners:
+        listener(None)
+
+def clear():
+    user_ids.clear()
+    clear_vocabularies()
@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import answer_buffer
+import cache_db
+from handlers_db import get_due_cards
+
+# Настройки очереди карточек
+card_prefetch_batch = int(os.getenv("CARD_PREFETCH_BATCH", "10"))
+card_prefetch_low = int(os.getenv("CARD_PREFETCH_LOW", "3"))
+card_prefetch_max_users = int(os.getenv("CARD_PREFETCH_MAX_USERS", "10000"))
+card_prefetch_workers = int(os.getenv("CARD_PREFETCH_WORKERS", "2"))
+# Не дольше кэша словарей: слово, удалённое через другой процесс, не
+# задерживается в очереди дольше, чем в кэше
+card_prefetch_ttl = float(os.getenv("CARD_PREFETCH_TTL", str(min(60.0, cache_db.cache_ttl))))
+
+logger = logging.getLogger(__name__)
+
+class CardPrefetcher:
+    """Очередь заранее выбранных карточек для каждого пользователя.
+
+    batch_size карточек (ближайшие к повторению слова и варианты ответа)
+    выбираются одним запросом. Когда в очереди остаётся меньше
+    low_watermark карточек, она пополняется в фоновом потоке, поэтому
+    следующая карточка обычно берётся из памяти. При изменении словаря
+    пользователя (сброс в cache_db) его очередь удаляется, а карточки
+    старше ttl секунд отбрасываются: словарь мог изменить другой процесс.
+
+    Пополнение выбирает ближайшие к повторению слова, кроме стоящих в
+    очереди, показанной сейчас карточки и слов, ответ или пропуск которых
+    ещё не записан (answer_buffer.ShownCards).
+    """
+
+    def __init__(self, batch_size=card_prefetch_batch, low_watermark=card_prefetch_low,
+                 max_users=card_prefetch_max_users, workers=card_prefetch_workers,
+                 ttl=card_prefetch_ttl):
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self.low_watermark = low_watermark
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        # users.id -> очередь (карточка, до какого времени её можно показать)
+        self._queues = OrderedDict()
+        self._refilling = set()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="card-prefetch")
+        cache_db.add_invalidation_listener(self.drop)
+
+    def get_card(self, cid, size=4):
+        """Возвращает следующую карточку пользователя (слова, данные повторения) или None."""
+        user_id = cache_db.get_user_id(cid)
+        if user_id is not None:
+            now = time.monotonic()
+            with self._lock:
+                queue = self._queues.get(user_id) or ()
+                # Карточки добавляются по времени, устаревшие - в начале
+                while queue and queue[0][1] < now:
+                    queue.popleft()
+                card = queue.popleft()[0] if queue else None
+                remaining = len(queue)
+            if card is not None:
+                answer_buffer.mark_shown(card[1])
+                if remaining < self.low_watermark:
+                    self._schedule_refill(cid, user_id, size)
+                return card
+
+        fetched = get_due_cards(cid, self.batch_size, size, self._excluded)
+        if fetched and not fetched[2] and answer_buffer.excluded_words(fetched[0]):
+            # Других слов нет: показанная карточка может повториться
+            fetched = get_due_cards(cid, self.batch_size, size,
+                                    lambda user_id: self._excluded(user_id, current=False))
+        if not fetched or not fetched[2]:
+            return None
+        user_id, generation, cards = fetched
+        answer_buffer.mark_shown(cards[0][1])
+        self._store(user_id, generation, cards[1:])
+        return cards[0]
+
+    def drop(self, user_id=None):
+        """Удаляет очередь пользователя (или все очереди, если user_id не задан)."""
+        with self._lock:
+            if user_id is None:
+                self._queues.clear()
+            else:
+                self._queues.pop(user_id, None)
+
+    def _schedule_refill(self, cid, user_id, size):
+        with self._lock:
+            if user_id in self._refilling:
+                return
+            self._refilling.add(user_id)
+        self._executor.submit(self._refill, cid, user_id, size)
+
+    def _refill(self, cid, user_id, size):
+        try:
+            fetched = get_due_cards(cid, self.batch_size, size, self._excluded)
+            if fetched:
+                self._store(*fetched)
+        except Exception as e:
+            logger.error("Ошибка при подготовке карточек: %s", e)
+        finally:
+            with self._lock:
+                self._refilling.discard(user_id)
+
+    def _excluded(self, user_id, current=True):
+        """Слова, которые не нужно выбирать: в очереди и ждущие записи ответа (и показанное)."""
+        excluded = answer_buffer.excluded_words(user_id, current)
+        with self._lock:
+            excluded.update(card[1]["user_word_id"] for card, _ in self._queues.get(user_id, ()))
+        return excluded
+
+    def _store(self, user_id, generation, cards):
+        # Пока выбирались карточки, часть слов могла быть показана
+        served = answer_buffer.excluded_words(user_id)
+        with self._lock:
+            # Словарь изменился, пока выбирались карточки
+            if cache_db.vocabulary_generation(user_id) != generation:
+                return
+            queue = self._queues.setdefault(user_id, deque())
+            skip = served | {card[1]["user_word_id"] for card, _ in queue}
+            expires_at = time.monotonic() + self.ttl
+            queue.extend((card, expires_at) for card in cards if card[1]["user_word_id"] not in skip)
+            self._queues.move_to_end(user_id)
+            while len(self._queues) > self.max_users:
+                self._queues.popitem(last=False)
+
+prefetcher = CardPrefetcher()
+
+def get_card(cid, size=4):
+    """Следующая карточка из очереди пользователя (см. CardPrefetcher.get_card)."""
+    return prefetcher.get_card(cid, size)
@@ -1,8 +1,16 @@
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 from dotenv import load_dotenv
 
+import metrics
+
 # Загрузка переменных из .env
 load_dotenv()
 
@@ -13,13 +21,258 @@ db_password = os.getenv("DB_PASSWORD")
 db_host = os.getenv("DB_HOST")
 db_port = os.getenv("DB_PORT")
 
-def get_db_connection():
-    """Функция для создания подключения к базе данных."""
-    conn = psycopg2.connect(
+# Настройки пула соединений
+pool_min_size = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+pool_max_size = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+pool_max_lifetime = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+pool_max_idle = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+pool_check_interval = float(os.getenv("DB_POOL_CHECK_INTERVAL", "30"))
+
+# Число запросов, выполненных через соединения create_connection
+_query_count = 0
+_query_count_lock = threading.Lock()
+
+def query_count():
+    """Сколько запросов выполнено с запуска процесса (для бенчмарков)."""
+    return _query_count
+
+def _count_query():
+    global _query_count
+    with _query_count_lock:
+        _query_count += 1
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Курсор, который считает выполненные запросы (query_count) и их время (metrics)."""
+
+    def execute(self, query, vars=None):
+        _count_query()
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            metrics.observe_query(time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        _count_query()
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            metrics.observe_query(time.perf_counter() - start)
+
+    def copy_expert(self, sql, file, size=8192):
+        _count_query()
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            metrics.observe_query(time.perf_counter() - start)
+
+_pool_wait_seconds = metrics.histogram("db_pool_wait_seconds", "Ожидание свободного соединения пула")
+_pool_timeouts = metrics.counter("db_pool_timeouts_total", "Свободное соединение пула не появилось вовремя")
+
+class PoolTimeoutError(psycopg2.pool.PoolError):
+    """Свободное соединение не появилось за отведённое время."""
+
+def create_connection():
+    """Открывает новое соединение с базой данных."""
+    return psycopg2.connect(
         dbname=db_name,
         user=db_user,
         password=db_password,
         host=db_host,
-        port=db_port
+        port=db_port,
+        cursor_factory=CountingCursor
     )
-    return conn
\ No newline at end of file
+
+class ConnectionPool:
+    """Ограниченный потокобезопасный пул соединений.
+
+    Не держит больше max_size соединений одновременно: если все заняты,
+    поток ждёт освобождения не дольше timeout секунд. При выдаче соединение
+    проверяется: закрытые и слишком старые соединения пересоздаются, а
+    простаивавшие дольше check_interval проверяются запросом SELECT 1.
+    """
+
+    def __init__(self, min_size=pool_min_size, max_size=pool_max_size,
+                 timeout=pool_timeout, max_lifetime=pool_max_lifetime,
+                 max_idle=pool_max_idle, check_interval=pool_check_interval,
+                 connect=create_connection):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Некорректные размеры пула соединений")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        # Свободные соединения: (conn, время создания, время возврата в пул)
+        self._idle = deque()
+        self._created = {}
+        self._closed = False
+
+        for _ in range(min_size):
+            self._idle.append(self._open())
+
+    @property
+    def size(self):
+        """Количество открытых соединений (свободных и выданных)."""
+        with self._lock:
+            return len(self._created)
+
+    @property
+    def idle(self):
+        """Количество свободных соединений."""
+        with self._lock:
+            return len(self._idle)
+
+    def _open(self):
+        conn = self._connect()
+        now = time.monotonic()
+        with self._lock:
+            self._created[id(conn)] = now
+        return conn, now, now
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_healthy(self, conn, created_at, returned_at):
+        """Проверяет соединение перед выдачей."""
+        now = time.monotonic()
+        if conn.closed:
+            return False
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            return False
+        if self.max_idle and now - returned_at > self.max_idle:
+            return False
+        if now - returned_at > self.check_interval:
+            try:
+                # Обычный курсор: проверка пула не входит в число запросов бота
+                with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def getconn(self):
+        """Выдаёт соединение из пула, при необходимости открывая новое."""
+        if self._closed:
+            raise psycopg2.pool.PoolError("Пул соединений закрыт")
+        start = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.timeout)
+        _pool_wait_seconds.observe(time.perf_counter() - start)
+        if not acquired:
+            _pool_timeouts.inc()
+            raise PoolTimeoutError("Нет свободных соединений с базой данных")
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    conn, _, _ = self._open()
+                    return conn
+                if self._is_healthy(*entry):
+                    return entry[0]
+                self._discard(entry[0])
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        """Возвращает соединение в пул."""
+        try:
+            if not close and not conn.closed:
+                # Соединение не должно вернуться в пул посреди транзакции
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+            with self._lock:
+                created_at = self._created.get(id(conn))
+                keep = (not close and not self._closed and not conn.closed
+                        and created_at is not None)
+                if keep:
+                    self._idle.append((conn, created_at, time.monotonic()))
+            if not keep:
+                self._discard(conn)
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт соединение на время блока with.
+
+        При успешном выходе транзакция фиксируется, при исключении -
+        откатывается, после чего соединение возвращается в пул.
+        """
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken or conn.closed)
+
+    def closeall(self):
+        """Закрывает все свободные соединения и запрещает выдачу новых."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Возвращает общий пул соединений, создавая его при первом обращении."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def _pool_connections():
+    pool = _pool
+    if pool is None:
+        return {}
+    # Одним захватом блокировки, чтобы занятых не получилось меньше нуля
+    with pool._lock:
+        size, idle = len(pool._created), len(pool._idle)
+    return {("idle",): idle, ("busy",): size - idle}
+
+metrics.gauge("db_pool_connections", "Открытые соединения пула", _pool_connections, ("state",))
+metrics.gauge("db_pool_max_connections", "Наибольший размер пула", lambda: pool_max_size)
+
+def close_pool():
+    """Закрывает общий пул соединений."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+def get_db_connection():
+    """Функция для получения подключения к базе данных из пула.
+
+    Используется как контекстный менеджер: по выходу из блока with
+    соединение возвращается в пул.
+    """
+    return get_pool().connection()
@@ -1,43 +1,291 @@
+import io
+import logging
+import os
+import random
+import threading
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2.errors
+
+import cache_db
+import metrics
+import scheduler
 from connection_db import get_db_connection
 
+logger = logging.getLogger(__name__)
+
+# Размер пачки слов при отложенной записи пользователя в словарь
+enrollment_batch_size = int(os.getenv("ENROLLMENT_BATCH_SIZE", "5000"))
+
+# Фоновые потоки для отложенной записи пользователей в словарь
+_enrollment_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ENROLLMENT_WORKERS", "2")),
+    thread_name_prefix="enrollment"
+)
+# Пользователи, которых фоновый поток этого процесса уже записывает в словарь
+_enrolling = set()
+_enrolling_lock = threading.Lock()
+
+# Индекс вариантов ответа: сколько похожих слов хранить для каждого слова
+# и сколько соседей по алфавиту с каждой стороны сравнивать с ним
+distractor_count = int(os.getenv("DISTRACTOR_COUNT", "8"))
+distractor_window = int(os.getenv("DISTRACTOR_WINDOW", "20"))
+
+# Подсказки "возможно, вы имели в виду": сколько слов предлагать и
+# минимальное сходство по триграммам (pg_trgm), от 0 до 1
+fuzzy_suggestions = int(os.getenv("FUZZY_SUGGESTIONS", "3"))
+fuzzy_threshold = float(os.getenv("FUZZY_THRESHOLD", "0.3"))
+
+# Фоновое построение индекса вариантов ответа после импорта слов
+_distractor_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="distractors")
+
+# Индексы поиска; {concurrently} позволяет строить их без блокировки записи
+LOOKUP_INDEXES = {
+    "idx_words_lower_target_word": """
+        CREATE INDEX {concurrently} IF NOT EXISTS idx_words_lower_target_word
+        ON words (LOWER(target_word));
+    """,
+    # Нечёткий поиск похожих слов (оператор % из pg_trgm)
+    "idx_words_lower_target_word_trgm": """
+        CREATE INDEX {concurrently} IF NOT EXISTS idx_words_lower_target_word_trgm
+        ON words USING GIN (LOWER(target_word) gin_trgm_ops);
+    """,
+}
+
+# Версия схемы базы. Увеличивается при каждом изменении create_schema:
+# бот не создаёт таблицы сам и не запускается, пока migrate.py не
+# обновил базу до этой версии.
+SCHEMA_VERSION = 2
+
+# Ключ рекомендательной блокировки PostgreSQL, под которой работает migrate.py
+MIGRATION_LOCK_ID = 4_207_001
+
+class SchemaVersionError(RuntimeError):
+    """Схема базы старее, чем нужно этой версии бота."""
+
+def create_schema(cur):
+    """Создаёт таблицы, индексы и триггеры в текущей схеме."""
+    # Создаем таблицу пользователей
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT UNIQUE NOT NULL,
+        user_name VARCHAR(255) UNIQUE NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+    # Создаем словарь
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS words (
+        id SERIAL PRIMARY KEY,
+        target_word VARCHAR(255) NOT NULL,
+        translate_word VARCHAR(255) NOT NULL,
+        CONSTRAINT unique_target_word UNIQUE (target_word)
+        );
+    """)
+
+    # Создаем таблицу связей
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_words (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users (id),
+        word_id BIGINT NOT NULL REFERENCES words (id),
+        CONSTRAINT unique_user_word UNIQUE (user_id, word_id)
+        );
+    """)
+
+    # Индексы для поиска слова без учёта регистра (LOWER(target_word) = LOWER(%s))
+    # и похожих слов. Отдельный индекс по user_words(user_id) не нужен: его роль
+    # выполняют unique_user_word (user_id, word_id) и unique_user_word_ordinal (user_id, ordinal)
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    for query in LOOKUP_INDEXES.values():
+        cur.execute(query.format(concurrently=""))
+
+    # Интервальные повторения (scheduler): лёгкость, интервал в днях, число
+    # правильных ответов подряд и время следующего повторения
+    cur.execute("""
+        ALTER TABLE user_words
+        ADD COLUMN IF NOT EXISTS ease REAL NOT NULL DEFAULT 2.5,
+        ADD COLUMN IF NOT EXISTS interval_days REAL NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS streak INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS due_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+        CREATE INDEX IF NOT EXISTS idx_user_words_due ON user_words (user_id, due_at);
+    """)
+
+    # Похожие слова - неправильные варианты ответа для карточек
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS word_distractors (
+        word_id BIGINT NOT NULL REFERENCES words (id) ON DELETE CASCADE,
+        distractor_id BIGINT NOT NULL REFERENCES words (id) ON DELETE CASCADE,
+        score REAL NOT NULL,
+        PRIMARY KEY (word_id, distractor_id)
+        );
+    """)
+
+    # file_id файлов, уже загруженных ботом в Telegram (см. media_cache)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS bot_media (
+        bot_id BIGINT NOT NULL,
+        name TEXT NOT NULL,
+        digest TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        PRIMARY KEY (bot_id, name, digest)
+        );
+    """)
+
+    # Состояния диалогов для state_storage.StatePostgresStorage
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS bot_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data JSONB NOT NULL DEFAULT '{}',
+        expires_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_bot_states_expires_at ON bot_states (expires_at);
+    """)
+
+    # Журнал ответов на карточки (пишется пачками, см. answer_buffer)
+    # и счётчики ответов пользователя, которые обновляются вместе с ним
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS answers (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        user_word_id BIGINT NOT NULL,
+        correct BOOLEAN NOT NULL,
+        attempts SMALLINT NOT NULL,
+        quality SMALLINT NOT NULL,
+        answered_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_answers_user_answered_at ON answers (user_id, answered_at);
+
+        CREATE TABLE IF NOT EXISTS user_stats (
+        user_id BIGINT PRIMARY KEY REFERENCES users (id),
+        answers INTEGER NOT NULL DEFAULT 0,
+        correct INTEGER NOT NULL DEFAULT 0,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_answer_at TIMESTAMPTZ
+        );
+    """)
+
+    # Отметка о том, что пользователь уже связан со всеми словами словаря
+    cur.execute("""
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS enrolled_at TIMESTAMP;
+    """)
+
+    # Плотный порядковый номер слова в словаре пользователя (1..N)
+    # для случайной выборки без сортировки всего словаря
+    cur.execute("""
+        ALTER TABLE user_words ADD COLUMN IF NOT EXISTS ordinal INTEGER;
+    """)
+    cur.execute("""
+        UPDATE user_words
+        SET ordinal = numbered.ordinal
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id) AS ordinal
+            FROM user_words
+        ) AS numbered
+        WHERE user_words.id = numbered.id AND user_words.ordinal IS NULL;
+    """)
+    cur.execute("""
+        ALTER TABLE user_words ALTER COLUMN ordinal SET NOT NULL;
+        CREATE UNIQUE INDEX IF NOT EXISTS unique_user_word_ordinal
+        ON user_words (user_id, ordinal);
+    """)
+
+    # Новое слово получает следующий номер, строка пользователя
+    # блокируется, чтобы параллельные вставки не выдали один номер.
+    # FOR NO KEY UPDATE не конфликтует с блокировками FOR KEY SHARE, которые
+    # берут внешние ключи на users, поэтому вставки в другие таблицы со
+    # ссылкой на пользователя (например, user_stats) не ждут триггер
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION user_words_assign_ordinal() RETURNS trigger AS $$
+        BEGIN
+            PERFORM 1 FROM users WHERE id = NEW.user_id FOR NO KEY UPDATE;
+            SELECT COALESCE(MAX(ordinal), 0) + 1 INTO NEW.ordinal
+            FROM user_words WHERE user_id = NEW.user_id;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS user_words_assign_ordinal ON user_words;
+        CREATE TRIGGER user_words_assign_ordinal
+        BEFORE INSERT ON user_words
+        FOR EACH ROW EXECUTE FUNCTION user_words_assign_ordinal();
+    """)
+
+    # При удалении последнее по номеру слово занимает место удалённого,
+    # поэтому номера остаются непрерывными
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION user_words_compact_ordinal() RETURNS trigger AS $$
+        BEGIN
+            PERFORM 1 FROM users WHERE id = OLD.user_id FOR NO KEY UPDATE;
+            UPDATE user_words SET ordinal = OLD.ordinal
+            WHERE user_id = OLD.user_id
+              AND ordinal > OLD.ordinal
+              AND ordinal = (SELECT MAX(ordinal) FROM user_words WHERE user_id = OLD.user_id);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS user_words_compact_ordinal ON user_words;
+        CREATE TRIGGER user_words_compact_ordinal
+        AFTER DELETE ON user_words
+        FOR EACH ROW EXECUTE FUNCTION user_words_compact_ordinal();
+    """)
+
+    # Применённые версии схемы (migrate.py, SCHEMA_VERSION)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+
 def initialize_db():
-    """Создаёт таблицы в базе данных."""
+    """Создаёт таблицы в базе данных (вызывается из migrate.py)."""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Создаем таблицу пользователей
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT UNIQUE NOT NULL,
-                user_name VARCHAR(255) UNIQUE NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            """)
+            create_schema(cur)
+            conn.commit()
 
-            # Создаем словарь
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS words (
-                id SERIAL PRIMARY KEY,
-                target_word VARCHAR(255) NOT NULL,
-                translate_word VARCHAR(255) NOT NULL,
-                CONSTRAINT unique_target_word UNIQUE (target_word)
-                );
-            """)
+def schema_version(conn):
+    """Версия схемы базы; 0, если migrate.py ещё не выполняли."""
+    with conn.cursor() as cur:
+        try:
+            cur.execute("SELECT MAX(version) FROM schema_version")
+            return cur.fetchone()[0] or 0
+        except psycopg2.errors.UndefinedTable:
+            conn.rollback()
+            return 0
 
-            # Создаем таблицу связей
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_words (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT NOT NULL REFERENCES users (id),
-                word_id BIGINT NOT NULL REFERENCES words (id),
-                CONSTRAINT unique_user_word UNIQUE (user_id, word_id)
-                );
-            """)
+def save_schema_version(conn, version=SCHEMA_VERSION):
+    """Отмечает, что база обновлена до версии version."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO schema_version (version) VALUES (%s)
+            ON CONFLICT (version) DO NOTHING
+        """, (version,))
+    conn.commit()
 
-            conn.commit()
+def check_schema_version():
+    """Проверяет одним запросом, что база обновлена до SCHEMA_VERSION.
+
+    Вызывается при запуске бота вместо создания таблиц; при устаревшей
+    схеме бросает SchemaVersionError. Более новая схема допускается:
+    migrate.py следующей версии выполняют до перезапуска ботов.
+    """
+    with get_db_connection() as conn:
+        version = schema_version(conn)
+    if version < SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"Схема базы версии {version}, нужна {SCHEMA_VERSION}: выполните python migrate.py"
+        )
+    return version
 
 def fill_common_words_table():
-    """Заполняет словарь."""
+    """Заполняет общий словарь (вызывается из migrate.py)."""
     common_words = [
         ("Peace", "Мир"), ("Green", "Зелёный"), ("White", "Белый"),
         ("Hello", "Привет"), ("Car", "Машина"), ("Sky", "Небо"),
@@ -45,211 +293,787 @@ def fill_common_words_table():
         ("Friend", "Друг")
     ]
 
-    query = """
-        INSERT INTO words (target_word, translate_word)
-        VALUES (%s, %s)
-        ON CONFLICT (target_word)
-        DO UPDATE SET translate_word = EXCLUDED.translate_word;
+    import_words(common_words, update_translations=True)
+
+def normalize_word(word):
+    """Приводит слово или перевод к виду, в котором оно хранится в words."""
+    return word.strip().capitalize()
+
+def _copy_escape(value):
+    return (value.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+class _CopyStream:
+    """Файлоподобный объект для COPY ... FROM STDIN.
+
+    Читает пары слов из итератора по мере того, как их запрашивает COPY,
+    поэтому список любого размера не загружается в память целиком.
     """
 
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.executemany(query, common_words)
-            conn.commit()
+    def __init__(self, pairs):
+        self._pairs = iter(pairs)
+        self._rest = ""
+        self.count = 0
+
+    def read(self, size=-1):
+        chunks, length = [self._rest], len(self._rest)
+        while size < 0 or length < size:
+            pair = next(self._pairs, None)
+            if pair is None:
+                break
+            line = f"{_copy_escape(pair[0])}\t{_copy_escape(pair[1])}\n"
+            chunks.append(line)
+            length += len(line)
+            self.count += 1
+        data = "".join(chunks)
+        if size < 0:
+            self._rest = ""
+            return data
+        self._rest = data[size:]
+        return data[:size]
+
+def import_words(pairs, cid=None, update_translations=False):
+    """Загружает пары (слово, перевод) в словарь одной транзакцией.
+
+    Пары читаются лениво и копируются через COPY во временную таблицу,
+    затем добавляются в words одним запросом (нормализация - как в
+    add_word_for_user, из повторов остаётся первый). Существующие слова
+    сохраняют перевод, если не задан update_translations. С cid слова ещё
+    и добавляются в словарь пользователя.
+
+    Возвращает (прочитано пар, новых слов, добавлено в словарь
+    пользователя) или None, если пользователя с cid нет.
+    """
+    stream = _CopyStream((normalize_word(target), normalize_word(translate))
+                         for target, translate in pairs)
+    on_conflict = ("DO UPDATE SET translate_word = EXCLUDED.translate_word"
+                   if update_translations else "DO NOTHING")
 
-def ensure_user_exists(cid, username):
-    """Проверяет, существует ли пользователь, если нет - создает его и
-    связывает со всеми словами."""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Проверяем, есть ли пользователь
-            cur.execute("SELECT id FROM users WHERE user_id = %s", (cid,))
-            result = cur.fetchone()
-            if result:
+            user_id = None
+            if cid is not None:
+                cur.execute("SELECT id FROM users WHERE user_id = %s", (cid,))
+                result = cur.fetchone()
+                if not result:
+                    return None
                 user_id = result[0]
-            else:
-                # Создаем нового пользователя
-                cur.execute(
-                    "INSERT INTO users (user_id, user_name) VALUES (%s, %s) RETURNING id",
-                    (cid, username)
+
+            cur.execute("""
+                CREATE TEMP TABLE import_words (target_word TEXT, translate_word TEXT) ON COMMIT DROP
+            """)
+            cur.copy_expert("COPY import_words FROM STDIN", stream)
+            cur.execute("ANALYZE import_words")
+
+            cur.execute(f"""
+                WITH unique_words AS (
+                    SELECT DISTINCT ON (target_word) target_word, translate_word
+                    FROM import_words
+                    WHERE target_word <> '' AND translate_word <> ''
+                    ORDER BY target_word, ctid
+                ), upserted AS (
+                    INSERT INTO words (target_word, translate_word)
+                    SELECT target_word, translate_word FROM unique_words
+                    ON CONFLICT (target_word) {on_conflict}
+                    RETURNING id, xmax = 0 AS inserted
                 )
-                user_id = cur.fetchone()[0]
+                SELECT COUNT(*) FILTER (WHERE inserted), MIN(id) FILTER (WHERE inserted) FROM upserted
+            """)
+            added, first_added_id = cur.fetchone()
+
+            linked = 0
+            if user_id is not None:
+                cur.execute("""
+                    WITH linked AS (
+                        INSERT INTO user_words (user_id, word_id)
+                        SELECT %s, words.id
+                        FROM (SELECT DISTINCT target_word FROM import_words) AS imported
+                        JOIN words ON words.target_word = imported.target_word
+                        ON CONFLICT DO NOTHING
+                        RETURNING 1
+                    )
+                    SELECT COUNT(*) FROM linked
+                """, (user_id,))
+                linked = cur.fetchone()[0]
+            conn.commit()
+
+    if added:
+        # Новые слова попадают в индекс вариантов ответа в фоне
+        schedule_distractor_indexing(first_added_id - 1)
+    if update_translations:
+        # Переводы могли измениться
+        cache_db.clear_vocabularies()
+    elif linked:
+        cache_db.set_user_id(cid, user_id)
+        cache_db.invalidate_vocabulary(user_id)
+    return stream.count, added, linked
+
+def _edit_distance(a, b):
+    """Расстояние Левенштейна между строками."""
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
 
-            # Получаем все id слов из таблицы words
-            cur.execute("SELECT id FROM words")
-            all_word_ids = cur.fetchall()
+def distractor_score(word, candidate):
+    """Насколько candidate похож на word: чем меньше, тем труднее их перепутать не глядя.
 
-            # Связываем пользователя со всеми словами
-            for (word_id,) in all_word_ids:
+    Расстояние Левенштейна без учёта регистра, уменьшенное на половину
+    длины общего начала слов.
+    """
+    word, candidate = word.lower(), candidate.lower()
+    prefix = len(os.path.commonprefix([word, candidate]))
+    return _edit_distance(word, candidate) - prefix / 2
+
+def _index_distractors(cur, words):
+    """Добавляет в индекс вариантов ответа слова words [(id, target_word)].
+
+    Кандидаты - соседи слова по алфавиту (индекс idx_words_lower_target_word),
+    из них остаются distractor_count самых похожих. Связь симметрична:
+    слово становится вариантом и для своих соседей, если похоже на них
+    больше, чем их худший вариант.
+    """
+    if not words:
+        return
+
+    cur.execute("""
+        SELECT source.id, neighbour.id, neighbour.target_word
+        FROM unnest(%s::BIGINT[], %s::TEXT[]) AS source(id, target_word)
+        CROSS JOIN LATERAL (
+            (SELECT id, target_word FROM words
+             WHERE LOWER(target_word) < LOWER(source.target_word)
+             ORDER BY LOWER(target_word) DESC
+             LIMIT %s)
+            UNION ALL
+            (SELECT id, target_word FROM words
+             WHERE LOWER(target_word) > LOWER(source.target_word)
+             ORDER BY LOWER(target_word)
+             LIMIT %s)
+        ) AS neighbour
+    """, ([word_id for word_id, _ in words], [target_word for _, target_word in words],
+          distractor_window, distractor_window))
+    neighbours = defaultdict(list)
+    for word_id, neighbour_id, neighbour_word in cur.fetchall():
+        neighbours[word_id].append((neighbour_id, neighbour_word))
+
+    scores = {}
+    for word_id, target_word in words:
+        ranked = sorted((distractor_score(target_word, neighbour_word), neighbour_id)
+                        for neighbour_id, neighbour_word in neighbours[word_id])
+        for score, neighbour_id in ranked[:distractor_count]:
+            scores[word_id, neighbour_id] = score
+            scores[neighbour_id, word_id] = score
+    if not scores:
+        return
+
+    # Один порядок строк во всех транзакциях, чтобы параллельные вставки не ждали друг друга по кругу
+    pairs = sorted(scores)
+    cur.execute("""
+        INSERT INTO word_distractors (word_id, distractor_id, score)
+        SELECT * FROM unnest(%s::BIGINT[], %s::BIGINT[], %s::REAL[])
+        ON CONFLICT (word_id, distractor_id) DO UPDATE SET score = EXCLUDED.score;
+
+        DELETE FROM word_distractors
+        USING (
+            SELECT word_id, distractor_id,
+                   ROW_NUMBER() OVER (PARTITION BY word_id ORDER BY score, distractor_id) AS rank
+            FROM word_distractors
+            WHERE word_id = ANY(%s::BIGINT[])
+        ) AS ranked
+        WHERE word_distractors.word_id = ranked.word_id
+          AND word_distractors.distractor_id = ranked.distractor_id
+          AND ranked.rank > %s;
+    """, ([word_id for word_id, _ in pairs], [distractor_id for _, distractor_id in pairs],
+          [scores[pair] for pair in pairs], list({word_id for word_id, _ in pairs}), distractor_count))
+
+def index_distractors(after_word_id=0, batch_size=1000):
+    """Добавляет в индекс вариантов ответа слова с id больше after_word_id,
+    у которых вариантов ещё нет.
+
+    Слова обрабатываются пачками, каждая - отдельной транзакцией.
+    Возвращает число обработанных слов.
+    """
+    done = 0
+    while True:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
                 cur.execute("""
-                    INSERT INTO user_words (user_id, word_id)
-                    VALUES (%s, %s)
-                    ON CONFLICT DO NOTHING
-                """, (user_id, word_id))
+                    SELECT id, target_word FROM words
+                    WHERE id > %s AND NOT EXISTS (
+                        SELECT 1 FROM word_distractors WHERE word_distractors.word_id = words.id
+                    )
+                    ORDER BY id
+                    LIMIT %s
+                """, (after_word_id, batch_size))
+                words = cur.fetchall()
+                if not words:
+                    return done
+                _index_distractors(cur, words)
+                conn.commit()
+        done += len(words)
+        after_word_id = words[-1][0]
 
-            conn.commit()
+def schedule_distractor_indexing(after_word_id=0):
+    """Запускает index_distractors в фоновом потоке."""
+    def run():
+        try:
+            index_distractors(after_word_id)
+        except Exception as e:
+            logger.error("Ошибка при построении индекса вариантов ответа: %s", e)
+    _distractor_executor.submit(run)
 
-def get_random_words(cid, limit=4):
-    """Получает случайные слова из словаря."""
-    query = """
-        SELECT target_word, translate_word
-        FROM words
-        JOIN user_words ON words.id = user_words.word_id
-        JOIN users ON users.id = user_words.user_id
-        WHERE users.user_id = %s
-        ORDER BY RANDOM()
-        LIMIT %s;
+def _enroll_batch(cur, user_id, after_word_id, batch_size):
+    """Связывает пользователя с очередной пачкой слов по порядку id.
+
+    Возвращает id последнего слова пачки или None, если слова закончились.
     """
+    cur.execute("""
+        WITH batch AS (
+            SELECT id FROM words
+            WHERE id > %s
+            ORDER BY id
+            LIMIT %s
+        ), linked AS (
+            INSERT INTO user_words (user_id, word_id)
+            SELECT %s, id FROM batch
+            ON CONFLICT DO NOTHING
+        )
+        SELECT MAX(id) FROM batch
+    """, (after_word_id, batch_size, user_id))
+    return cur.fetchone()[0]
+
+def _enroll(conn, cur, user_id, after_word_id=0, batch_size=None):
+    """Связывает пользователя со всеми словами и отмечает его записанным."""
+    if batch_size is None:
+        cur.execute("""
+            INSERT INTO user_words (user_id, word_id)
+            SELECT %s, id FROM words
+            ON CONFLICT DO NOTHING
+        """, (user_id,))
+    else:
+        # Каждая пачка - отдельная транзакция, чтобы не держать блокировки
+        while after_word_id is not None:
+            after_word_id = _enroll_batch(cur, user_id, after_word_id, batch_size)
+            conn.commit()
+            cache_db.invalidate_vocabulary(user_id)
+
+    cur.execute("UPDATE users SET enrolled_at = CURRENT_TIMESTAMP WHERE id = %s", (user_id,))
+    conn.commit()
+    cache_db.invalidate_vocabulary(user_id)
+
+def enroll_user(user_id, after_word_id=0, batch_size=None):
+    """Связывает пользователя со всеми словами словаря.
 
+    Без batch_size выполняется одним INSERT ... SELECT, иначе пачками по
+    batch_size слов, начиная со слов с id больше after_word_id.
+    """
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(query, (cid, limit))
-            return cur.fetchall()
+            _enroll(conn, cur, user_id, after_word_id, batch_size)
+
+def ensure_user_exists(cid, username, defer_enrollment=False):
+    """Проверяет, существует ли пользователь, если нет - создает его и
+    связывает со всеми словами.
 
-def get_word_id(target_word):
-    """Проверяет, есть - ли слово в словаре"""
+    Уже записанные пользователи пропускаются одним запросом. При
+    defer_enrollment синхронно связывается только первая пачка слов (её
+    хватает для первых карточек), остальные - в фоновом потоке. Пока
+    запись идёт, повторные вызовы (например, несколько /start подряд)
+    её не запускают заново.
+    Возвращает id пользователя в таблице users.
+    """
     with get_db_connection() as conn:
         with conn.cursor() as cur:
+            # Находим пользователя или создаем нового
             cur.execute("""
-                SELECT id FROM words
-                WHERE LOWER(target_word) = LOWER(%s)
-            """, (target_word.strip(),))
+                WITH existing AS (
+                    SELECT id, enrolled_at FROM users WHERE user_id = %s
+                ), created AS (
+                    INSERT INTO users (user_id, user_name)
+                    SELECT %s, %s
+                    WHERE NOT EXISTS (SELECT 1 FROM existing)
+                    ON CONFLICT (user_id) DO NOTHING
+                    RETURNING id, enrolled_at
+                )
+                SELECT id, enrolled_at IS NOT NULL FROM existing
+                UNION ALL
+                SELECT id, enrolled_at IS NOT NULL FROM created
+            """, (cid, cid, username))
             result = cur.fetchone()
-            if result:
-                return result[0]
-            else:
-                return None
+            if not result:
+                # Пользователя параллельно создал другой запрос
+                cur.execute("SELECT id, enrolled_at IS NOT NULL FROM users WHERE user_id = %s", (cid,))
+                result = cur.fetchone()
+            user_id, enrolled = result
+            conn.commit()
+            cache_db.set_user_id(cid, user_id)
+
+            if enrolled:
+                return user_id
+
+            if not defer_enrollment:
+                _enroll(conn, cur, user_id)
+                return user_id
+
+            with _enrolling_lock:
+                if user_id in _enrolling:
+                    # Первая пачка уже связана, остальные добавляет фоновый поток
+                    return user_id
+
+            last_word_id = _enroll_batch(cur, user_id, 0, enrollment_batch_size)
+            conn.commit()
+            cache_db.invalidate_vocabulary(user_id)
+
+    with _enrolling_lock:
+        if user_id in _enrolling:
+            return user_id
+        _enrolling.add(user_id)
+    if last_word_id is None:
+        _finish_enrollment(user_id, None)
+    else:
+        _enrollment_executor.submit(_finish_enrollment, user_id, last_word_id)
+    return user_id
+
+def _finish_enrollment(user_id, after_word_id):
+    """Связывает пользователя с оставшимися словами и снимает отметку _enrolling."""
+    try:
+        enroll_user(user_id, after_word_id or 0, enrollment_batch_size)
+    finally:
+        with _enrolling_lock:
+            _enrolling.discard(user_id)
+
+def _dictionary_size(cur, cid):
+    """Возвращает (id пользователя, число слов в его словаре) или None."""
+    cur.execute("""
+        SELECT id, (
+            SELECT COALESCE(MAX(ordinal), 0) FROM user_words
+            WHERE user_words.user_id = users.id
+        )
+        FROM users
+        WHERE user_id = %s
+    """, (cid,))
+    return cur.fetchone()
+
+def _draw_by_ordinal(cur, user_id, total, limit):
+    """Читает limit слов пользователя со случайными порядковыми номерами."""
+    ordinals = random.sample(range(1, total + 1), min(limit, total))
+    cur.execute("""
+        SELECT target_word, translate_word
+        FROM user_words
+        JOIN words ON words.id = user_words.word_id
+        WHERE user_words.user_id = %s AND user_words.ordinal = ANY(%s)
+    """, (user_id, ordinals))
+    words = cur.fetchall()
+    random.shuffle(words)
+    return words
+
+def draw_random_words(cur, cid, limit=4):
+    """Выбирает limit различных случайных слов пользователя.
+
+    Вместо сортировки всего словаря (ORDER BY RANDOM()) берёт размер словаря
+    по индексу (user_id, ordinal), выбирает случайные порядковые номера и
+    читает только эти строки.
+    """
+    result = _dictionary_size(cur, cid)
+    if not result or not result[1]:
+        return []
+    user_id, total = result
+    return _draw_by_ordinal(cur, user_id, total, limit)
+
+def get_due_cards(cid, count, size=4, exclude=None):
+    """Выбирает count карточек: слово к повторению и size - 1 случайных вариантов.
+
+    Загадываемые слова берутся из очереди повторений по индексу
+    (user_id, due_at): сначала те, что раньше всех нужно повторить.
+    exclude(user_id) возвращает id слов (user_words.id), которые не нужно
+    загадывать: показанную карточку, слова с незаписанными ответами и
+    стоящие в очереди карточек - их немного, список передаётся в запрос.
+    Варианты - похожие слова из индекса word_distractors; если их не
+    хватает, добавляются случайные слова из словаря пользователя в
+    cache_db (при промахе словарь читается и кэшируется) или, для словарей
+    больше cache_max_vocabulary, по порядковым номерам в том же запросе.
+
+    Возвращает (id пользователя, поколение словаря в cache_db, карточки) или
+    None, если пользователя нет. Карточка - (слова, данные для record_answer),
+    первое слово загадывается. По поколению очередь карточек отличает
+    карточки, выбранные до изменения словаря.
+    """
+    user_id = cache_db.get_user_id(cid)
+    generation = vocabulary = None
+    if user_id is not None:
+        generation = cache_db.vocabulary_generation(user_id)
+        vocabulary = cache_db.get_vocabulary(user_id)
 
-def check_user_word_relation(cid, target_word):
-    """Проверяет, есть - ли связь между словом и пользователем"""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Получаем id пользователя по cid
-            cur.execute("SELECT id FROM users WHERE user_id = %s", (cid,))
-            user_result = cur.fetchone()
-            if not user_result:
-                return None
-            user_id = user_result[0]
-
-            # Получаем id слова по target_word (учитывая регистр и пробелы)
-            cur.execute("""
-                SELECT id FROM words
-                WHERE LOWER(target_word) = LOWER(%s)
-            """, (target_word.strip(),))
-            word_result = cur.fetchone()
-            if not word_result:
-                return None
-            word_id = word_result[0]
-
-            # Проверяем наличие связи в user_words
+            draws = []
+            if vocabulary is None:
+                result = _dictionary_size(cur, cid)
+                if not result:
+                    return None
+                user_id, total = result
+                cache_db.set_user_id(cid, user_id)
+                # Поколение берём до чтения, чтобы не закэшировать устаревший словарь
+                generation = cache_db.vocabulary_generation(user_id)
+                if total <= cache_db.cache_max_vocabulary:
+                    cur.execute("""
+                        SELECT target_word, translate_word
+                        FROM user_words
+                        JOIN words ON words.id = user_words.word_id
+                        WHERE user_words.user_id = %s
+                    """, (user_id,))
+                    vocabulary = cur.fetchall()
+                    cache_db.set_vocabulary(user_id, vocabulary, generation)
+                else:
+                    # На карточку size номеров: один запасной на случай, если
+                    # среди них окажется загадываемое слово
+                    draws = [random.sample(range(1, total + 1), min(size, total)) for _ in range(count)]
+            excluded = sorted(exclude(user_id)) if exclude is not None else []
+
             cur.execute("""
-                SELECT id FROM user_words
-                WHERE user_id = %s AND word_id = %s
-            """, (user_id, word_id)
-            )
-            relation = cur.fetchone()
-            if relation:
-                return relation[0]
+                (
+                    SELECT TRUE, user_words.id, ordinal, target_word, translate_word,
+                           ease, interval_days, streak,
+                           ARRAY(
+                               SELECT ARRAY[similar.target_word, similar.translate_word]
+                               FROM word_distractors
+                               JOIN words AS similar ON similar.id = word_distractors.distractor_id
+                               WHERE word_distractors.word_id = user_words.word_id
+                               ORDER BY RANDOM()
+                               LIMIT %s
+                           )
+                    FROM user_words
+                    JOIN words ON words.id = user_words.word_id
+                    WHERE user_words.user_id = %s AND user_words.id <> ALL(%s::INTEGER[])
+                    ORDER BY due_at
+                    LIMIT %s
+                )
+                UNION ALL
+                (
+                    SELECT FALSE, user_words.id, ordinal, target_word, translate_word,
+                           NULL, NULL, NULL, NULL
+                    FROM user_words
+                    JOIN words ON words.id = user_words.word_id
+                    WHERE user_words.user_id = %s AND ordinal = ANY(%s::INTEGER[])
+                )
+            """, (size - 1, user_id, excluded, count, user_id,
+                  sorted({ordinal for draw in draws for ordinal in draw})))
+            rows = cur.fetchall()
+
+    due = [row[1:] for row in rows if row[0]]
+    pool = {row[2]: (row[3], row[4]) for row in rows if not row[0]}
+
+    cards = []
+    for i, (user_word_id, ordinal, target_word, translate_word, ease, interval, streak, similar) in enumerate(due):
+        # Сначала похожие слова из индекса, недостающие варианты - случайные
+        others = [tuple(word) for word in similar]
+        if len(others) < size - 1:
+            if vocabulary is not None:
+                extra = random.sample(vocabulary, min(size + len(others), len(vocabulary)))
             else:
-                return None
+                extra = [pool[other] for other in draws[i] if other != ordinal and other in pool]
+            seen = {target_word} | {word[0] for word in others}
+            others += [word for word in extra if word[0] not in seen]
+        words = [(target_word, translate_word)] + others[:size - 1]
+        review = {"user_id": user_id, "user_word_id": user_word_id,
+                  "ease": ease, "interval": interval, "streak": streak}
+        cards.append((words, review))
+    return user_id, generation, cards
+
+# Ответ на карточку: кто и на какое слово ответил, с какой попытки, и
+# новые параметры повторения слова (scheduler.review). skipped - карточку
+# пропустили: слово откладывается на scheduler.SKIP_DELAY_MINUTES
+AnswerEvent = namedtuple("AnswerEvent", [
+    "user_id", "user_word_id", "correct", "attempts", "quality",
+    "ease", "interval", "streak", "answered_at", "skipped"
+], defaults=(False,))
+
+def record_answers(events):
+    """Записывает пачку ответов (AnswerEvent) одной транзакцией.
+
+    Ответы копируются в журнал answers через COPY, слова получают время
+    следующего повторения по последнему ответу на них, а счётчики
+    user_stats увеличиваются на итоги пачки без пересчёта по журналу.
+    Пропуски только откладывают слово. Если слова уже нет в словаре
+    пользователя (его удалили, возможно, через другой процесс), словарь
+    пользователя сбрасывается в cache_db вместе с очередью карточек.
+    """
+    if not events:
+        return
+
+    latest = {}
+    for event in events:
+        latest[event.user_word_id] = event
+    # Время до следующего показа в днях
+    delays = [scheduler.SKIP_DELAY_MINUTES / (24 * 60) if event.skipped else event.interval
+              for event in latest.values()]
+
+    answers = [event for event in events if not event.skipped]
+    rows = io.StringIO()
+    for event in answers:
+        rows.write(f"{event.user_id}\t{event.user_word_id}\t{event.correct}\t{event.attempts}\t"
+                   f"{event.quality}\t{event.answered_at.isoformat()}\n")
+    rows.seek(0)
+
+    totals = {}
+    for event in answers:
+        count, correct, attempts, last_answer_at = totals.get(event.user_id, (0, 0, 0, event.answered_at))
+        totals[event.user_id] = (count + 1, correct + event.correct, attempts + event.attempts,
+                                 max(last_answer_at, event.answered_at))
 
-def add_user_word_relation(cid, target_word):
-    """Создает связь пользователя и слова"""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Получаем id пользователя по cid
+            if answers:
+                cur.copy_expert("""
+                    COPY answers (user_id, user_word_id, correct, attempts, quality, answered_at)
+                    FROM STDIN
+                """, rows)
             cur.execute("""
-                SELECT id FROM users
-                WHERE user_id = %s""", (cid,))
-            user_result = cur.fetchone()
-            if not user_result:
-                raise ValueError("Пользователь не найден")
-            user_id = user_result[0]
-
-            # Получаем id слова по target_word
+                UPDATE user_words
+                SET ease = t.ease,
+                    interval_days = t.interval,
+                    streak = t.streak,
+                    due_at = t.answered_at + t.delay * INTERVAL '1 day'
+                FROM unnest(%s::BIGINT[], %s::REAL[], %s::REAL[], %s::INTEGER[], %s::TIMESTAMPTZ[], %s::REAL[])
+                    AS t(id, ease, interval, streak, answered_at, delay)
+                WHERE user_words.id = t.id
+                RETURNING user_words.id
+            """, [[event.user_word_id for event in latest.values()],
+                  [event.ease for event in latest.values()],
+                  [event.interval for event in latest.values()],
+                  [event.streak for event in latest.values()],
+                  [event.answered_at for event in latest.values()],
+                  delays])
+            updated = {user_word_id for (user_word_id,) in cur.fetchall()}
+            if totals:
+                cur.execute("""
+                    INSERT INTO user_stats AS s (user_id, answers, correct, attempts, last_answer_at)
+                    SELECT * FROM unnest(%s::BIGINT[], %s::INTEGER[], %s::INTEGER[], %s::INTEGER[],
+                                         %s::TIMESTAMPTZ[])
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        answers = s.answers + EXCLUDED.answers,
+                        correct = s.correct + EXCLUDED.correct,
+                        attempts = s.attempts + EXCLUDED.attempts,
+                        last_answer_at = GREATEST(s.last_answer_at, EXCLUDED.last_answer_at)
+                """, [list(totals)] + [list(column) for column in zip(*totals.values())])
+            conn.commit()
+
+    for user_id in {event.user_id for event in latest.values() if event.user_word_id not in updated}:
+        cache_db.invalidate_vocabulary(user_id)
+
+def get_media_file_id(bot_id, name, digest):
+    """Возвращает file_id файла с содержимым digest, загруженного ботом, или None."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
             cur.execute("""
-                SELECT id FROM words
-                WHERE LOWER(target_word) = LOWER(%s)
-            """, (target_word.strip(),))
-            word_result = cur.fetchone()
-            if not word_result:
-                raise ValueError("Слово не найдено")
-            word_id = word_result[0]
-
-            # Создаем связь в user_words
+                SELECT file_id FROM bot_media
+                WHERE bot_id = %s AND name = %s AND digest = %s
+            """, (bot_id, name, digest))
+            result = cur.fetchone()
+            return result[0] if result else None
+
+def save_media_file_id(bot_id, name, digest, file_id):
+    """Запоминает file_id загруженного ботом файла."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
             cur.execute("""
-                INSERT INTO user_words (user_id, word_id)
-                VALUES (%s, %s) RETURNING id
-            """, (user_id, word_id)
-            )
-            relation_id = cur.fetchone()[0]
+                INSERT INTO bot_media (bot_id, name, digest, file_id)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (bot_id, name, digest) DO UPDATE SET file_id = EXCLUDED.file_id
+            """, (bot_id, name, digest, file_id))
             conn.commit()
-            return relation_id
 
-def add_word(target_word, translate_word):
-    """Добавляет слово в словарь"""
+def get_user_stats(cid):
+    """Возвращает (ответов, правильных, попыток) пользователя или None."""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Обрабатываем входные данные
-            target_word_clean = target_word.strip().capitalize()
-            translate_word_clean = translate_word.strip().capitalize()
-
-            # Вставляем слова в таблицу words
             cur.execute("""
-                INSERT INTO words (target_word, translate_word)
-                VALUES (%s, %s)
-                ON CONFLICT (target_word) DO NOTHING
-                RETURNING id
-            """, (target_word_clean, translate_word_clean)
-            )
-            result = cur.fetchone()
-            if result:
-                word_id = result[0]
+                SELECT answers, correct, attempts
+                FROM user_stats
+                JOIN users ON users.id = user_stats.user_id
+                WHERE users.user_id = %s
+            """, (cid,))
+            return cur.fetchone()
+
+def similar_words(word, cid=None, limit=None):
+    """Слова, похожие по написанию на word, от самого похожего.
+
+    Ищет в словаре пользователя cid или, без cid, в общем словаре по
+    триграммному индексу idx_words_lower_target_word_trgm. Само слово
+    (без учёта регистра) не возвращается.
+    """
+    word = word.strip().lower()
+    limit = fuzzy_suggestions if limit is None else limit
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, TRUE)", (str(fuzzy_threshold),))
+            if cid is None:
+                cur.execute("""
+                    SELECT target_word FROM words
+                    WHERE LOWER(target_word) %% %s AND LOWER(target_word) <> %s
+                    ORDER BY similarity(LOWER(target_word), %s) DESC, target_word
+                    LIMIT %s
+                """, (word, word, word, limit))
             else:
-                # Если слово уже есть, получаем его id
                 cur.execute("""
+                    SELECT words.target_word
+                    FROM users
+                    JOIN user_words ON user_words.user_id = users.id
+                    JOIN words ON words.id = user_words.word_id
+                    WHERE users.user_id = %s
+                      AND LOWER(words.target_word) %% %s AND LOWER(words.target_word) <> %s
+                    ORDER BY similarity(LOWER(words.target_word), %s) DESC, words.target_word
+                    LIMIT %s
+                """, (cid, word, word, word, limit))
+            return [target_word for (target_word,) in cur.fetchall()]
+
+class RelationStatus:
+    """Результаты операций со словарём пользователя."""
+    ADDED = "added"
+    EXISTS = "exists"
+    DELETED = "deleted"
+    NOT_IN_DICTIONARY = "not_in_dictionary"
+    UNKNOWN_WORD = "unknown_word"
+    UNKNOWN_USER = "unknown_user"
+
+def relation_status(result, done_status, missing_status):
+    """Разбирает строку (id пользователя, id слова, id изменённой связи)."""
+    user_id, word_id, relation_id = result
+    if user_id is None:
+        return RelationStatus.UNKNOWN_USER
+    if word_id is None:
+        return RelationStatus.UNKNOWN_WORD
+    if relation_id is None:
+        return missing_status
+    return done_status
+
+def _after_relation_change(cid, result):
+    """Обновляет кэш после изменения словаря пользователя."""
+    user_id, _, relation_id = result
+    cache_db.set_user_id(cid, user_id)
+    if relation_id is not None:
+        cache_db.invalidate_vocabulary(user_id)
+
+def add_user_word(cid, target_word):
+    """Добавляет существующее слово в словарь пользователя одним запросом.
+
+    Возвращает RelationStatus.ADDED, EXISTS (связь уже была),
+    UNKNOWN_WORD или UNKNOWN_USER.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                WITH u AS (
+                    SELECT id FROM users WHERE user_id = %s
+                ), w AS (
                     SELECT id FROM words
-                    WHERE target_word = %s
-                """, (target_word_clean,)
+                    WHERE LOWER(target_word) = LOWER(%s)
+                    LIMIT 1
+                ), linked AS (
+                    INSERT INTO user_words (user_id, word_id)
+                    SELECT u.id, w.id FROM u, w
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
                 )
-                word_id = cur.fetchone()[0]
+                SELECT (SELECT id FROM u), (SELECT id FROM w), (SELECT id FROM linked)
+            """, (cid, target_word.strip()))
+            result = cur.fetchone()
             conn.commit()
-            return word_id
+            _after_relation_change(cid, result)
+            return relation_status(result, RelationStatus.ADDED, RelationStatus.EXISTS)
+
+def add_word_for_user(cid, target_word, translate_word):
+    """Добавляет слово в словарь и связывает его с пользователем одним запросом.
+
+    Возвращает RelationStatus.ADDED, EXISTS (связь уже была), UNKNOWN_USER
+    или UNKNOWN_WORD (слово не удалось ни добавить, ни найти).
+    """
+    target_word_clean = normalize_word(target_word)
+    translate_word_clean = normalize_word(translate_word)
 
-def delete_user_word_relation(cid, word_to_delete):
-    """Удаляет связь пользователя со словом"""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Получаем id пользователя по cid
-            cur.execute("SELECT id FROM users WHERE user_id = %s", (cid,))
-            user_result = cur.fetchone()
-            if not user_result:
-                return None
-            user_id = user_result[0]
-
-            # Получаем id слова по target_word (учитывая регистр и пробелы)
-            cur.execute("""
-                SELECT id FROM words
-                WHERE LOWER(target_word) = LOWER(%s)
-            """, (word_to_delete.strip(),)
-            )
-            word_result = cur.fetchone()
-            if not word_result:
-                return None
-            word_id = word_result[0]
-
-            # Удаляем связь и возвращаем id удаленной записи
             cur.execute("""
-                DELETE FROM user_words
-                WHERE user_id = %s AND word_id = %s
-                RETURNING id
-            """, (user_id, word_id)
-            )
+                WITH u AS (
+                    SELECT id FROM users WHERE user_id = %s
+                ), inserted AS (
+                    INSERT INTO words (target_word, translate_word)
+                    VALUES (%s, %s)
+                    ON CONFLICT (target_word) DO NOTHING
+                    RETURNING id
+                ), w AS (
+                    SELECT id FROM inserted
+                    UNION ALL
+                    SELECT id FROM words WHERE target_word = %s
+                    LIMIT 1
+                ), linked AS (
+                    INSERT INTO user_words (user_id, word_id)
+                    SELECT u.id, w.id FROM u, w
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                )
+                SELECT (SELECT id FROM u), (SELECT id FROM w), (SELECT id FROM linked),
+                       (SELECT id FROM inserted)
+            """, (cid, target_word_clean, translate_word_clean, target_word_clean))
+            *result, inserted_id = cur.fetchone()
+            if result[0] is not None and result[1] is None:
+                # Слово одновременно добавил другой сеанс: ON CONFLICT не вернул
+                # строку, а снимок запроса её не видит. Следующий запрос видит
+                cur.execute("""
+                    WITH w AS (
+                        SELECT id FROM words WHERE target_word = %s
+                    ), linked AS (
+                        INSERT INTO user_words (user_id, word_id)
+                        SELECT %s, w.id FROM w
+                        ON CONFLICT DO NOTHING
+                        RETURNING id
+                    )
+                    SELECT (SELECT id FROM w), (SELECT id FROM linked)
+                """, (target_word_clean, result[0]))
+                result[1:] = cur.fetchone()
+            if inserted_id is not None:
+                _index_distractors(cur, [(inserted_id, target_word_clean)])
+            conn.commit()
+            _after_relation_change(cid, result)
+            return relation_status(result, RelationStatus.ADDED, RelationStatus.EXISTS)
+
+def delete_user_word(cid, word_to_delete):
+    """Удаляет слово из словаря пользователя одним запросом.
 
-            deleted = cur.fetchone()
+    Возвращает RelationStatus.DELETED, NOT_IN_DICTIONARY (связи не было),
+    UNKNOWN_WORD или UNKNOWN_USER.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            # Строка пользователя блокируется до строки user_words (подзапросы
+            # вычисляются до чтения таблицы): иначе два удаления держали бы
+            # каждое свою строку и ждали друг друга в user_words_compact_ordinal
+            cur.execute("""
+                WITH u AS (
+                    SELECT id FROM users WHERE user_id = %s
+                    FOR NO KEY UPDATE
+                ), w AS (
+                    SELECT id FROM words
+                    WHERE LOWER(target_word) = LOWER(%s)
+                    LIMIT 1
+                ), removed AS (
+                    DELETE FROM user_words
+                    WHERE user_words.user_id = (SELECT id FROM u)
+                      AND user_words.word_id = (SELECT id FROM w)
+                    RETURNING user_words.id
+                )
+                SELECT (SELECT id FROM u), (SELECT id FROM w), (SELECT id FROM removed)
+            """, (cid, word_to_delete.strip()))
+            result = cur.fetchone()
             conn.commit()
+            _after_relation_change(cid, result)
+            return relation_status(result, RelationStatus.DELETED, RelationStatus.NOT_IN_DICTIONARY)
 
-            if deleted:
-                return deleted[0]
-            else:
-                return None
\ No newline at end of file
+# Время и запросы каждой функции доступа к базе (кроме не обращающихся к ней)
+metrics.instrument_db(globals(), exclude={
+    "normalize_word", "distractor_score", "relation_status", "schedule_distractor_indexing"
+})
@@ -0,0 +1,412 @@
+"""Асинхронный доступ к базе данных на asyncpg для main_async.py.
+
+Повторяет функции handlers_db с теми же запросами и результатами, но не
+блокирует цикл событий. Кэш пользователей и словарей (cache_db) общий с
+синхронной версией.
+"""
+import asyncio
+import random
+
+import asyncpg
+
+import cache_db
+import metrics
+from connection_db import (
+    db_name, db_user, db_password, db_host, db_port,
+    pool_min_size, pool_max_size, pool_timeout, pool_max_idle
+)
+from handlers_db import (
+    RelationStatus, relation_status, enrollment_batch_size, normalize_word, schedule_distractor_indexing,
+    fuzzy_suggestions, fuzzy_threshold, SCHEMA_VERSION, SchemaVersionError
+)
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+# Фоновые задачи отложенной записи пользователей в словарь: users.id -> задача
+_enrollment_tasks = {}
+
+def _log_query(record):
+    metrics.observe_query(record.elapsed)
+
+async def _init_connection(conn):
+    # Журнал запросов вызывается в контексте запроса, поэтому запрос
+    # учитывается за той функцией доступа к базе, которая его выполнила
+    conn.add_query_logger(_log_query)
+
+def _pool_connections():
+    pool = _pool
+    if pool is None:
+        return {}
+    size, idle = pool.get_size(), pool.get_idle_size()
+    return {("idle",): idle, ("busy",): size - idle}
+
+metrics.gauge("db_async_pool_connections", "Открытые соединения пула asyncpg", _pool_connections, ("state",))
+
+async def get_pool():
+    """Возвращает общий пул соединений, создавая его при первом обращении."""
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    database=db_name,
+                    user=db_user,
+                    password=db_password,
+                    host=db_host,
+                    port=int(db_port) if db_port else None,
+                    min_size=pool_min_size,
+                    max_size=pool_max_size,
+                    timeout=pool_timeout,
+                    max_inactive_connection_lifetime=pool_max_idle,
+                    init=_init_connection
+                )
+    return _pool
+
+async def close_pool():
+    """Дожидается фоновой записи пользователей и закрывает пул."""
+    global _pool
+    if _enrollment_tasks:
+        await asyncio.gather(*_enrollment_tasks.values(), return_exceptions=True)
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+async def check_schema_version():
+    """Проверяет одним запросом, что база обновлена до SCHEMA_VERSION (см. handlers_db)."""
+    pool = await get_pool()
+    try:
+        version = await pool.fetchval("SELECT MAX(version) FROM schema_version") or 0
+    except asyncpg.exceptions.UndefinedTableError:
+        version = 0
+    if version < SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"Схема базы версии {version}, нужна {SCHEMA_VERSION}: выполните python migrate.py"
+        )
+    return version
+
+async def _enroll_batch(conn, user_id, after_word_id, batch_size):
+    """Связывает пользователя с очередной пачкой слов по порядку id."""
+    return await conn.fetchval("""
+        WITH batch AS (
+            SELECT id FROM words
+            WHERE id > $1
+            ORDER BY id
+            LIMIT $2
+        ), linked AS (
+            INSERT INTO user_words (user_id, word_id)
+            SELECT $3::BIGINT, id FROM batch
+            ON CONFLICT DO NOTHING
+        )
+        SELECT MAX(id) FROM batch
+    """, after_word_id, batch_size, user_id)
+
+async def _enroll(conn, user_id, after_word_id=0, batch_size=None):
+    """Связывает пользователя со всеми словами и отмечает его записанным."""
+    if batch_size is None:
+        await conn.execute("""
+            INSERT INTO user_words (user_id, word_id)
+            SELECT $1::BIGINT, id FROM words
+            ON CONFLICT DO NOTHING
+        """, user_id)
+    else:
+        while after_word_id is not None:
+            after_word_id = await _enroll_batch(conn, user_id, after_word_id, batch_size)
+            cache_db.invalidate_vocabulary(user_id)
+
+    await conn.execute("UPDATE users SET enrolled_at = CURRENT_TIMESTAMP WHERE id = $1", user_id)
+    cache_db.invalidate_vocabulary(user_id)
+
+async def enroll_user(user_id, after_word_id=0, batch_size=None):
+    """Связывает пользователя со всеми словами словаря (см. handlers_db.enroll_user)."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        await _enroll(conn, user_id, after_word_id, batch_size)
+
+async def ensure_user_exists(cid, username, defer_enrollment=False):
+    """Находит или создает пользователя и связывает его со всеми словами.
+
+    См. handlers_db.ensure_user_exists; при defer_enrollment остальные слова
+    добавляются фоновой задачей, одной на пользователя.
+    """
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        # Находим пользователя или создаем нового
+        result = await conn.fetchrow("""
+            WITH existing AS (
+                SELECT id, enrolled_at FROM users WHERE user_id = $1
+            ), created AS (
+                INSERT INTO users (user_id, user_name)
+                SELECT $1, $2
+                WHERE NOT EXISTS (SELECT 1 FROM existing)
+                ON CONFLICT (user_id) DO NOTHING
+                RETURNING id, enrolled_at
+            )
+            SELECT id, enrolled_at IS NOT NULL FROM existing
+            UNION ALL
+            SELECT id, enrolled_at IS NOT NULL FROM created
+        """, cid, username)
+        if not result:
+            # Пользователя параллельно создал другой запрос
+            result = await conn.fetchrow(
+                "SELECT id, enrolled_at IS NOT NULL FROM users WHERE user_id = $1", cid
+            )
+        user_id, enrolled = result
+        cache_db.set_user_id(cid, user_id)
+
+        if enrolled:
+            return user_id
+
+        if not defer_enrollment:
+            await _enroll(conn, user_id)
+            return user_id
+
+        if user_id in _enrollment_tasks:
+            # Первая пачка уже связана, остальные добавляет фоновая задача
+            return user_id
+
+        last_word_id = await _enroll_batch(conn, user_id, 0, enrollment_batch_size)
+        cache_db.invalidate_vocabulary(user_id)
+
+    # Пока связывалась первая пачка, задачу мог запустить другой вызов
+    if user_id not in _enrollment_tasks:
+        task = asyncio.create_task(enroll_user(user_id, last_word_id, enrollment_batch_size))
+        _enrollment_tasks[user_id] = task
+        task.add_done_callback(lambda _: _enrollment_tasks.pop(user_id, None))
+    return user_id
+
+async def get_random_words(cid, limit=4):
+    """Получает случайные слова из словаря.
+
+    Словари активных пользователей берутся из cache_db без запросов к базе.
+    Словари больше cache_max_vocabulary не кэшируются, слова для них
+    выбираются по порядковым номерам.
+    """
+    user_id = cache_db.get_user_id(cid)
+    if user_id is not None:
+        words = cache_db.get_vocabulary(user_id)
+        if words is not None:
+            return random.sample(words, min(limit, len(words)))
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        result = await conn.fetchrow("""
+            SELECT id, (
+                SELECT COALESCE(MAX(ordinal), 0) FROM user_words
+                WHERE user_words.user_id = users.id
+            )
+            FROM users
+            WHERE user_id = $1
+        """, cid)
+        if not result:
+            return []
+        user_id, total = result
+        cache_db.set_user_id(cid, user_id)
+
+        if total > cache_db.cache_max_vocabulary:
+            ordinals = random.sample(range(1, total + 1), min(limit, total))
+            rows = await conn.fetch("""
+                SELECT target_word, translate_word
+                FROM user_words
+                JOIN words ON words.id = user_words.word_id
+                WHERE user_words.user_id = $1 AND user_words.ordinal = ANY($2::INTEGER[])
+            """, user_id, ordinals)
+            words = [tuple(row) for row in rows]
+            random.shuffle(words)
+            return words
+
+        # Поколение берём до чтения, чтобы не закэшировать устаревший словарь
+        generation = cache_db.vocabulary_generation(user_id)
+        rows = await conn.fetch("""
+            SELECT target_word, translate_word
+            FROM user_words
+            JOIN words ON words.id = user_words.word_id
+            WHERE user_words.user_id = $1
+        """, user_id)
+        words = [tuple(row) for row in rows]
+
+    cache_db.set_vocabulary(user_id, words, generation)
+    return random.sample(words, min(limit, len(words)))
+
+async def get_due_card(cid, size=4, exclude=None):
+    """Карточка со словом, которое раньше всех нужно повторить.
+
+    Возвращает (слова, данные для record_answer) или None, если слов нет;
+    слова из exclude(user_id) не загадываются (см. handlers_db.get_due_cards).
+    """
+    words = await get_random_words(cid, limit=size)
+    user_id = cache_db.get_user_id(cid)
+    if not words or user_id is None:
+        return None
+    excluded = sorted(exclude(user_id)) if exclude is not None else []
+
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            SELECT user_words.id, target_word, translate_word, ease, interval_days, streak,
+                   ARRAY(
+                       SELECT ARRAY[similar.target_word, similar.translate_word]
+                       FROM word_distractors
+                       JOIN words AS similar ON similar.id = word_distractors.distractor_id
+                       WHERE word_distractors.word_id = user_words.word_id
+                       ORDER BY RANDOM()
+                       LIMIT $2
+                   )
+            FROM user_words
+            JOIN words ON words.id = user_words.word_id
+            WHERE user_words.user_id = $1 AND user_words.id <> ALL($3::INTEGER[])
+            ORDER BY due_at
+            LIMIT 1
+        """, user_id, size - 1, excluded)
+    if row is None:
+        return None
+
+    user_word_id, target_word, translate_word, ease, interval, streak, similar = row
+    # Сначала похожие слова из индекса, недостающие варианты - случайные
+    others = [tuple(word) for word in similar]
+    seen = {target_word} | {word[0] for word in others}
+    others += [word for word in words if word[0] not in seen]
+    review = {"user_id": user_id, "user_word_id": user_word_id,
+              "ease": ease, "interval": interval, "streak": streak}
+    return [(target_word, translate_word)] + others[:size - 1], review
+
+async def similar_words(word, cid=None, limit=None):
+    """Слова, похожие по написанию на word (см. handlers_db.similar_words)."""
+    word = word.strip().lower()
+    limit = fuzzy_suggestions if limit is None else limit
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT set_config('pg_trgm.similarity_threshold', $1, TRUE)",
+                               str(fuzzy_threshold))
+            if cid is None:
+                rows = await conn.fetch("""
+                    SELECT target_word FROM words
+                    WHERE LOWER(target_word) % $1 AND LOWER(target_word) <> $1
+                    ORDER BY similarity(LOWER(target_word), $1) DESC, target_word
+                    LIMIT $2
+                """, word, limit)
+            else:
+                rows = await conn.fetch("""
+                    SELECT words.target_word
+                    FROM users
+                    JOIN user_words ON user_words.user_id = users.id
+                    JOIN words ON words.id = user_words.word_id
+                    WHERE users.user_id = $3
+                      AND LOWER(words.target_word) % $1 AND LOWER(words.target_word) <> $1
+                    ORDER BY similarity(LOWER(words.target_word), $1) DESC, words.target_word
+                    LIMIT $2
+                """, word, limit, cid)
+    return [row[0] for row in rows]
+
+async def get_user_stats(cid):
+    """Возвращает (ответов, правильных, попыток) пользователя или None."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            SELECT answers, correct, attempts
+            FROM user_stats
+            JOIN users ON users.id = user_stats.user_id
+            WHERE users.user_id = $1
+        """, cid)
+    return tuple(row) if row else None
+
+def _after_relation_change(cid, result):
+    """Обновляет кэш после изменения словаря пользователя."""
+    user_id, _, relation_id = result
+    cache_db.set_user_id(cid, user_id)
+    if relation_id is not None:
+        cache_db.invalidate_vocabulary(user_id)
+
+async def add_user_word(cid, target_word):
+    """Добавляет существующее слово в словарь пользователя (см. handlers_db.add_user_word)."""
+    pool = await get_pool()
+    result = tuple(await pool.fetchrow("""
+        WITH u AS (
+            SELECT id FROM users WHERE user_id = $1
+        ), w AS (
+            SELECT id FROM words
+            WHERE LOWER(target_word) = LOWER($2)
+            LIMIT 1
+        ), linked AS (
+            INSERT INTO user_words (user_id, word_id)
+            SELECT u.id, w.id FROM u, w
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        )
+        SELECT (SELECT id FROM u), (SELECT id FROM w), (SELECT id FROM linked)
+    """, cid, target_word.strip()))
+    _after_relation_change(cid, result)
+    return relation_status(result, RelationStatus.ADDED, RelationStatus.EXISTS)
+
+async def add_word_for_user(cid, target_word, translate_word):
+    """Добавляет слово в словарь и связывает его с пользователем (см. handlers_db.add_word_for_user)."""
+    target_word_clean = normalize_word(target_word)
+    translate_word_clean = normalize_word(translate_word)
+
+    pool = await get_pool()
+    *result, inserted_id = tuple(await pool.fetchrow("""
+        WITH u AS (
+            SELECT id FROM users WHERE user_id = $1
+        ), inserted AS (
+            INSERT INTO words (target_word, translate_word)
+            VALUES ($2, $3)
+            ON CONFLICT (target_word) DO NOTHING
+            RETURNING id
+        ), w AS (
+            SELECT id FROM inserted
+            UNION ALL
+            SELECT id FROM words WHERE target_word = $2
+            LIMIT 1
+        ), linked AS (
+            INSERT INTO user_words (user_id, word_id)
+            SELECT u.id, w.id FROM u, w
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        )
+        SELECT (SELECT id FROM u), (SELECT id FROM w), (SELECT id FROM linked),
+               (SELECT id FROM inserted)
+    """, cid, target_word_clean, translate_word_clean))
+    if result[0] is not None and result[1] is None:
+        # Слово одновременно добавил другой сеанс (см. handlers_db.add_word_for_user)
+        result[1:] = await pool.fetchrow("""
+            WITH w AS (
+                SELECT id FROM words WHERE target_word = $1
+            ), linked AS (
+                INSERT INTO user_words (user_id, word_id)
+                SELECT $2, w.id FROM w
+                ON CONFLICT DO NOTHING
+                RETURNING id
+            )
+            SELECT (SELECT id FROM w), (SELECT id FROM linked)
+        """, target_word_clean, result[0])
+    if inserted_id is not None:
+        # Индекс вариантов ответа строится синхронным драйвером в фоне
+        schedule_distractor_indexing(inserted_id - 1)
+    _after_relation_change(cid, result)
+    return relation_status(result, RelationStatus.ADDED, RelationStatus.EXISTS)
+
+async def delete_user_word(cid, word_to_delete):
+    """Удаляет слово из словаря пользователя (см. handlers_db.delete_user_word)."""
+    pool = await get_pool()
+    result = tuple(await pool.fetchrow("""
+        WITH u AS (
+            SELECT id FROM users WHERE user_id = $1
+            FOR NO KEY UPDATE
+        ), w AS (
+            SELECT id FROM words
+            WHERE LOWER(target_word) = LOWER($2)
+            LIMIT 1
+        ), removed AS (
+            DELETE FROM user_words
+            WHERE user_words.user_id = (SELECT id FROM u)
+              AND user_words.word_id = (SELECT id FROM w)
+            RETURNING user_words.id
+        )
+        SELECT (SELECT id FROM u), (SELECT id FROM w), (SELECT id FROM removed)
+    """, cid, word_to_delete.strip()))
+    _after_relation_change(cid, result)
+    return relation_status(result, RelationStatus.DELETED, RelationStatus.NOT_IN_DICTIONARY)
+
+# Время и запросы каждой функции доступа к базе
+metrics.instrument_db(globals(), exclude={"get_pool", "close_pool"})
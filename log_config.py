@@ -0,0 +1,70 @@
+"""Настройка журнала бота.
+
+Уровень задаётся в LOG_LEVEL (по умолчанию INFO; DEBUG включает
+подробные сообщения обработчиков о каждом ответе). Частота одинаковых
+сообщений ограничена: по каждому шаблону сообщения проходит не больше
+LOG_BURST подряд и дальше LOG_RATE в секунду. Число пропущенных
+сообщений дописывается к следующему прошедшему и учитывается в метрике
+log_messages_dropped_total, поэтому, например, недоступная база не
+засыпает консоль одинаковыми ошибками.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Настройки журнала
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+log_rate = float(os.getenv("LOG_RATE", "1"))
+log_burst = float(os.getenv("LOG_BURST", "10"))
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Сколько шаблонов сообщений помнить для ограничения частоты
+_MAX_KEYS = 10000
+
+_dropped = metrics.counter("log_messages_dropped_total",
+                           "Сообщения журнала, отброшенные ограничением частоты", ("level",))
+
+class RateLimitFilter(logging.Filter):
+    """Ограничивает частоту сообщений с одинаковым шаблоном (корзина токенов)."""
+
+    def __init__(self, rate=log_rate, burst=log_burst):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        # (логгер, уровень, шаблон) -> [токены, время обновления, пропущено]
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            state = self._keys.get(key)
+            if state is None:
+                state = self._keys[key] = [self.burst, now, 0]
+                if len(self._keys) > _MAX_KEYS:
+                    self._keys.popitem(last=False)
+            self._keys.move_to_end(key)
+            state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+            if state[0] < 1:
+                state[2] += 1
+                _dropped.inc(record.levelname)
+                return False
+            state[0] -= 1
+            dropped, state[2] = state[2], 0
+        if dropped:
+            record.msg = f"{record.msg} (пропущено похожих сообщений: {dropped})"
+        return True
+
+def setup_logging(level=log_level):
+    """Настраивает вывод журнала в консоль с ограничением частоты."""
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    rate_limit = RateLimitFilter()
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(rate_limit)
@@ -1,103 +1,88 @@
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import telebot
-import random
-from telebot import types, custom_filters
-from telebot.handler_backends import State, StatesGroup
-from telebot.storage import StateMemoryStorage
-
-from connection_db import get_db_connection
+from telebot import apihelper, custom_filters
+
+import answer_buffer
+import bot_logic
+import metrics
+import word_import
+from bot_logic import Command, MyStates
+from card_prefetch import get_card
+from media_cache import MediaCache, bot_id_from_token
+from outbox import Outbox, CARD, MENU
 from handlers_db import (
-    initialize_db, ensure_user_exists, fill_common_words_table, get_random_words,
-    get_word_id, check_user_word_relation, add_user_word_relation, add_word,
-    delete_user_word_relation
+    check_schema_version, ensure_user_exists,
+    add_user_word, add_word_for_user, delete_user_word, get_user_stats,
+    similar_words, RelationStatus
 )
+from log_config import setup_logging
+from state_storage import create_state_storage
+
+# Журнал: уровень LOG_LEVEL, одинаковые сообщения ограничены по частоте
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Создание хранилища состояний (STATE_STORAGE: memory, postgres или redis)
+state_storage = create_state_storage()
+
+# Режим получения обновлений: polling или webhook
+bot_mode = os.getenv("BOT_MODE", "polling")
 
-# Определение команд
-class Command:
-    ADD_WORD = "Добавить слово ➕"
-    DELETE_WORD = "Удалить слово 🔙"
-    NEXT = "Следующее слово ➡️"
-
-# Определение состояний
-class MyStates(StatesGroup):
-    target_word = State()
-    translate_word = State()
-    other_words = State()
-    adding_new_word = State()
-    saving_new_word = State()
-    deleting_word = State()
-
-# Создание хранилища состояний
-state_storage = StateMemoryStorage()
-
-# Создание объекта бота
+# Адрес Bot API можно заменить, например, на тестовый сервер
+# (формат как у apihelper.API_URL: http://host:port/bot{0}/{1})
+if os.getenv("TELEGRAM_API_URL"):
+    apihelper.API_URL = os.getenv("TELEGRAM_API_URL")
+if os.getenv("TELEGRAM_FILE_URL"):
+    apihelper.FILE_URL = os.getenv("TELEGRAM_FILE_URL")
+
+# Создание объекта бота; в режиме webhook обновления раздаёт webhook.UpdateDispatcher
 token_bot = os.getenv("TOKEN")
-bot = telebot.TeleBot(token_bot, state_storage=state_storage)
+bot = telebot.TeleBot(token_bot, state_storage=state_storage, threaded=bot_mode != "webhook")
 
-common_words = [
-    ("Peace", "Мир"), ("Green", "Зелёный"), ("White", "Белый"),
-    ("Hello", "Привет"), ("Car", "Машина"), ("Sky", "Небо"),
-    ("Tree", "Дерево"), ("Book", "Книга"), ("Love", "Любовь"),
-    ("Friend", "Друг")
-]
+# Сообщения отправляются из очереди с учётом ограничений Telegram
+outbox = Outbox(bot)
+metrics.gauge("outbox_pending", "Сообщения, ждущие отправки", outbox.pending)
 
-# Подключение к базе данных, создание таблиц, заполнение словаря
-with get_db_connection() as conn:
-    initialize_db()
-    fill_common_words_table()
+# Файлы со словами импортируются в фоне, обработчик обновлений не ждёт загрузки
+import_executor = ThreadPoolExecutor(max_workers=int(os.getenv("IMPORT_WORKERS", "2")),
+                                     thread_name_prefix="word-import")
 
-print('Start telegram bot...')
+# Стикер приветствия загружается в Telegram один раз, дальше отправляется его file_id
+media = MediaCache(lambda: bot_id_from_token(token_bot))
+media.register("welcome_sticker", "sticker.png")
 
 def create_cards(message):
     """Создает клавиатуру и карточки, определяет состояние."""
     cid = message.chat.id
 
-    # Получаем случайные слова
-    words = get_random_words(cid, limit=4)
-    print(f"Случайные слова: {words}")
+    # Берём слово к повторению и варианты из очереди заранее выбранных карточек
+    words, review = get_card(cid, size=bot_logic.CARD_SIZE) or ([], None)
+    logger.debug("Случайные слова: %s", words)
 
-    if not words or len(words) < 4:
-        bot.send_message(cid, "Нет доступных слов!\nДобавьте новые через 'Добавить слово ➕'.")
-        print("Недостаточно слов для создания карточек.")
+    card = bot_logic.make_card(words)
+    if card is None:
+        outbox.send_message(cid, bot_logic.NO_WORDS_TEXT)
+        logger.warning("Недостаточно слов для создания карточек.")
         return
-
-    # Извлекаем целевое слово и другие варианты
-    target_word, translate_word = words[0]
-    other_words = [w[0] for w in words[1:]]
-
-    # Перемешиваем варианты
-    options = other_words + [target_word]
-    random.shuffle(options)
-
-    # Создаем клавиатуру
-    markup = types.ReplyKeyboardMarkup(row_width=2)
-    buttons = [types.KeyboardButton(option) for option in options]
-    buttons.append(types.KeyboardButton(Command.NEXT))
-    buttons.append(types.KeyboardButton(Command.ADD_WORD))
-    buttons.append(types.KeyboardButton(Command.DELETE_WORD))
-    markup.add(*buttons)
+    target_word, translate_word, text, markup = card
 
     # Устанавливаем состояние для пользователя
     bot.set_state(user_id=message.from_user.id, chat_id=message.chat.id, state=MyStates.target_word)
     with bot.retrieve_data(user_id=message.from_user.id, chat_id=message.chat.id) as data:
         data["target_word"] = target_word
         data["translate_word"] = translate_word
+        data["review"] = review
 
     # Отправляем сообщение
-    greeting = f"Выбери перевод слова:\n🇷🇺 {translate_word}"
-    bot.send_message(cid, greeting, reply_markup=markup)
+    outbox.send_message(cid, text, reply_markup=markup, priority=CARD)
 
 def send_main_menu(chat_id):
     """Отправляет основное меню."""
-    markup = types.ReplyKeyboardMarkup(row_width=2)
-    buttons = [
-        types.KeyboardButton(Command.ADD_WORD),
-        types.KeyboardButton(Command.DELETE_WORD),
-        types.KeyboardButton(Command.NEXT)
-    ]
-    markup.add(*buttons)
-    bot.send_message(chat_id, "Выберите дальнейшее действие:", reply_markup=markup)
+    outbox.send_message(chat_id, bot_logic.MAIN_MENU_TEXT, reply_markup=bot_logic.main_menu_markup(),
+                        priority=MENU)
 
 # # Обработчики
 
@@ -105,22 +90,21 @@ def send_main_menu(chat_id):
 def send_welcome(message):
     cid = message.chat.id
     username = message.chat.username or "Unknown"
-    ensure_user_exists(cid, username)
+    ensure_user_exists(cid, username, defer_enrollment=True)
 
-    print("Starting bot for the first time...")
+    logger.debug("Starting bot for the first time...")
 
     # Отправка приветственного сообщения
-    with open("sticker.png", "rb") as sti:
-        bot.send_sticker(cid, sti)
-    bot.send_message(cid, f"Приветствую, {message.from_user.first_name}!\nЯ {bot.get_me().first_name}! "
-                              f"Начнём учить язык 🇬🇧\nУ тебя есть возможность использовать тренажёр,\nкак конструктор, "
-                              f"и собирать свою собственную базу для обучения.\nДля этого воспользуйся инструментами:\n"
-                              f"- добавить слово ➕\n"
-                              f"- удалить слово 🔙\n"
-                              f"Приступим ⬇️", parse_mode="html"
-                         )
+    media.send_sticker(bot, outbox, cid, "welcome_sticker")
+    # bot.user запрашивает getMe один раз и дальше берётся из памяти
+    outbox.send_message(cid, bot_logic.welcome_text(message.from_user.first_name, bot.user.first_name),
+                        parse_mode="html")
     create_cards(message)
 
+@bot.message_handler(commands=["stats"])
+def send_stats(message):
+    outbox.send_message(message.chat.id, bot_logic.stats_text(get_user_stats(message.chat.id)))
+
 @bot.message_handler(func=lambda message: message.text == Command.NEXT)
 def next_word(message):
     create_cards(message)
@@ -129,35 +113,33 @@ def next_word(message):
 def add_word_start(message):
     cid = message.chat.id
     bot.set_state(user_id=message.from_user.id, chat_id=cid, state=MyStates.adding_new_word)
-    bot.send_message(cid, "Введите слово, которое вы хотите добавить, на английском:")
+    outbox.send_message(cid, bot_logic.ASK_NEW_WORD_TEXT)
 
 @bot.message_handler(state=MyStates.adding_new_word)
 def handle_add_new_word(message):
     cid = message.chat.id
     target_word = message.text.strip().capitalize()
 
-    # Проверка наличия слова в таблице words
-    word_id = get_word_id(target_word)
+    # Пробуем связать пользователя со словом из словаря
+    reply = bot_logic.add_word_reply(add_user_word(cid, target_word), target_word)
 
-    if word_id:
-        # Слово есть, проверяем связь с пользователем
-        relation_id = check_user_word_relation(cid, target_word)
-        if relation_id:
-            # Связь уже есть
-            bot.send_message(cid, "Такое слово уже есть в вашем словаре.")
+    if reply:
+        text, show_menu = reply
+        outbox.send_message(cid, text)
+        if show_menu:
             send_main_menu(cid)
-        else:
-            # Связи нет, создаем
-            add_user_word_relation(cid, target_word)
-            bot.send_message(cid, f"Слово добавлено '{target_word}' успешно добавлено.")
         # Удаляем состояние
         bot.delete_state(user_id=message.from_user.id, chat_id=cid)
     else:
-        # Слова нет, сохраняем в состояние и переходим к следующему шагу
+        # Слова нет: возможно, это опечатка в слове из словаря
+        suggestions = similar_words(target_word)
+        # Сохраняем слово в состояние и переходим к следующему шагу
         with bot.retrieve_data(user_id=message.from_user.id, chat_id=cid) as data:
             data["target_word"] = target_word
+            data["suggestions"] = suggestions
         bot.set_state(user_id=message.from_user.id, chat_id=cid, state=MyStates.saving_new_word)
-        bot.send_message(cid, f"Теперь введите перевод для слова '{target_word}':")
+        outbox.send_message(cid, bot_logic.ask_translation_text(target_word, suggestions),
+                            reply_markup=bot_logic.suggestions_markup(suggestions))
 
 @bot.message_handler(state=MyStates.saving_new_word)
 def handle_save_new_word(message):
@@ -167,19 +149,20 @@ def handle_save_new_word(message):
     # Извлекаем target_word из состояния
     with bot.retrieve_data(user_id=message.from_user.id, chat_id=cid) as data:
         target_word = data.get("target_word")
+        suggestions = data.get("suggestions") or []
         if not target_word:
-            bot.send_message(cid, "Ошибка: не найдено слово для сохранения. Начните заново.")
+            outbox.send_message(cid, bot_logic.NO_WORD_TO_SAVE_TEXT)
             bot.delete_state(user_id=message.from_user.id, chat_id=cid)
             return
 
-    # Добавляем слово в таблицу words
-    add_word(target_word, translate_word)
-
-    # Создаем связь пользователя и слова
-    add_user_word_relation(cid, target_word)
-
-    # Отправляем сообщение
-    bot.send_message(cid, f"Слово '{target_word}' и перевод '{translate_word}' успешно добавлены.")
+    if translate_word in suggestions:
+        # Вместо перевода выбрано похожее слово из словаря
+        status = add_user_word(cid, translate_word)
+        outbox.send_message(cid, bot_logic.add_suggestion_reply(status, translate_word))
+    else:
+        # Добавляем слово в таблицу words и создаем связь пользователя и слова
+        status = add_word_for_user(cid, target_word, translate_word)
+        outbox.send_message(cid, bot_logic.save_word_reply(status, target_word, translate_word))
 
     # Удаляем состояние
     bot.delete_state(user_id=message.from_user.id, chat_id=cid)
@@ -189,73 +172,97 @@ def handle_save_new_word(message):
 def delete_word_start(message):
     cid = message.chat.id
     bot.set_state(user_id=message.from_user.id, chat_id=message.chat.id, state=MyStates.deleting_word)
-    bot.send_message(cid, "Введите слово, которое хотите удалить, на английском:")
+    outbox.send_message(cid, bot_logic.ASK_WORD_TO_DELETE_TEXT)
 
 @bot.message_handler(state=MyStates.deleting_word)
 def handle_delete_word(message):
     cid = message.chat.id
     word_to_delete = message.text.strip()
-    # Проверяем наличие слова в словаре
-    word_id = get_word_id(word_to_delete)
-    if word_id:
-        # Проверяем наличие связи
-        if check_user_word_relation(cid, word_to_delete):
-            delete_user_word_relation(cid, word_to_delete)
-            bot.send_message(cid, f"Слово '{word_to_delete}' успешно удалено.")
-        else:
-            bot.send_message(cid, "Слово не найдено в вашем словаре.")
-    else:
-        bot.send_message(cid, "Слово не найдено в вашем словаре.")
+    # Удаляем связь, если слово есть в словаре пользователя
+    status = delete_user_word(cid, word_to_delete)
+    # Не нашли: предлагаем похожие слова из словаря пользователя
+    suggestions = [] if status == RelationStatus.DELETED else similar_words(word_to_delete, cid=cid)
+    text, reset_state = bot_logic.delete_word_reply(status, word_to_delete, suggestions)
+    if suggestions:
+        outbox.send_message(cid, text, reply_markup=bot_logic.suggestions_markup(suggestions))
+        return
+    outbox.send_message(cid, text)
+    if reset_state:
         bot.delete_state(user_id=message.from_user.id, chat_id=cid)
     send_main_menu(cid)
 
+def import_document(cid, file_id):
+    """Импортирует присланный файл со словами и отвечает, когда импорт закончен."""
+    # Файл читается прямо из ответа Telegram и загружается через COPY
+    try:
+        result = word_import.import_url(bot.get_file_url(file_id), cid=cid)
+    except Exception as e:
+        logger.error("Ошибка при импорте файла: %s", e)
+        outbox.send_message(cid, bot_logic.IMPORT_FAILED_TEXT)
+        return
+    outbox.send_message(cid, bot_logic.import_reply(result))
+    send_main_menu(cid)
+
+@bot.message_handler(content_types=["document"])
+def handle_document(message):
+    cid = message.chat.id
+    refusal = bot_logic.check_import_document(message.document)
+    if refusal:
+        outbox.send_message(cid, refusal)
+        return
+    import_executor.submit(import_document, cid, message.document.file_id)
+
 @bot.message_handler(func=lambda message: True, content_types=["text"])
 def message_reply(message):
     user_response = message.text.strip()
-    print(f"Ответ пользователя: {user_response}")
+    logger.debug("Ответ пользователя: %s", user_response)
 
     # Проверяем текущее состояние
     state = bot.get_state(user_id=message.from_user.id, chat_id=message.chat.id)
-    print(f"Полученное состояние для пользователя {message.from_user.id}, чат {message.chat.id}: {state}")
+    logger.debug("Полученное состояние для пользователя %s, чат %s: %s",
+                 message.from_user.id, message.chat.id, state)
 
     if state != MyStates.target_word.name:
-        bot.send_message(message.chat.id, "Ошибка! Начните заново со /start.")
+        outbox.send_message(message.chat.id, bot_logic.RESTART_TEXT)
         return
 
-    # Извлекаем данные из состояния
+    # Проверяем ответ; изменения данных сохраняются при выходе из блока
+    reply = quality = None
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        target_word = data.get("target_word")
-        translate_word = data.get("translate_word")
-        attempts = data.get("attempts", 0)
-        print(f"Данные из состояний: target_word={target_word}, translate_word={translate_word}")
+        logger.debug("Данные из состояний: target_word=%s, translate_word=%s",
+                     data.get("target_word"), data.get("translate_word"))
+        review = data.get("review")
+        attempts = data.get("attempts", 0) + 1
+        if data.get("target_word") and data.get("translate_word"):
+            reply, quality = bot_logic.check_answer(user_response, data)
 
-    if not target_word or not translate_word:
-        bot.send_message(message.chat.id, "Ошибка! Попробуй снова начать со /start.")
-        return
+    outbox.send_message(message.chat.id, reply or bot_logic.NO_QUIZ_DATA_TEXT)
 
-    # Если пользователь ответил правильно
-    if user_response.strip().lower() == target_word.strip().lower():
-        try:
-            # update_word_to_user_dict(message.from_user.id, target_word, translate_word)
-            bot.send_message(message.chat.id, f"✅ Правильно!\n{target_word} => {translate_word}!")
-        except ValueError as e:
-            print(f"Ошибка при обновлении слова: {e}")
-        data.clear()
-        return
-
-    # Если пользователь ответил неправильно
-    attempts += 1
-    data["attempts"] = attempts
-    if attempts < 3:
-        bot.send_message(
-            message.chat.id, f"❌ Неправильно! Попробуй снова.\nПеревод слова: {translate_word}\n"
-                             f"Попытка {attempts} из 3."
-        )
-    else:
-        bot.send_message(
-            message.chat.id, f"К сожалению, вы исчерпали попытки.\n"f"Правильный перевод: {target_word}"
-        )
-        data.clear()
+    # Карточка завершена: назначаем следующее повторение слова
+    if quality is not None and review:
+        answer_buffer.record_answer(review, quality, attempts)
 
 bot.add_custom_filter(custom_filters.StateFilter(bot))
-bot.infinity_polling(timeout=10, long_polling_timeout=5, skip_pending=True)
\ No newline at end of file
+
+# Время и ошибки каждого обработчика
+metrics.instrument_handlers(bot)
+
+if __name__ == "__main__":
+    # Таблицы создаёт migrate.py; здесь только проверяем, что он выполнен
+    check_schema_version()
+    logger.info('Start telegram bot...')
+    # Данные бота запрашиваются один раз при запуске
+    logger.info("Bot @%s", bot.user.username)
+    # Метрики на METRICS_PORT, если порт задан
+    metrics.start_server()
+    try:
+        if bot_mode == "webhook":
+            from webhook import run_webhook
+            run_webhook(bot)
+        else:
+            bot.infinity_polling(timeout=10, long_polling_timeout=5, skip_pending=True)
+    finally:
+        # Завершаем импорт файлов, досылаем сообщения и дописываем накопленные ответы
+        import_executor.shutdown()
+        outbox.close()
+        answer_buffer.close()
@@ -0,0 +1,252 @@
+"""Асинхронный запуск бота на AsyncTeleBot.
+
+Запуск: python main_async.py
+
+Обработчики те же, что в main.py (общая логика - в bot_logic), но запросы
+к Telegram и базе данных не блокируют друг друга: пока один чат ждёт
+ответа базы, обрабатываются обновления остальных.
+"""
+import asyncio
+import logging
+import os
+
+from telebot import asyncio_filters
+from telebot.async_telebot import AsyncTeleBot
+
+import answer_buffer
+import bot_logic
+import cache_db
+import handlers_db_async as db
+import metrics
+import word_import
+from bot_logic import Command, MyStates
+from handlers_db import RelationStatus
+from log_config import setup_logging
+from media_cache import MediaCache, bot_id_from_token
+from state_storage import create_async_state_storage
+
+# Журнал: уровень LOG_LEVEL, одинаковые сообщения ограничены по частоте
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Создание хранилища состояний (STATE_STORAGE: memory, postgres или redis)
+state_storage = create_async_state_storage()
+
+# Создание объекта бота
+token_bot = os.getenv("TOKEN")
+bot = AsyncTeleBot(token_bot, state_storage=state_storage)
+
+# Стикер приветствия загружается в Telegram один раз, дальше отправляется его file_id
+media = MediaCache(lambda: bot_id_from_token(token_bot))
+media.register("welcome_sticker", "sticker.png")
+
+async def next_card(cid):
+    """Слово к повторению, кроме показанного сейчас и ждущих записи ответа."""
+    card = await db.get_due_card(cid, size=bot_logic.CARD_SIZE, exclude=answer_buffer.excluded_words)
+    user_id = cache_db.get_user_id(cid)
+    if card is None and user_id is not None and answer_buffer.excluded_words(user_id):
+        # Других слов нет: показанная карточка может повториться
+        card = await db.get_due_card(cid, size=bot_logic.CARD_SIZE,
+                                     exclude=lambda user_id: answer_buffer.excluded_words(user_id, False))
+    if card is not None:
+        answer_buffer.mark_shown(card[1])
+    return card
+
+async def create_cards(message):
+    """Создает клавиатуру и карточки, определяет состояние."""
+    cid = message.chat.id
+
+    # Берём слово к повторению и случайные варианты
+    words, review = await next_card(cid) or ([], None)
+
+    card = bot_logic.make_card(words)
+    if card is None:
+        await bot.send_message(cid, bot_logic.NO_WORDS_TEXT)
+        return
+    target_word, translate_word, text, markup = card
+
+    # Устанавливаем состояние для пользователя
+    await bot.set_state(user_id=message.from_user.id, chat_id=cid, state=MyStates.target_word)
+    async with bot.retrieve_data(user_id=message.from_user.id, chat_id=cid) as data:
+        data["target_word"] = target_word
+        data["translate_word"] = translate_word
+        data["review"] = review
+
+    # Отправляем сообщение
+    await bot.send_message(cid, text, reply_markup=markup)
+
+async def send_main_menu(chat_id):
+    """Отправляет основное меню."""
+    await bot.send_message(chat_id, bot_logic.MAIN_MENU_TEXT, reply_markup=bot_logic.main_menu_markup())
+
+# # Обработчики
+
+@bot.message_handler(commands=["start"])
+async def send_welcome(message):
+    cid = message.chat.id
+    username = message.chat.username or "Unknown"
+    await db.ensure_user_exists(cid, username, defer_enrollment=True)
+
+    # Отправка приветственного сообщения
+    file_id = await asyncio.to_thread(media.file_id, "welcome_sticker")
+    sent = await bot.send_sticker(cid, file_id or media.data("welcome_sticker"))
+    if file_id is None:
+        await asyncio.to_thread(media.remember, "welcome_sticker", sent.sticker.file_id)
+    # bot.user заполняется один раз при запуске опроса (getMe)
+    await bot.send_message(cid, bot_logic.welcome_text(message.from_user.first_name, bot.user.first_name),
+                           parse_mode="html")
+    await create_cards(message)
+
+@bot.message_handler(commands=["stats"])
+async def send_stats(message):
+    stats = await db.get_user_stats(message.chat.id)
+    await bot.send_message(message.chat.id, bot_logic.stats_text(stats))
+
+@bot.message_handler(func=lambda message: message.text == Command.NEXT)
+async def next_word(message):
+    await create_cards(message)
+
+@bot.message_handler(func=lambda message: message.text == Command.ADD_WORD)
+async def add_word_start(message):
+    cid = message.chat.id
+    await bot.set_state(user_id=message.from_user.id, chat_id=cid, state=MyStates.adding_new_word)
+    await bot.send_message(cid, bot_logic.ASK_NEW_WORD_TEXT)
+
+@bot.message_handler(state=MyStates.adding_new_word)
+async def handle_add_new_word(message):
+    cid = message.chat.id
+    target_word = message.text.strip().capitalize()
+
+    # Пробуем связать пользователя со словом из словаря
+    reply = bot_logic.add_word_reply(await db.add_user_word(cid, target_word), target_word)
+
+    if reply:
+        text, show_menu = reply
+        await bot.send_message(cid, text)
+        if show_menu:
+            await send_main_menu(cid)
+        await bot.delete_state(user_id=message.from_user.id, chat_id=cid)
+    else:
+        # Слова нет: возможно, это опечатка в слове из словаря
+        suggestions = await db.similar_words(target_word)
+        # Сохраняем слово в состояние и переходим к следующему шагу
+        async with bot.retrieve_data(user_id=message.from_user.id, chat_id=cid) as data:
+            data["target_word"] = target_word
+            data["suggestions"] = suggestions
+        await bot.set_state(user_id=message.from_user.id, chat_id=cid, state=MyStates.saving_new_word)
+        await bot.send_message(cid, bot_logic.ask_translation_text(target_word, suggestions),
+                               reply_markup=bot_logic.suggestions_markup(suggestions))
+
+@bot.message_handler(state=MyStates.saving_new_word)
+async def handle_save_new_word(message):
+    cid = message.chat.id
+    translate_word = message.text.strip().capitalize()
+
+    # Извлекаем target_word из состояния
+    async with bot.retrieve_data(user_id=message.from_user.id, chat_id=cid) as data:
+        target_word = data.get("target_word")
+        suggestions = data.get("suggestions") or []
+    if not target_word:
+        await bot.send_message(cid, bot_logic.NO_WORD_TO_SAVE_TEXT)
+        await bot.delete_state(user_id=message.from_user.id, chat_id=cid)
+        return
+
+    if translate_word in suggestions:
+        # Вместо перевода выбрано похожее слово из словаря
+        status = await db.add_user_word(cid, translate_word)
+        await bot.send_message(cid, bot_logic.add_suggestion_reply(status, translate_word))
+    else:
+        # Добавляем слово в таблицу words и создаем связь пользователя и слова
+        status = await db.add_word_for_user(cid, target_word, translate_word)
+        await bot.send_message(cid, bot_logic.save_word_reply(status, target_word, translate_word))
+
+    await bot.delete_state(user_id=message.from_user.id, chat_id=cid)
+    await send_main_menu(cid)
+
+@bot.message_handler(func=lambda message: message.text == Command.DELETE_WORD)
+async def delete_word_start(message):
+    cid = message.chat.id
+    await bot.set_state(user_id=message.from_user.id, chat_id=cid, state=MyStates.deleting_word)
+    await bot.send_message(cid, bot_logic.ASK_WORD_TO_DELETE_TEXT)
+
+@bot.message_handler(state=MyStates.deleting_word)
+async def handle_delete_word(message):
+    cid = message.chat.id
+    word_to_delete = message.text.strip()
+    status = await db.delete_user_word(cid, word_to_delete)
+    # Не нашли: предлагаем похожие слова из словаря пользователя
+    suggestions = [] if status == RelationStatus.DELETED else await db.similar_words(word_to_delete, cid=cid)
+    text, reset_state = bot_logic.delete_word_reply(status, word_to_delete, suggestions)
+    if suggestions:
+        await bot.send_message(cid, text, reply_markup=bot_logic.suggestions_markup(suggestions))
+        return
+    await bot.send_message(cid, text)
+    if reset_state:
+        await bot.delete_state(user_id=message.from_user.id, chat_id=cid)
+    await send_main_menu(cid)
+
+@bot.message_handler(func=lambda message: True, content_types=["text"])
+async def message_reply(message):
+    user_response = message.text.strip()
+
+    # Проверяем текущее состояние
+    state = await bot.get_state(user_id=message.from_user.id, chat_id=message.chat.id)
+    if state != MyStates.target_word.name:
+        await bot.send_message(message.chat.id, bot_logic.RESTART_TEXT)
+        return
+
+    # Проверяем ответ; изменения данных сохраняются при выходе из блока
+    reply = quality = None
+    async with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        review = data.get("review")
+        attempts = data.get("attempts", 0) + 1
+        if data.get("target_word") and data.get("translate_word"):
+            reply, quality = bot_logic.check_answer(user_response, data)
+
+    await bot.send_message(message.chat.id, reply or bot_logic.NO_QUIZ_DATA_TEXT)
+
+    # Карточка завершена: назначаем следующее повторение слова; ответ
+    # только попадает в буфер, поэтому цикл событий не блокируется
+    if quality is not None and review:
+        answer_buffer.record_answer(review, quality, attempts)
+
+@bot.message_handler(content_types=["document"])
+async def handle_document(message):
+    cid = message.chat.id
+    refusal = bot_logic.check_import_document(message.document)
+    if refusal:
+        await bot.send_message(cid, refusal)
+        return
+
+    # COPY выполняется синхронным драйвером в отдельном потоке
+    url = await bot.get_file_url(message.document.file_id)
+    try:
+        result = await asyncio.to_thread(word_import.import_url, url, cid)
+    except Exception as e:
+        logger.error("Ошибка при импорте файла: %s", e)
+        await bot.send_message(cid, bot_logic.IMPORT_FAILED_TEXT)
+        return
+    await bot.send_message(cid, bot_logic.import_reply(result))
+    await send_main_menu(cid)
+
+bot.add_custom_filter(asyncio_filters.StateFilter(bot))
+
+# Время и ошибки каждого обработчика
+metrics.instrument_handlers(bot)
+
+async def main():
+    # Таблицы создаёт migrate.py; здесь только проверяем, что он выполнен
+    await db.check_schema_version()
+
+    # Метрики на METRICS_PORT, если порт задан
+    metrics.start_server()
+
+    logger.info('Start async telegram bot...')
+    try:
+        await bot.infinity_polling(timeout=10, request_timeout=15, skip_pending=True)
+    finally:
+        await asyncio.to_thread(answer_buffer.close)
+        await db.close_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""Повторное использование файлов, уже загруженных в Telegram.
+
+Файл, отправленный ботом, Telegram хранит у себя и возвращает его
+file_id; дальше достаточно отправлять file_id вместо содержимого. Здесь
+file_id запоминаются в памяти и в таблице bot_media (ключ - id бота, имя
+файла и хеш содержимого), поэтому после перезапуска файл снова не
+загружается, а после замены файла на диске загружается один раз заново.
+
+Содержимое файлов читается в память один раз при регистрации, пока
+file_id ещё нет.
+"""
+import hashlib
+import threading
+
+from handlers_db import get_media_file_id, save_media_file_id
+
+class MediaCache:
+    """file_id статических файлов бота.
+
+    bot_id - id бота или функция без аргументов, которая его возвращает;
+    функция вызывается при первом обращении к bot_media, поэтому модуль
+    бота можно импортировать без TOKEN.
+    """
+
+    def __init__(self, bot_id):
+        self._bot_id = bot_id
+        # имя -> (хеш содержимого, содержимое)
+        self._files = {}
+        self._file_ids = {}
+        # имя -> событие завершения загрузки, которую выполняет другой поток
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    @property
+    def bot_id(self):
+        if callable(self._bot_id):
+            self._bot_id = self._bot_id()
+        return self._bot_id
+
+    def register(self, name, path):
+        """Читает файл с диска; отправлять его можно будет по имени."""
+        with open(path, "rb") as f:
+            data = f.read()
+        self._files[name] = (hashlib.sha256(data).hexdigest(), data)
+
+    def data(self, name):
+        return self._files[name][1]
+
+    def file_id(self, name):
+        """file_id файла, если он уже загружен, иначе None."""
+        with self._lock:
+            file_id = self._file_ids.get(name)
+        if file_id is None:
+            file_id = get_media_file_id(self.bot_id, name, self._files[name][0])
+            if file_id is not None:
+                with self._lock:
+                    self._file_ids[name] = file_id
+        return file_id
+
+    def remember(self, name, file_id):
+        """Запоминает file_id, который Telegram вернул после загрузки."""
+        with self._lock:
+            self._file_ids[name] = file_id
+        save_media_file_id(self.bot_id, name, self._files[name][0], file_id)
+
+    def send_sticker(self, bot, outbox, chat_id, name):
+        """Отправляет стикер, загружая файл в Telegram не больше одного раза.
+
+        Пока file_id нет, первый поток загружает файл сам, а остальные ждут
+        его file_id; с известным file_id стикер уходит через outbox.
+        """
+        while True:
+            file_id = self.file_id(name)
+            if file_id is not None:
+                outbox.send_sticker(chat_id, file_id)
+                return
+
+            with self._lock:
+                upload = self._uploads.get(name)
+                uploading = upload is None
+                if uploading:
+                    upload = self._uploads[name] = threading.Event()
+            if not uploading:
+                # Если загрузка не удалась, следующий поток попробует сам
+                upload.wait()
+                continue
+
+            try:
+                message = bot.send_sticker(chat_id, self.data(name))
+                self.remember(name, message.sticker.file_id)
+                return
+            finally:
+                with self._lock:
+                    del self._uploads[name]
+                upload.set()
+
+def bot_id_from_token(token):
+    """id бота - часть токена до двоеточия; запрос к Bot API не нужен."""
+    return int(token.split(":", 1)[0])
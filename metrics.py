@@ -0,0 +1,278 @@
+"""Метрики бота в текстовом формате Prometheus.
+
+Что измеряется:
+
+- время и ошибки каждого обработчика сообщений (instrument_handlers);
+- время вызова каждой функции доступа к базе, число и время её запросов
+  (instrument_db; запросы считают курсор connection_db и журнал запросов
+  asyncpg в handlers_db_async);
+- соединения пулов, очередь исходящих сообщений, буфер ответов (gauge).
+
+Метрики отдаёт HTTP-сервер на METRICS_PORT (по умолчанию не запускается):
+GET /metrics. При METRICS_PROFILER=1 там же доступен выборочный
+профилировщик: GET /debug/profile?seconds=10 (см. profiler.py).
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Настройки сервера метрик
+metrics_host = os.getenv("METRICS_HOST", "0.0.0.0")
+metrics_port = int(os.getenv("METRICS_PORT", "0"))
+metrics_profiler = os.getenv("METRICS_PROFILER", "0") == "1"
+
+# Границы корзин гистограмм времени, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Дольше профилировщик не работает, сколько бы секунд ни запросили
+MAX_PROFILE_SECONDS = 60
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+class Counter:
+    """Счётчик, который только растёт."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self.labels, values, value) for values, value in items]
+
+class Histogram:
+    """Распределение значений по корзинам (обычно - время в секундах)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: [число значений по корзинам (последняя - +Inf), сумма]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(values, list(counts), total) for values, (counts, total) in self._values.items()]
+        names = self.labels + ("le",)
+        result = []
+        for values, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                result.append((f"{self.name}_bucket", names, values + (bound,), cumulative))
+            result.append((f"{self.name}_sum", self.labels, values, total))
+            result.append((f"{self.name}_count", self.labels, values, cumulative))
+        return result
+
+class Gauge:
+    """Текущее значение, которое считает функция при каждом чтении метрик.
+
+    fn возвращает число или словарь {кортеж значений меток: число}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.fn = fn
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.warning("Не удалось получить метрику %s: %s", self.name, e)
+            return []
+        if isinstance(value, dict):
+            return [(self.name, self.labels, values, number) for values, number in value.items()]
+        return [(self.name, self.labels, (), value)]
+
+def counter(name, help, labels=()):
+    """Возвращает счётчик name, создавая его при первом обращении."""
+    with _registry_lock:
+        return _registry.setdefault(name, Counter(name, help, labels))
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    """Возвращает гистограмму name, создавая её при первом обращении."""
+    with _registry_lock:
+        return _registry.setdefault(name, Histogram(name, help, labels, buckets))
+
+def gauge(name, help, fn, labels=()):
+    """Регистрирует показатель name; повторная регистрация заменяет fn."""
+    with _registry_lock:
+        _registry[name] = Gauge(name, help, fn, labels)
+
+def render():
+    """Все метрики в текстовом формате Prometheus."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, values, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels, values)} {value}")
+    return "\n".join(lines) + "\n"
+
+# # Обработчики и доступ к базе
+
+handler_seconds = histogram("bot_handler_seconds", "Время обработки сообщения", ("handler",))
+handler_errors = counter("bot_handler_errors_total", "Исключения в обработчиках сообщений", ("handler",))
+db_call_seconds = histogram("db_call_seconds", "Время вызова функции доступа к базе", ("function",))
+db_queries = counter("db_queries_total", "Запросы к базе данных по функциям доступа к базе", ("function",))
+db_query_seconds = histogram("db_query_seconds", "Время выполнения запроса к базе", ("function",))
+
+# Функция доступа к базе, которая выполняет запрос в текущем потоке или задаче
+_db_function = contextvars.ContextVar("db_function", default="other")
+
+def observe_query(seconds):
+    """Учитывает один выполненный запрос к базе."""
+    function = _db_function.get()
+    db_queries.inc(function)
+    db_query_seconds.observe(seconds, function)
+
+def _timed(func, label, seconds, errors=None, db_function=False):
+    """Оборачивает func (обычную или async) замером времени в seconds."""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _db_function.set(label) if db_function else None
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(label)
+                raise
+            finally:
+                seconds.observe(time.perf_counter() - start, label)
+                if token is not None:
+                    _db_function.reset(token)
+        return wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _db_function.set(label) if db_function else None
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if errors is not None:
+                errors.inc(label)
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - start, label)
+            if token is not None:
+                _db_function.reset(token)
+    return wrapper
+
+def instrument_handlers(bot):
+    """Добавляет замер времени ко всем зарегистрированным обработчикам сообщений бота.
+
+    Вызывается после объявления обработчиков (TeleBot или AsyncTeleBot).
+    """
+    for handler in bot.message_handlers:
+        func = handler["function"]
+        handler["function"] = _timed(func, func.__name__, handler_seconds, handler_errors)
+
+def instrument_db(namespace, exclude=()):
+    """Добавляет замер времени и учёт запросов к функциям модуля доступа к базе.
+
+    namespace - globals() модуля; оборачиваются его собственные публичные
+    функции, кроме перечисленных в exclude (например, без обращений к базе).
+    """
+    module = namespace["__name__"]
+    for name, value in list(namespace.items()):
+        if (inspect.isfunction(value) and value.__module__ == module
+                and not name.startswith("_") and name not in exclude):
+            namespace[name] = _timed(value, name, db_call_seconds, db_function=True)
+
+# # HTTP-сервер
+
+def _make_handler(profiler):
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/metrics":
+                self._reply(render(), "text/plain; version=0.0.4; charset=utf-8")
+            elif url.path == "/debug/profile" and profiler:
+                import profiler as sampling_profiler
+
+                query = parse_qs(url.query)
+                try:
+                    seconds = min(float(query.get("seconds", ["10"])[0]), MAX_PROFILE_SECONDS)
+                except ValueError:
+                    self._reply("seconds должно быть числом\n", "text/plain; charset=utf-8", 400)
+                    return
+                stacks = sampling_profiler.sample(seconds)
+                self._reply(sampling_profiler.collapsed(stacks), "text/plain; charset=utf-8")
+            else:
+                self._reply("", "text/plain", 404)
+
+        def _reply(self, text, content_type, code=200):
+            body = text.encode()
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsRequestHandler
+
+def start_server(host=metrics_host, port=metrics_port, profiler=metrics_profiler):
+    """Запускает сервер метрик в фоновом потоке.
+
+    Возвращает сервер (остановка - shutdown()) или None, если порт не задан.
+    """
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _make_handler(profiler))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Метрики на %s:%s/metrics", host, server.server_port)
+    return server
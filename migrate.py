@@ -0,0 +1,132 @@
+"""Создание и обновление схемы базы данных, заполнение общего словаря.
+
+Запуск: python migrate.py [--skip-seed]
+
+Бот таблицы не создаёт: при запуске он только проверяет версию схемы
+(handlers_db.SCHEMA_VERSION) и останавливается, если база старее. Команду
+выполняют перед первым запуском и перед обновлением бота. Одновременно
+запущенные копии (например, при старте нескольких реплик) работают по
+очереди под рекомендательной блокировкой PostgreSQL, и следующая видит,
+что схема уже актуальна.
+
+При обновлении схемы индексы поиска строятся через CREATE INDEX
+CONCURRENTLY, поэтому бот может продолжать работать с базой во время
+миграции; недостроенные после сбоя индексы пересоздаются. Затем в индекс
+вариантов ответа (word_distractors) добавляются слова, которых в нём ещё
+нет, - например, все слова базы, созданной до его появления.
+
+Общий словарь заполняется при каждом запуске (слова уже в базе не
+дублируются); --skip-seed пропускает этот шаг.
+"""
+import argparse
+import time
+
+from connection_db import create_connection
+from handlers_db import (
+    LOOKUP_INDEXES, MIGRATION_LOCK_ID, SCHEMA_VERSION, fill_common_words_table, index_distractors,
+    initialize_db, save_schema_version, schema_version
+)
+
+# Как часто пробовать взять блокировку миграции, пока её держит другая копия, секунды
+LOCK_RETRY_INTERVAL = 1
+
+def migrate_lookup_indexes():
+    """Строит индексы поиска без блокировки записи в таблицы."""
+    conn = create_connection()
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('words') IS NOT NULL")
+            if not cur.fetchone()[0]:
+                # Новая база: индексы создаст initialize_db вместе с таблицей
+                return
+
+            # Прерванная сборка оставляет невалидный индекс, который
+            # IF NOT EXISTS посчитал бы готовым
+            cur.execute("""
+                SELECT class.relname
+                FROM pg_index AS idx
+                JOIN pg_class AS class ON class.oid = idx.indexrelid
+                WHERE NOT idx.indisvalid AND class.relname = ANY(%s)
+            """, (list(LOOKUP_INDEXES),))
+            for (name,) in cur.fetchall():
+                print(f"Удаляю недостроенный индекс {name}...")
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+            # Операторные классы для триграммного индекса
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for name, query in LOOKUP_INDEXES.items():
+                print(f"Создаю индекс {name}...")
+                cur.execute(query.format(concurrently="CONCURRENTLY"))
+    finally:
+        conn.close()
+
+def migrate_distractors():
+    """Добавляет в word_distractors все слова, которых там ещё нет."""
+    print("Строю индекс вариантов ответа...")
+    print(f"Добавлено слов: {index_distractors()}")
+
+def acquire_migration_lock(conn):
+    """Ждёт рекомендательную блокировку миграции на соединении conn.
+
+    Блокировка берётся через pg_try_advisory_lock с паузами, а не через
+    ожидающий pg_advisory_lock: ожидающий запрос держал бы снимок данных,
+    и CREATE INDEX CONCURRENTLY копии, которая держит блокировку, ждал бы
+    его завершения - взаимная блокировка, которую PostgreSQL не видит.
+    """
+    waiting = False
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+            if cur.fetchone()[0]:
+                return
+        if not waiting:
+            print("Жду, пока закончится другая миграция...")
+            waiting = True
+        time.sleep(LOCK_RETRY_INTERVAL)
+
+def migrate(seed=True):
+    """Обновляет базу до SCHEMA_VERSION и заполняет общий словарь.
+
+    Всё выполняется, пока соединение lock держит рекомендательную
+    блокировку; она снимается при закрытии соединения, в том числе если
+    процесс упал.
+    """
+    lock = create_connection()
+    lock.autocommit = True
+    try:
+        # Ждём, пока закончит другая копия migrate.py
+        acquire_migration_lock(lock)
+        version = schema_version(lock)
+
+        if version < SCHEMA_VERSION:
+            print(f"Обновляю схему базы с версии {version} до {SCHEMA_VERSION}...")
+            # Индексы существующих таблиц - до initialize_db, чтобы та не
+            # строила их с блокировкой записи
+            migrate_lookup_indexes()
+            initialize_db()
+        else:
+            print(f"Схема базы актуальна (версия {version}).")
+
+        if seed:
+            print("Заполняю общий словарь...")
+            fill_common_words_table()
+
+        if version < SCHEMA_VERSION:
+            migrate_distractors()
+            # Версия отмечается последней: после сбоя миграция повторится
+            save_schema_version(lock)
+    finally:
+        lock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--skip-seed", action="store_true", help="не заполнять общий словарь")
+    args = parser.parse_args()
+
+    migrate(seed=not args.skip_seed)
+    print("Миграция завершена.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Очередь исходящих сообщений с учётом ограничений Telegram.
+
+Telegram ограничивает скорость отправки: около 30 сообщений в секунду на
+бота, примерно одно в секунду в личный чат и 20 в минуту в группу. При
+превышении Bot API отвечает 429 с retry_after, и синхронный обработчик
+ждёт. Здесь обработчики только ставят сообщение в очередь, а отправляют
+его фоновые потоки:
+
+- скорость ограничивают корзины токенов - общая и у каждого чата;
+- сообщения одного чата уходят по порядку, между чатами первыми идут
+  более срочные (карточки раньше меню);
+- после 429 чат ждёт retry_after секунд, сообщение отправляется снова;
+- подряд идущие текстовые сообщения одного чата, ещё не отправленные,
+  склеиваются в одно (например, "слово добавлено" и меню).
+
+Для проверки без Telegram адрес Bot API задаётся в TELEGRAM_API_URL
+(см. main.py), например, адрес тестового сервера.
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from requests.exceptions import RequestException
+from telebot.apihelper import ApiTelegramException
+
+# Ограничения отправки
+outbox_global_rate = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+outbox_chat_rate = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+outbox_chat_burst = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+outbox_group_rate = float(os.getenv("OUTBOX_GROUP_RATE", str(20 / 60)))
+outbox_workers = int(os.getenv("OUTBOX_WORKERS", "4"))
+outbox_max_retries = int(os.getenv("OUTBOX_MAX_RETRIES", "3"))
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: чем меньше, тем раньше
+CARD = 0
+REPLY = 1
+MENU = 2
+
+# Предел длины текста сообщения в Telegram
+MAX_TEXT_LENGTH = 4096
+
+# Сколько чатов помнить для ограничения скорости
+_MAX_CHAT_BUCKETS = 100000
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity."""
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def delay(self, now):
+        """Через сколько секунд будет доступен токен (0 - доступен сейчас)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class _Send:
+    """Одно исходящее сообщение."""
+
+    def __init__(self, method, chat_id, priority, kwargs):
+        self.method = method
+        self.chat_id = chat_id
+        self.priority = priority
+        self.kwargs = kwargs
+        self.attempts = 0
+
+    def merge(self, other):
+        """Склеивает с следующим текстом того же чата; False, если нельзя."""
+        if self.method != "send_message" or other.method != "send_message":
+            return False
+        if self.kwargs.get("parse_mode") != other.kwargs.get("parse_mode"):
+            return False
+        text = f"{self.kwargs['text']}\n\n{other.kwargs['text']}"
+        if len(text) > MAX_TEXT_LENGTH:
+            return False
+        self.kwargs["text"] = text
+        # Клавиатура последнего сообщения всё равно заменила бы предыдущую
+        if other.kwargs.get("reply_markup") is not None:
+            self.kwargs["reply_markup"] = other.kwargs["reply_markup"]
+        self.priority = min(self.priority, other.priority)
+        return True
+
+class Outbox:
+    """Планировщик отправки сообщений бота (см. описание модуля).
+
+    Чат, у которого есть неотправленные сообщения, находится ровно в одном
+    месте: в очереди готовых чатов (по приоритету первого сообщения), в
+    очереди ожидающих (по времени, когда можно отправлять) или у потока,
+    который отправляет его сообщение.
+    """
+
+    def __init__(self, bot, workers=outbox_workers, global_rate=outbox_global_rate,
+                 chat_rate=outbox_chat_rate, chat_burst=outbox_chat_burst,
+                 group_rate=outbox_group_rate, max_retries=outbox_max_retries, clock=time.monotonic):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._clock = clock
+        self._global = TokenBucket(global_rate, global_rate, clock())
+        self._buckets = OrderedDict()
+        self._chats = {}
+        self._ready = []
+        self._delayed = []
+        self._seq = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"outbox-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def send_message(self, chat_id, text, reply_markup=None, parse_mode=None, priority=REPLY):
+        self._put(_Send("send_message", chat_id, priority,
+                        {"text": text, "reply_markup": reply_markup, "parse_mode": parse_mode}))
+
+    def send_sticker(self, chat_id, sticker, priority=REPLY):
+        """sticker - file_id или содержимое файла (bytes)."""
+        self._put(_Send("send_sticker", chat_id, priority, {"sticker": sticker}))
+
+    def pending(self):
+        """Сколько сообщений ждут отправки."""
+        with self._cond:
+            return sum(len(queue) for queue in self._chats.values())
+
+    def close(self):
+        """Отправляет уже поставленные сообщения и останавливает потоки."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _put(self, item):
+        with self._cond:
+            queue = self._chats.get(item.chat_id)
+            if queue is None:
+                self._chats[item.chat_id] = deque([item])
+                self._push_ready(item.chat_id, item.priority)
+            elif not (queue and queue[-1].merge(item)):
+                queue.append(item)
+            self._cond.notify()
+
+    def _push_ready(self, chat_id, priority):
+        self._seq += 1
+        heapq.heappush(self._ready, (priority, self._seq, chat_id))
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # У групп и каналов id отрицательные
+            rate = self.chat_rate if chat_id > 0 else self.group_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.chat_burst, now)
+            if len(self._buckets) > _MAX_CHAT_BUCKETS:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(chat_id)
+        return bucket
+
+    def _next(self):
+        """Ждёт, пока можно отправить следующее сообщение; None - очередь закрыта и пуста."""
+        with self._cond:
+            while True:
+                now = self._clock()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, chat_id = heapq.heappop(self._delayed)
+                    self._push_ready(chat_id, self._chats[chat_id][0].priority)
+
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                if self._ready:
+                    wait = self._global.delay(now)
+                    if wait == 0:
+                        _, _, chat_id = heapq.heappop(self._ready)
+                        chat_wait = self._bucket(chat_id, now).delay(now)
+                        if chat_wait > 0:
+                            heapq.heappush(self._delayed, (now + chat_wait, chat_id))
+                            continue
+                        self._bucket(chat_id, now).take()
+                        self._global.take()
+                        return self._chats[chat_id].popleft()
+                    timeout = wait if timeout is None else min(timeout, wait)
+                elif self._closed and not self._chats:
+                    return None
+                self._cond.wait(timeout)
+
+    def _done(self, item, retry_after=None):
+        with self._cond:
+            queue = self._chats[item.chat_id]
+            if retry_after is not None:
+                queue.appendleft(item)
+                heapq.heappush(self._delayed, (self._clock() + retry_after, item.chat_id))
+            elif queue:
+                self._push_ready(item.chat_id, queue[0].priority)
+            else:
+                del self._chats[item.chat_id]
+            self._cond.notify_all()
+
+    def _send(self, item):
+        """Отправляет сообщение; возвращает через сколько секунд повторить или None."""
+        try:
+            getattr(self.bot, item.method)(item.chat_id, **item.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                return float((e.result_json.get("parameters") or {}).get("retry_after", 1))
+            # Бот заблокирован, чат не найден и т.п.: повтор не поможет
+            logger.warning("Сообщение в чат %s не отправлено: %s", item.chat_id, e.description)
+        except RequestException as e:
+            item.attempts += 1
+            if item.attempts <= self.max_retries:
+                return min(2 ** item.attempts, 30)
+            logger.warning("Сообщение в чат %s не отправлено: %s", item.chat_id, e)
+        return None
+
+    def _work(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            retry_after = None
+            try:
+                retry_after = self._send(item)
+            except Exception as e:
+                logger.error("Ошибка при отправке в чат %s: %s", item.chat_id, e)
+            finally:
+                self._done(item, retry_after)
@@ -0,0 +1,43 @@
+"""Интервальные повторения по алгоритму SM-2.
+
+У каждого слова в словаре пользователя есть лёгкость (ease), интервал до
+следующего повторения в днях и число правильных ответов подряд (streak).
+После ответа они пересчитываются функцией review, а слово получает время
+следующего повторения; карточки загадывают слова в порядке этого времени.
+"""
+
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+# Интервал растёт геометрически; ограничиваем, чтобы время повторения оставалось в пределах TIMESTAMP
+MAX_INTERVAL_DAYS = 36500.0
+
+# Пропущенная карточка откладывается ненадолго, параметры повторения не меняются
+SKIP_DELAY_MINUTES = 10
+
+# Оценка ответа: 5 - с первой попытки, 4 - со второй, 3 - с третьей, 1 - не угадал
+FAILED_QUALITY = 1
+MIN_PASSING_QUALITY = 3
+
+def quality_from_attempts(correct, attempts):
+    """Оценка ответа по SM-2 (0-5) по числу неудачных попыток перед ним."""
+    if not correct:
+        return FAILED_QUALITY
+    return max(MIN_PASSING_QUALITY, 5 - attempts)
+
+def review(ease, interval, streak, quality):
+    """Пересчитывает (ease, interval, streak) после ответа с оценкой quality.
+
+    При оценке ниже 3 слово начинает повторяться заново с интервалом в
+    день, лёгкость не меняется.
+    """
+    if quality < MIN_PASSING_QUALITY:
+        return ease, 1.0, 0
+
+    if streak == 0:
+        interval = 1.0
+    elif streak == 1:
+        interval = 6.0
+    else:
+        interval = min(interval * ease, MAX_INTERVAL_DAYS)
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return ease, interval, streak + 1
@@ -0,0 +1,286 @@
+"""Хранилища состояний диалогов (MyStates и данные карточки).
+
+StateMemoryStorage из pyTelegramBotAPI держит состояния в памяти процесса:
+после перезапуска все начатые карточки теряются, а несколько процессов
+бота не видят состояния друг друга. Здесь - общее хранилище в PostgreSQL
+(таблица bot_states) и выбор хранилища через переменную STATE_STORAGE:
+
+- memory - StateMemoryStorage (по умолчанию);
+- postgres - StatePostgresStorage;
+- redis - StateRedisStorage из pyTelegramBotAPI (нужен пакет redis,
+  адрес в REDIS_URL; для проверки подходит любой Redis-совместимый сервер).
+
+Для AsyncTeleBot (main_async.py) те же хранилища создает
+create_async_state_storage.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from telebot import asyncio_storage
+from telebot.storage import StateMemoryStorage, StateRedisStorage
+from telebot.storage.base_storage import StateStorageBase, StateDataContext
+
+from connection_db import get_db_connection
+
+# Настройки хранилища состояний
+state_storage_backend = os.getenv("STATE_STORAGE", "memory")
+state_ttl = int(os.getenv("STATE_TTL", str(24 * 60 * 60)))
+state_batch_size = int(os.getenv("STATE_BATCH_SIZE", "500"))
+state_purge_interval = float(os.getenv("STATE_PURGE_INTERVAL", "600"))
+redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+class _Batcher:
+    """Собирает одновременные запросы и выполняет их одной пачкой.
+
+    Пока выполняется одна пачка, новые запросы копятся и уходят следующей,
+    поэтому под нагрузкой число обращений к базе растёт медленнее числа
+    запросов, а без нагрузки лишней задержки нет. Вызывающий поток ждёт
+    результата своего запроса.
+    """
+
+    def __init__(self, run, max_size, name):
+        self._run = run
+        self._max_size = max_size
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def call(self, item):
+        future = Future()
+        with self._cond:
+            self._pending.append((item, future))
+            self._cond.notify()
+        return future.result()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                batch = self._pending[:self._max_size]
+                del self._pending[:self._max_size]
+
+            try:
+                results = self._run([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+class StatePostgresStorage(StateStorageBase):
+    """Хранилище состояний в таблице bot_states, общее для всех процессов бота.
+
+    Одна строка на пару чат-пользователь: ключ, имя состояния и данные в
+    JSONB. Строка живёт ttl секунд с последней записи; просроченные строки
+    не читаются и периодически удаляются. Чтения и записи разных чатов,
+    пришедшие одновременно, объединяются в один запрос.
+    """
+
+    def __init__(self, ttl=state_ttl, batch_size=state_batch_size,
+                 purge_interval=state_purge_interval, prefix="telebot", separator=":"):
+        self.ttl = ttl
+        self.prefix = prefix
+        self.separator = separator
+        self.purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+        self._reads = _Batcher(self._read_batch, batch_size, "state-reads")
+        self._writes = _Batcher(self._write_batch, batch_size, "state-writes")
+
+    def _key(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return self._get_key(chat_id, user_id, self.prefix, self.separator,
+                             business_connection_id, message_thread_id, bot_id)
+
+    def _read_batch(self, keys):
+        """Читает строки для списка ключей одним запросом."""
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT key, state, data FROM bot_states
+                    WHERE key = ANY(%s) AND expires_at > CURRENT_TIMESTAMP
+                """, (list(set(keys)),))
+                rows = {key: (state, data) for key, state, data in cur.fetchall()}
+        return [rows.get(key) for key in keys]
+
+    def _write_batch(self, ops):
+        """Выполняет пачку изменений одним обращением к базе.
+
+        Если ключ встречается в пачке повторно, пачка делится, чтобы
+        изменения одного ключа применялись по порядку.
+        """
+        chunks, chunk, keys = [], [], set()
+        for op in ops:
+            if op[1] in keys:
+                chunks.append(chunk)
+                chunk, keys = [], set()
+            chunk.append(op)
+            keys.add(op[1])
+        chunks.append(chunk)
+
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                for chunk in chunks:
+                    self._apply(cur, chunk)
+                if time.monotonic() - self._last_purge > self.purge_interval:
+                    cur.execute("DELETE FROM bot_states WHERE expires_at < CURRENT_TIMESTAMP")
+                    self._last_purge = time.monotonic()
+                conn.commit()
+        return [True] * len(ops)
+
+    def _apply(self, cur, ops):
+        deletes = [key for action, key, _ in ops if action == "delete"]
+        states = [(key, value) for action, key, value in ops if action == "state"]
+        replaces = [(key, json.dumps(value)) for action, key, value in ops if action == "replace"]
+        merges = [(key, json.dumps(value)) for action, key, value in ops if action == "merge"]
+
+        queries, params = [], []
+        if deletes:
+            queries.append("DELETE FROM bot_states WHERE key = ANY(%s);")
+            params.append(deletes)
+        if states:
+            # Просроченная строка начинается заново, без старых данных
+            queries.append("""
+                INSERT INTO bot_states AS s (key, state, data, expires_at)
+                SELECT key, state, '{}', CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                FROM unnest(%s::TEXT[], %s::TEXT[]) AS t(key, state)
+                ON CONFLICT (key) DO UPDATE SET
+                    state = EXCLUDED.state,
+                    data = CASE WHEN s.expires_at > CURRENT_TIMESTAMP THEN s.data ELSE '{}' END,
+                    expires_at = EXCLUDED.expires_at;
+            """)
+            params.extend([self.ttl, [k for k, _ in states], [v for _, v in states]])
+        for rows, expression in ((replaces, "t.data::JSONB"), (merges, "s.data || t.data::JSONB")):
+            if rows:
+                queries.append(f"""
+                    UPDATE bot_states AS s
+                    SET data = {expression},
+                        expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                    FROM unnest(%s::TEXT[], %s::TEXT[]) AS t(key, data)
+                    WHERE s.key = t.key AND s.expires_at > CURRENT_TIMESTAMP;
+                """)
+                params.extend([self.ttl, [k for k, _ in rows], [v for _, v in rows]])
+        cur.execute("\n".join(queries), params)
+
+    def set_state(self, chat_id, user_id, state, business_connection_id=None,
+                  message_thread_id=None, bot_id=None):
+        if hasattr(state, "name"):
+            state = state.name
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        return self._writes.call(("state", key, state))
+
+    def get_state(self, chat_id, user_id, business_connection_id=None,
+                  message_thread_id=None, bot_id=None):
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        row = self._reads.call(key)
+        return row[0] if row else None
+
+    def delete_state(self, chat_id, user_id, business_connection_id=None,
+                     message_thread_id=None, bot_id=None):
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        return self._writes.call(("delete", key, None))
+
+    def set_data(self, chat_id, user_id, key, value, business_connection_id=None,
+                 message_thread_id=None, bot_id=None):
+        state_key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        return self._writes.call(("merge", state_key, {key: value}))
+
+    def get_data(self, chat_id, user_id, business_connection_id=None,
+                 message_thread_id=None, bot_id=None):
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        row = self._reads.call(key)
+        return row[1] if row else {}
+
+    def reset_data(self, chat_id, user_id, business_connection_id=None,
+                   message_thread_id=None, bot_id=None):
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        return self._writes.call(("replace", key, {}))
+
+    def get_interactive_data(self, chat_id, user_id, business_connection_id=None,
+                             message_thread_id=None, bot_id=None):
+        return StateDataContext(self, chat_id=chat_id, user_id=user_id,
+                                business_connection_id=business_connection_id,
+                                message_thread_id=message_thread_id, bot_id=bot_id)
+
+    def save(self, chat_id, user_id, data, business_connection_id=None,
+             message_thread_id=None, bot_id=None):
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        return self._writes.call(("replace", key, data))
+
+class AsyncStatePostgresStorage(asyncio_storage.StateStorageBase):
+    """StatePostgresStorage для AsyncTeleBot.
+
+    Вызовы выполняются в потоках asyncio.to_thread, поэтому цикл событий не
+    ждёт базу, а одновременные запросы разных чатов по-прежнему
+    объединяются в пачки.
+    """
+
+    def __init__(self, ttl=state_ttl, batch_size=state_batch_size,
+                 purge_interval=state_purge_interval, prefix="telebot", separator=":"):
+        self.storage = StatePostgresStorage(ttl, batch_size, purge_interval, prefix, separator)
+
+    async def set_state(self, chat_id, user_id, state, business_connection_id=None,
+                        message_thread_id=None, bot_id=None):
+        return await asyncio.to_thread(self.storage.set_state, chat_id, user_id, state,
+                                       business_connection_id, message_thread_id, bot_id)
+
+    async def get_state(self, chat_id, user_id, business_connection_id=None,
+                        message_thread_id=None, bot_id=None):
+        return await asyncio.to_thread(self.storage.get_state, chat_id, user_id,
+                                       business_connection_id, message_thread_id, bot_id)
+
+    async def delete_state(self, chat_id, user_id, business_connection_id=None,
+                           message_thread_id=None, bot_id=None):
+        return await asyncio.to_thread(self.storage.delete_state, chat_id, user_id,
+                                       business_connection_id, message_thread_id, bot_id)
+
+    async def set_data(self, chat_id, user_id, key, value, business_connection_id=None,
+                       message_thread_id=None, bot_id=None):
+        return await asyncio.to_thread(self.storage.set_data, chat_id, user_id, key, value,
+                                       business_connection_id, message_thread_id, bot_id)
+
+    async def get_data(self, chat_id, user_id, business_connection_id=None,
+                       message_thread_id=None, bot_id=None):
+        return await asyncio.to_thread(self.storage.get_data, chat_id, user_id,
+                                       business_connection_id, message_thread_id, bot_id)
+
+    async def reset_data(self, chat_id, user_id, business_connection_id=None,
+                         message_thread_id=None, bot_id=None):
+        return await asyncio.to_thread(self.storage.reset_data, chat_id, user_id,
+                                       business_connection_id, message_thread_id, bot_id)
+
+    def get_interactive_data(self, chat_id, user_id, business_connection_id=None,
+                             message_thread_id=None, bot_id=None):
+        return asyncio_storage.StateDataContext(self, chat_id=chat_id, user_id=user_id,
+                                                business_connection_id=business_connection_id,
+                                                message_thread_id=message_thread_id, bot_id=bot_id)
+
+    async def save(self, chat_id, user_id, data, business_connection_id=None,
+                   message_thread_id=None, bot_id=None):
+        return await asyncio.to_thread(self.storage.save, chat_id, user_id, data,
+                                       business_connection_id, message_thread_id, bot_id)
+
+def create_state_storage(backend=state_storage_backend):
+    """Создает хранилище состояний по имени: memory, postgres или redis."""
+    if backend == "memory":
+        return StateMemoryStorage()
+    if backend == "postgres":
+        return StatePostgresStorage()
+    if backend == "redis":
+        return StateRedisStorage(redis_url=redis_url)
+    raise ValueError(f"Неизвестное хранилище состояний: {backend}")
+
+def create_async_state_storage(backend=state_storage_backend):
+    """Создает хранилище состояний для AsyncTeleBot: memory, postgres или redis."""
+    if backend == "memory":
+        return asyncio_storage.StateMemoryStorage()
+    if backend == "postgres":
+        return AsyncStatePostgresStorage()
+    if backend == "redis":
+        return asyncio_storage.StateRedisStorage(redis_url=redis_url)
+    raise ValueError(f"Неизвестное хранилище состояний: {backend}")
@@ -0,0 +1,231 @@
+"""Запуск бота в нескольких процессах с разделением чатов.
+
+Запуск: python supervisor.py (BOT_MODE=polling или webhook, как у main.py)
+
+Один процесс бота упирается в одно ядро. Здесь главный процесс только
+получает обновления от Telegram (long polling или вебхук) и раскладывает
+их по SUPERVISOR_WORKERS рабочим процессам: чат с id c всегда попадает в
+процесс c % SUPERVISOR_WORKERS. Каждый рабочий процесс - обычный main.py
+со своими кэшами, очередью карточек, состояниями MyStates и пулом
+соединений. Все обновления чата обрабатывает один процесс по порядку,
+поэтому состояния диалога разных процессов не пересекаются даже при
+STATE_STORAGE=memory.
+
+Ограничение Telegram на число сообщений в секунду общее для бота, поэтому
+OUTBOX_GLOBAL_RATE делится между процессами. Соединений с базой будет до
+SUPERVISOR_WORKERS * DB_POOL_MAX_SIZE.
+
+Упавший рабочий процесс перезапускается с новой очередью: обновления из
+его старой очереди и взятые им в обработку теряются (процесс, убитый во
+время чтения очереди, оставляет её заблокированной). При изменении
+SUPERVISOR_WORKERS чаты распределяются заново: незаконченные диалоги в
+памяти процессов (STATE_STORAGE=memory) при этом сбрасываются.
+
+Если задан METRICS_PORT, главный процесс отдаёт метрики на этом порту, а
+рабочий процесс i - на METRICS_PORT + 1 + i.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+import telebot
+from telebot import apihelper, types
+
+import metrics
+from log_config import setup_logging
+from webhook import UpdateDispatcher, chat_id_of_json, json_update, serve_webhook, submit_waiting
+
+# Настройки
+supervisor_workers = int(os.getenv("SUPERVISOR_WORKERS", str(os.cpu_count() or 1)))
+supervisor_queue_size = int(os.getenv("SUPERVISOR_QUEUE_SIZE", "1000"))
+supervisor_enqueue_timeout = float(os.getenv("SUPERVISOR_ENQUEUE_TIMEOUT", "1"))
+
+# Как часто проверять, живы ли рабочие процессы, секунды
+_CHECK_INTERVAL = 1
+
+# Наибольшая пауза между попытками getUpdates после ошибок, секунды
+_MAX_POLLING_BACKOFF = 30
+
+logger = logging.getLogger(__name__)
+
+_restarts = metrics.counter("supervisor_worker_restarts_total", "Перезапуски рабочих процессов", ("worker",))
+
+def _worker_main(index, workers, updates):
+    """Рабочий процесс: обрабатывает обновления своей доли чатов."""
+    # Остановку по Ctrl+C или SIGTERM (например, от systemd) получает вся
+    # группа процессов; рабочий процесс дорабатывает очередь, пока главный
+    # не пришлёт None
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # Обработчики выполняет UpdateDispatcher, как в режиме вебхука
+    os.environ["BOT_MODE"] = "webhook"
+    global_rate = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+    os.environ["OUTBOX_GLOBAL_RATE"] = str(global_rate / workers)
+
+    import answer_buffer
+    import main
+
+    if metrics.metrics_port:
+        metrics.start_server(port=metrics.metrics_port + 1 + index)
+    dispatcher = UpdateDispatcher(main.bot.process_new_updates)
+    dispatcher.start()
+    metrics.gauge("webhook_pending_updates", "Принятые обновления, ждущие обработки", dispatcher.pending)
+    logger.info("Worker %s of %s started", index, workers)
+    try:
+        while True:
+            item = updates.get()
+            if item is None:
+                break
+            update = types.Update.de_json(item)
+            # Очереди обработчиков заполнены: ждём, обновления остаются в очереди процесса
+            submit_waiting(dispatcher, update)
+    finally:
+        dispatcher.stop()
+        main.import_executor.shutdown()
+        main.outbox.close()
+        answer_buffer.close()
+
+class ShardRouter:
+    """Рабочие процессы и распределение обновлений между ними по id чата."""
+
+    def __init__(self, workers=supervisor_workers, queue_size=supervisor_queue_size,
+                 enqueue_timeout=supervisor_enqueue_timeout):
+        self.workers = workers
+        self.enqueue_timeout = enqueue_timeout
+        # Отдельный интерпретатор для каждого процесса: fork копировал бы
+        # потоки и соединения главного процесса
+        self._context = multiprocessing.get_context("spawn")
+        self.queue_size = queue_size
+        self._queues = [None] * workers
+        self._processes = [None] * workers
+        self._stopping = threading.Event()
+        self._monitor = threading.Thread(target=self._watch, name="supervisor-monitor", daemon=True)
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        self._monitor.start()
+
+    def stop(self):
+        """Дожидается, пока рабочие процессы обработают свои очереди."""
+        self._stopping.set()
+        self._monitor.join()
+        for q in self._queues:
+            q.put(None)
+        for process in self._processes:
+            process.join()
+
+    def pending(self):
+        """Сколько обновлений ждут в очередях рабочих процессов (по процессам).
+
+        На macOS размер multiprocessing.Queue недоступен, тогда показатель пуст.
+        """
+        try:
+            return {(str(index),): q.qsize() for index, q in enumerate(self._queues)}
+        except NotImplementedError:
+            return {}
+
+    def shard_of(self, item):
+        """Номер рабочего процесса для обновления в виде JSON."""
+        try:
+            key = chat_id_of_json(item)
+        except (KeyError, TypeError, AttributeError):
+            key = None
+        if key is None:
+            key = item["update_id"]
+        return key % self.workers
+
+    def submit(self, item):
+        """Ставит обновление в очередь его процесса.
+
+        Возвращает False, если очередь не освободилась за enqueue_timeout.
+        """
+        try:
+            self._queues[self.shard_of(item)].put(item, timeout=self.enqueue_timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def _spawn(self, index):
+        self._queues[index] = self._context.Queue(maxsize=self.queue_size)
+        process = self._context.Process(
+            target=_worker_main, args=(index, self.workers, self._queues[index]),
+            name=f"bot-worker-{index}", daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _watch(self):
+        while not self._stopping.wait(_CHECK_INTERVAL):
+            for index, process in enumerate(self._processes):
+                if not process.is_alive() and not self._stopping.is_set():
+                    logger.error("Worker %s exited with code %s, restarting", index, process.exitcode)
+                    _restarts.inc(str(index))
+                    self._spawn(index)
+
+def poll_updates(token, router, skip_pending=True):
+    """Получает обновления через getUpdates и раздаёт их рабочим процессам."""
+    offset = None
+    if skip_pending:
+        # Как infinity_polling(skip_pending=True): пропускаем накопившиеся обновления
+        pending = apihelper.get_updates(token, offset=-1)
+        if pending:
+            offset = pending[-1]["update_id"] + 1
+    backoff = 0
+    while True:
+        try:
+            items = apihelper.get_updates(token, offset=offset, timeout=10, long_polling_timeout=5)
+            backoff = 0
+        except Exception as e:
+            backoff = min(max(backoff * 2, 1), _MAX_POLLING_BACKOFF)
+            logger.error("Ошибка при получении обновлений: %s", e)
+            time.sleep(backoff)
+            continue
+        for item in items:
+            # Ждём места в очереди процесса: Telegram не торопит long polling
+            submit_waiting(router, item)
+            offset = item["update_id"] + 1
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+def main():
+    from connection_db import close_pool
+    from handlers_db import check_schema_version
+
+    setup_logging()
+    signal.signal(signal.SIGTERM, _terminate)
+
+    # Адрес Bot API можно заменить так же, как в main.py
+    if os.getenv("TELEGRAM_API_URL"):
+        apihelper.API_URL = os.getenv("TELEGRAM_API_URL")
+    token = os.getenv("TOKEN")
+    bot_mode = os.getenv("BOT_MODE", "polling")
+
+    # Схему проверяем один раз, до запуска рабочих процессов
+    check_schema_version()
+    close_pool()
+
+    router = ShardRouter()
+    router.start()
+    metrics.gauge("supervisor_pending_updates", "Обновления в очередях рабочих процессов",
+                  router.pending, ("worker",))
+    metrics.start_server()
+    logger.info("Supervisor started %s workers (%s)", router.workers, bot_mode)
+    try:
+        if bot_mode == "webhook":
+            # Тело запроса не разбирается: процессу достаточно id чата
+            serve_webhook(telebot.TeleBot(token, threaded=False), router, decode=json_update)
+        else:
+            poll_updates(token, router)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        router.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Проверки cache_db.LRUCache."""
+import pytest
+
+import cache_db
+from cache_db import LRUCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_db.time, "monotonic", clock)
+    return clock
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert len(cache) == 2
+
+def test_max_bytes_evicts_oldest():
+    cache = LRUCache(max_entries=10, max_bytes=100)
+    cache.set("a", 1, size=40)
+    cache.set("b", 2, size=40)
+    cache.set("c", 3, size=40)
+    assert cache.get("a") is None
+    assert cache.bytes == 80
+    # Замена значения учитывает новый размер, а не сумму
+    cache.set("b", 4, size=10)
+    assert cache.bytes == 50
+
+def test_entry_larger_than_max_bytes_is_not_stored():
+    cache = LRUCache(max_entries=10, max_bytes=100)
+    cache.set("a", 1, size=50)
+    assert cache.set("b", 2, size=101) is False
+    assert cache.get("a") == 1
+    assert cache.bytes == 50
+
+def test_ttl(clock):
+    cache = LRUCache(max_entries=10, max_bytes=100, ttl=60)
+    cache.set("a", 1, size=10)
+    clock.now = 59
+    assert cache.get("a") == 1
+    clock.now = 61
+    assert cache.get("a") is None
+    assert (len(cache), cache.bytes) == (0, 0)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_invalidate_rejects_value_read_before_it():
+    cache = LRUCache(max_entries=10)
+    cache.set("a", "old")
+    generation = cache.generation("a")
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert cache.set("a", "stale", generation=generation) is False
+    assert cache.get("a") is None
+    assert cache.set("a", "fresh", generation=cache.generation("a")) is True
+    assert cache.get("a") == "fresh"
+
+def test_generations_are_bounded_by_epoch():
+    cache = LRUCache(max_entries=2)
+    generation = cache.generation("a")
+    for key in ("b", "c"):
+        cache.invalidate(key)
+    # Поколения "b" и "c" сброшены, но прочитанное до этого снова не годится
+    cache.invalidate("d")
+    assert len(cache._generations) == 1
+    assert cache.set("a", 1, generation=generation) is False
+    assert cache.set("a", 1, generation=cache.generation("a")) is True
+
+def test_clear_starts_new_epoch():
+    cache = LRUCache(max_entries=10, max_bytes=100)
+    cache.set("a", 1, size=10)
+    generation = cache.generation("a")
+    cache.clear()
+    assert (len(cache), cache.bytes) == (0, 0)
+    assert cache.set("a", 1, size=10, generation=generation) is False
+
+def test_invalidate_vocabulary_notifies_listeners(monkeypatch):
+    calls = []
+    monkeypatch.setattr(cache_db, "_invalidation_listeners", [calls.append])
+    cache_db.set_vocabulary(7, [("cat", "кошка")])
+    cache_db.invalidate_vocabulary(7)
+    cache_db.invalidate_vocabulary(None)
+    cache_db.clear_vocabularies()
+    assert cache_db.get_vocabulary(7) is None
+    assert calls == [7, None]
@@ -0,0 +1,117 @@
+"""Проверки порядковых номеров user_words на временном кластере PostgreSQL.
+
+Нужны программы сервера PostgreSQL (initdb, pg_ctl) и расширение pg_trgm,
+как для benchmarks/load_test.py; без них, а также под root (initdb не
+запускается от root) проверки пропускаются.
+"""
+import os
+import threading
+
+import pytest
+
+import connection_db
+from benchmarks.load_test import DisposablePostgres
+from handlers_db import (
+    RelationStatus, add_word_for_user, delete_user_word, ensure_user_exists, import_words
+)
+
+WORDS = 30
+
+@pytest.fixture(scope="module")
+def database():
+    if os.geteuid() == 0:
+        pytest.skip("initdb не запускается от root")
+    try:
+        server = DisposablePostgres()
+    except SystemExit:
+        pytest.skip("не найден initdb")
+    server.start()
+    settings = server.environ()
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(connection_db, "db_name", settings["DB_NAME"])
+        patch.setattr(connection_db, "db_user", settings["DB_USER"])
+        patch.setattr(connection_db, "db_password", settings["DB_PASSWORD"])
+        patch.setattr(connection_db, "db_host", settings["DB_HOST"])
+        patch.setattr(connection_db, "db_port", settings["DB_PORT"])
+        patch.setattr(connection_db, "_pool", None)
+        try:
+            from migrate import migrate
+            migrate(seed=False)
+            import_words((f"word{n}", f"слово{n}") for n in range(WORDS))
+            yield
+        finally:
+            connection_db.close_pool()
+            server.stop()
+
+_next_cid = iter(range(1, 1_000_000))
+
+@pytest.fixture
+def cid(database):
+    """Новый пользователь, связанный со всеми словами словаря."""
+    cid = next(_next_cid)
+    ensure_user_exists(cid, f"user{cid}")
+    return cid
+
+def ordinals(cid):
+    with connection_db.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT ordinal FROM user_words
+                JOIN users ON users.id = user_words.user_id
+                WHERE users.user_id = %s
+                ORDER BY ordinal
+            """, (cid,))
+            return [ordinal for (ordinal,) in cur.fetchall()]
+
+def assert_contiguous(cid):
+    numbers = ordinals(cid)
+    assert numbers == list(range(1, len(numbers) + 1))
+    return len(numbers)
+
+def test_enrollment_numbers_all_words(cid):
+    assert assert_contiguous(cid) >= WORDS
+
+def test_inserts_and_deletes_keep_numbers_contiguous(cid):
+    total = assert_contiguous(cid)
+    # Из середины, первое и последнее по номеру
+    for word in ("word15", "word0", f"word{WORDS - 1}"):
+        assert delete_user_word(cid, word) == RelationStatus.DELETED
+        total -= 1
+        assert assert_contiguous(cid) == total
+    for n in range(3):
+        assert add_word_for_user(cid, f"new{cid}x{n}", "новое") == RelationStatus.ADDED
+        total += 1
+        assert assert_contiguous(cid) == total
+    assert delete_user_word(cid, f"new{cid}x1") == RelationStatus.DELETED
+    assert assert_contiguous(cid) == total - 1
+
+def test_import_for_user_keeps_numbers_contiguous(cid):
+    total = assert_contiguous(cid)
+    delete_user_word(cid, "word3")
+    delete_user_word(cid, "word7")
+    read, added, linked = import_words(
+        [("word3", "слово3"), ("word7", "слово7"), (f"imported{cid}", "импорт"), ("word3", "повтор")],
+        cid=cid)
+    assert (read, added, linked) == (4, 1, 3)
+    assert assert_contiguous(cid) == total + 1
+
+def test_concurrent_changes_keep_numbers_contiguous(cid):
+    errors = []
+
+    def change(worker):
+        try:
+            for n in range(10):
+                add_word_for_user(cid, f"concurrent{cid}x{worker}x{n}", "параллельно")
+                delete_user_word(cid, f"word{(worker * 10 + n) % WORDS}")
+                if n % 3 == 0:
+                    delete_user_word(cid, f"concurrent{cid}x{worker}x{n}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=change, args=(worker,)) for worker in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert_contiguous(cid)
@@ -0,0 +1,220 @@
+"""Проверки outbox.Outbox с заглушкой бота и управляемыми часами."""
+import threading
+import time
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from outbox import CARD, MENU, REPLY, Outbox
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class FakeBot:
+    """Запоминает отправленные сообщения; failures[chat_id] - ошибки первых попыток."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.sent = []
+        self.attempts = []
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def _call(self, method, chat_id, kwargs):
+        with self._lock:
+            self.attempts.append(chat_id)
+            failures = self.failures.get(chat_id)
+            if failures:
+                raise failures.pop(0)
+            self.sent.append((method, chat_id, kwargs, self.clock()))
+
+    def send_message(self, chat_id, **kwargs):
+        self._call("send_message", chat_id, kwargs)
+
+    def send_sticker(self, chat_id, **kwargs):
+        self._call("send_sticker", chat_id, kwargs)
+
+    def chats(self):
+        with self._lock:
+            return [chat_id for _, chat_id, _, _ in self.sent]
+
+def too_many_requests(retry_after):
+    return ApiTelegramException("sendMessage", None, {
+        "ok": False, "error_code": 429, "description": "Too Many Requests",
+        "parameters": {"retry_after": retry_after}
+    })
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "условие не выполнилось"
+        time.sleep(0.005)
+
+def settle():
+    """Даёт потоку отправки время заметить изменения."""
+    time.sleep(0.05)
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def bot(clock):
+    return FakeBot(clock)
+
+@pytest.fixture
+def make_outbox(bot, clock):
+    outboxes = []
+
+    def make(**kwargs):
+        kwargs.setdefault("global_rate", 1000)
+        kwargs.setdefault("chat_rate", 1000)
+        kwargs.setdefault("chat_burst", 1000)
+        outbox = Outbox(bot, workers=1, clock=clock, **kwargs)
+        outboxes.append(outbox)
+        return outbox
+
+    yield make
+    for outbox in outboxes:
+        # close ждёт отправки всей очереди, а часы сами не идут
+        closer = threading.Thread(target=outbox.close)
+        closer.start()
+        while closer.is_alive():
+            advance(outbox, clock, 1000)
+            closer.join(0.01)
+
+def advance(outbox, clock, seconds):
+    with outbox._cond:
+        clock.now += seconds
+        outbox._cond.notify_all()
+
+def test_retry_after_delays_only_that_chat(make_outbox, bot, clock):
+    bot.failures[1] = [too_many_requests(5)]
+    outbox = make_outbox()
+    outbox.send_sticker(1, "a")
+    wait_until(lambda: bot.attempts == [1])
+    outbox.send_sticker(2, "b")
+    wait_until(lambda: bot.chats() == [2])
+
+    advance(outbox, clock, 4)
+    settle()
+    assert bot.chats() == [2]
+
+    advance(outbox, clock, 1)
+    wait_until(lambda: bot.chats() == [2, 1])
+    assert bot.sent[-1][3] == 5
+
+def test_retry_after_keeps_message_order(make_outbox, bot, clock):
+    bot.failures[1] = [too_many_requests(2)]
+    outbox = make_outbox()
+    outbox.send_sticker(1, "first")
+    wait_until(lambda: bot.attempts == [1])
+    outbox.send_sticker(1, "second")
+
+    advance(outbox, clock, 2)
+    wait_until(lambda: len(bot.sent) == 2)
+    assert [kwargs["sticker"] for _, _, kwargs, _ in bot.sent] == ["first", "second"]
+
+def test_other_api_errors_are_not_retried(make_outbox, bot, clock):
+    bot.failures[1] = [ApiTelegramException("sendMessage", None, {
+        "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"
+    })]
+    outbox = make_outbox()
+    outbox.send_sticker(1, "a")
+    wait_until(lambda: outbox.pending() == 0)
+    advance(outbox, clock, 100)
+    settle()
+    assert bot.attempts == [1] and bot.sent == []
+
+def test_chat_bucket_limits_one_chat(make_outbox, bot, clock):
+    outbox = make_outbox(chat_rate=1, chat_burst=2)
+    for n in range(4):
+        outbox.send_sticker(1, str(n))
+    outbox.send_sticker(2, "other")
+    wait_until(lambda: len(bot.sent) == 3)
+    assert sorted(bot.chats()) == [1, 1, 2]
+
+    advance(outbox, clock, 1)
+    wait_until(lambda: len(bot.sent) == 4)
+    settle()
+    assert len(bot.sent) == 4
+
+    advance(outbox, clock, 1)
+    wait_until(lambda: len(bot.sent) == 5)
+    assert [kwargs["sticker"] for _, chat_id, kwargs, _ in bot.sent if chat_id == 1] == ["0", "1", "2", "3"]
+
+def test_group_chats_use_group_rate(make_outbox, bot, clock):
+    outbox = make_outbox(chat_burst=1, group_rate=0.5)
+    outbox.send_sticker(-100, "a")
+    outbox.send_sticker(-100, "b")
+    wait_until(lambda: len(bot.sent) == 1)
+
+    advance(outbox, clock, 1)
+    settle()
+    assert len(bot.sent) == 1
+
+    advance(outbox, clock, 1)
+    wait_until(lambda: len(bot.sent) == 2)
+
+def test_global_bucket_limits_all_chats(make_outbox, bot, clock):
+    outbox = make_outbox(global_rate=2)
+    for chat_id in (1, 2, 3, 4):
+        outbox.send_sticker(chat_id, "a")
+    wait_until(lambda: len(bot.sent) == 2)
+    settle()
+    assert len(bot.sent) == 2
+
+    advance(outbox, clock, 0.5)
+    wait_until(lambda: len(bot.sent) == 3)
+    settle()
+    assert len(bot.sent) == 3
+
+    advance(outbox, clock, 0.5)
+    wait_until(lambda: len(bot.sent) == 4)
+
+def test_urgent_chats_go_first(make_outbox, bot, clock):
+    outbox = make_outbox(global_rate=1)
+    # Единственный токен общей корзины уходит на первое сообщение
+    outbox.send_sticker(1, "a")
+    wait_until(lambda: len(bot.sent) == 1)
+
+    outbox.send_message(2, "menu", priority=MENU)
+    outbox.send_message(3, "reply", priority=REPLY)
+    outbox.send_message(4, "card", priority=CARD)
+    for sent in (2, 3, 4):
+        advance(outbox, clock, 1)
+        wait_until(lambda: len(bot.sent) == sent)
+    assert bot.chats() == [1, 4, 3, 2]
+
+def test_consecutive_texts_are_merged(make_outbox, bot, clock):
+    outbox = make_outbox(global_rate=1)
+    outbox.send_sticker(1, "a")
+    wait_until(lambda: len(bot.sent) == 1)
+
+    outbox.send_message(2, "Слово добавлено", priority=REPLY)
+    outbox.send_message(2, "Меню", reply_markup="markup", priority=MENU)
+    outbox.send_sticker(2, "b")
+    outbox.send_message(2, "После стикера")
+    assert outbox.pending() == 3
+
+    for sent in (2, 3, 4):
+        advance(outbox, clock, 1)
+        wait_until(lambda: len(bot.sent) == sent)
+    methods = [(method, kwargs) for method, chat_id, kwargs, _ in bot.sent if chat_id == 2]
+    assert methods[0] == ("send_message", {"text": "Слово добавлено\n\nМеню", "reply_markup": "markup",
+                                           "parse_mode": None})
+    assert methods[1] == ("send_sticker", {"sticker": "b"})
+    assert methods[2][1]["text"] == "После стикера"
+
+def test_texts_with_different_parse_mode_are_not_merged(make_outbox, bot, clock):
+    outbox = make_outbox(global_rate=1)
+    outbox.send_sticker(1, "a")
+    wait_until(lambda: len(bot.sent) == 1)
+
+    outbox.send_message(2, "plain")
+    outbox.send_message(2, "*bold*", parse_mode="Markdown")
+    assert outbox.pending() == 2
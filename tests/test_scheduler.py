@@ -0,0 +1,48 @@
+"""Проверки интервальных повторений (scheduler)."""
+import pytest
+
+from scheduler import (
+    DEFAULT_EASE, FAILED_QUALITY, MAX_INTERVAL_DAYS, MIN_EASE, quality_from_attempts, review
+)
+
+@pytest.mark.parametrize("correct, attempts, quality", [
+    (True, 0, 5),
+    (True, 1, 4),
+    (True, 2, 3),
+    (True, 5, 3),
+    (False, 3, FAILED_QUALITY),
+])
+def test_quality_from_attempts(correct, attempts, quality):
+    assert quality_from_attempts(correct, attempts) == quality
+
+def test_interval_sequence():
+    ease, interval, streak = DEFAULT_EASE, 0.0, 0
+    intervals = []
+    for _ in range(4):
+        ease, interval, streak = review(ease, interval, streak, 4)
+        intervals.append(interval)
+    # Оценка 4 не меняет лёгкость: после 1 и 6 дней интервал умножается на неё
+    assert ease == pytest.approx(DEFAULT_EASE)
+    assert intervals == pytest.approx([1.0, 6.0, 6.0 * DEFAULT_EASE, 6.0 * DEFAULT_EASE ** 2])
+    assert streak == 4
+
+def test_ease_changes_with_quality():
+    assert review(DEFAULT_EASE, 6.0, 2, 5)[0] == pytest.approx(DEFAULT_EASE + 0.1)
+    assert review(DEFAULT_EASE, 6.0, 2, 3)[0] == pytest.approx(DEFAULT_EASE - 0.14)
+
+def test_ease_floor():
+    ease = DEFAULT_EASE
+    interval, streak = 0.0, 0
+    for _ in range(20):
+        ease, interval, streak = review(ease, interval, streak, 3)
+    assert ease == MIN_EASE
+    assert review(MIN_EASE, 6.0, 2, 3)[0] == MIN_EASE
+
+@pytest.mark.parametrize("quality", [0, FAILED_QUALITY, 2])
+def test_low_quality_resets_repetition(quality):
+    assert review(2.1, 40.0, 5, quality) == (2.1, 1.0, 0)
+
+def test_interval_is_clamped():
+    ease, interval, streak = review(DEFAULT_EASE, MAX_INTERVAL_DAYS / 2, 10, 5)
+    assert interval == MAX_INTERVAL_DAYS
+    assert review(ease, interval, streak, 5)[1] == MAX_INTERVAL_DAYS
@@ -0,0 +1,248 @@
+"""Проверки StatePostgresStorage на заглушке таблицы bot_states в памяти."""
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+import state_storage
+from state_storage import AsyncStatePostgresStorage, StatePostgresStorage
+
+class FakeDatabase:
+    """Таблица bot_states в памяти; понимает запросы StatePostgresStorage.
+
+    CURRENT_TIMESTAMP - поле now (секунды). Если задан gate, запросы ждут
+    его, чтобы тест успел накопить следующую пачку.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.rows = {}
+        self.executes = []
+        self.commits = 0
+        self.gate = None
+        self.waiting = 0
+        self.error = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        yield FakeConnection(self)
+
+    def execute(self, sql, params):
+        if self.gate is not None:
+            with self._lock:
+                self.waiting += 1
+            self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        with self._lock:
+            self.executes.append(sql)
+            if sql.lstrip().startswith("SELECT"):
+                (keys,) = params
+                return [(key, row[0], row[1]) for key, row in self.rows.items()
+                        if key in keys and row[2] > self.now]
+            params = list(params or ())
+            for statement in filter(str.strip, sql.split(";")):
+                self._statement(statement, params)
+            return []
+
+    def _statement(self, statement, params):
+        if "DELETE FROM bot_states WHERE key" in statement:
+            for key in params.pop(0):
+                self.rows.pop(key, None)
+        elif "DELETE FROM bot_states WHERE expires_at" in statement:
+            self.rows = {key: row for key, row in self.rows.items() if row[2] >= self.now}
+        elif "INSERT INTO bot_states" in statement:
+            ttl, keys, states = params.pop(0), params.pop(0), params.pop(0)
+            for key, state in zip(keys, states):
+                row = self.rows.get(key)
+                data = row[1] if row and row[2] > self.now else {}
+                self.rows[key] = [state, data, self.now + ttl]
+        elif "UPDATE bot_states" in statement:
+            ttl, keys, values = params.pop(0), params.pop(0), params.pop(0)
+            merge = "s.data ||" in statement
+            for key, value in zip(keys, values):
+                row = self.rows.get(key)
+                if row and row[2] > self.now:
+                    row[1] = {**row[1], **json.loads(value)} if merge else json.loads(value)
+                    row[2] = self.now + ttl
+        else:
+            raise AssertionError(f"Неизвестный запрос: {statement}")
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    @contextmanager
+    def cursor(self):
+        yield FakeCursor(self.db)
+
+    def commit(self):
+        with self.db._lock:
+            self.db.commits += 1
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self._rows = self.db.execute(sql, params)
+
+    def fetchall(self):
+        return self._rows
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(state_storage, "get_db_connection", db.connection)
+    return db
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "условие не выполнилось"
+        time.sleep(0.005)
+
+def run_batched(db, batcher, calls):
+    """Выполняет вызовы, пока первый держит поток пачек; возвращает результаты.
+
+    Первый вызов уходит отдельной пачкой и ждёт db.gate, остальные за это
+    время копятся в очереди batcher.
+    """
+    results = [None] * len(calls)
+
+    def run(index):
+        results[index] = calls[index]()
+
+    db.gate = threading.Event()
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(calls))]
+    threads[0].start()
+    wait_until(lambda: db.waiting == 1)
+    for thread in threads[1:]:
+        thread.start()
+    wait_until(lambda: len(batcher._pending) == len(calls) - 1)
+    db.gate.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_state_and_data(db):
+    storage = StatePostgresStorage(ttl=60)
+    assert storage.get_state(1, 2) is None
+    assert storage.get_data(1, 2) == {}
+
+    storage.set_state(1, 2, "target_word")
+    storage.set_data(1, 2, "target_word", "cat")
+    storage.set_data(1, 2, "attempts", 1)
+    assert storage.get_state(1, 2) == "target_word"
+    assert storage.get_data(1, 2) == {"target_word": "cat", "attempts": 1}
+    assert storage.get_state(3, 2) is None
+
+    storage.reset_data(1, 2)
+    assert storage.get_data(1, 2) == {}
+    storage.delete_state(1, 2)
+    assert storage.get_state(1, 2) is None
+
+def test_interactive_data_is_saved_on_exit(db):
+    storage = StatePostgresStorage(ttl=60)
+    storage.set_state(1, 2, "target_word")
+    with storage.get_interactive_data(1, 2) as data:
+        data["review"] = {"user_word_id": 5}
+    assert storage.get_data(1, 2) == {"review": {"user_word_id": 5}}
+
+def test_async_storage_uses_same_rows(db):
+    storage = AsyncStatePostgresStorage(ttl=60)
+
+    async def scenario():
+        await storage.set_state(1, 2, "target_word")
+        async with storage.get_interactive_data(1, 2) as data:
+            data["target_word"] = "cat"
+        return await storage.get_state(1, 2), await storage.get_data(1, 2)
+
+    assert asyncio.run(scenario()) == ("target_word", {"target_word": "cat"})
+    assert storage.storage.get_data(1, 2) == {"target_word": "cat"}
+
+def test_expired_rows_are_ignored(db):
+    storage = StatePostgresStorage(ttl=60)
+    storage.set_state(1, 2, "target_word")
+    storage.set_data(1, 2, "target_word", "cat")
+
+    db.now += 61
+    assert storage.get_state(1, 2) is None
+    assert storage.get_data(1, 2) == {}
+    # Запись в просроченную строку не продлевает её
+    storage.set_data(1, 2, "attempts", 1)
+    assert storage.get_data(1, 2) == {}
+    # Новое состояние начинается без старых данных
+    storage.set_state(1, 2, "add_word")
+    assert storage.get_state(1, 2) == "add_word"
+    assert storage.get_data(1, 2) == {}
+
+def test_writes_extend_ttl(db):
+    storage = StatePostgresStorage(ttl=60)
+    storage.set_state(1, 2, "target_word")
+    db.now += 50
+    storage.set_data(1, 2, "attempts", 1)
+    db.now += 50
+    assert storage.get_state(1, 2) == "target_word"
+
+def test_expired_rows_are_purged(db):
+    storage = StatePostgresStorage(ttl=60, purge_interval=0)
+    storage.set_state(1, 2, "target_word")
+    storage.set_state(3, 4, "target_word")
+    db.now += 61
+    storage.set_state(5, 6, "target_word")
+    assert set(db.rows) == {storage._key(5, 6)}
+
+def test_concurrent_reads_share_a_query(db):
+    storage = StatePostgresStorage(ttl=60)
+    for chat_id in range(10):
+        storage.set_state(chat_id, 1, f"state{chat_id}")
+    db.executes.clear()
+
+    results = run_batched(db, storage._reads, [lambda c=c: storage.get_state(c, 1) for c in range(10)])
+    assert results == [f"state{c}" for c in range(10)]
+    assert len(db.executes) == 2
+
+def test_batches_are_limited_by_size(db):
+    storage = StatePostgresStorage(ttl=60, batch_size=2)
+    run_batched(db, storage._writes, [lambda c=c: storage.set_state(c, 1, "s") for c in range(5)])
+
+    # Первая запись уходит одна, остальные четыре - двумя пачками по 2
+    assert len(db.executes) == 3
+    assert db.commits == 3
+    assert len(db.rows) == 5
+
+def test_repeated_key_splits_batch_in_order(db):
+    storage = StatePostgresStorage(ttl=60)
+    first, second = storage._key(1, 1), storage._key(2, 2)
+    storage._write_batch([
+        ("state", first, "target_word"),
+        ("merge", first, {"a": 1}),
+        ("state", second, "add_word"),
+        ("replace", first, {"b": 2}),
+        ("merge", first, {"c": 3}),
+    ])
+    # Ключ first повторяется: пачка делится на четыре части, но транзакция одна
+    assert len(db.executes) == 4
+    assert db.commits == 1
+    assert storage.get_data(1, 1) == {"b": 2, "c": 3}
+    assert storage.get_state(2, 2) == "add_word"
+
+def test_batch_errors_reach_every_caller(db):
+    storage = StatePostgresStorage(ttl=60)
+    errors = []
+
+    def read(chat_id):
+        try:
+            storage.get_state(chat_id, 1)
+        except RuntimeError as e:
+            errors.append(e)
+
+    db.error = RuntimeError("база недоступна")
+    run_batched(db, storage._reads, [lambda c=c: read(c) for c in range(3)])
+    assert len(errors) == 3
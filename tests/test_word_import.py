@@ -0,0 +1,30 @@
+"""Проверки разбора списков слов (word_import.read_word_pairs)."""
+import pytest
+
+from word_import import read_word_pairs
+
+@pytest.mark.parametrize("text, options, pairs", [
+    # Разделитель определяется по первой строке
+    ("cat,кошка\ndog,собака\n", {}, [("cat", "кошка"), ("dog", "собака")]),
+    ("cat;кошка, кот\n", {}, [("cat", "кошка, кот")]),
+    ("cat\tкошка\n", {}, [("cat", "кошка")]),
+    ("cat|кошка\n", {"delimiter": "|"}, [("cat", "кошка")]),
+    # Заголовок, кавычки, строки без перевода и лишние поля
+    ("word,translation\ncat,кошка\n", {"skip_header": True}, [("cat", "кошка")]),
+    ('"a, b",перевод\n', {}, [("a, b", "перевод")]),
+    ("cat\n,кошка\ndog, \n\nbird,птица,лишнее\n", {}, [("bird", "птица")]),
+    ("", {}, []),
+    # Экспорт Anki: разделитель, HTML и служебные столбцы из заголовков
+    ("#separator:tab\n#html:true\ncat<br>\t<b>кошка</b> &amp; кот\n", {},
+     [("cat", "кошка & кот")]),
+    ("#separator:Pipe\n#html:false\n<b>cat</b>|кошка\n", {}, [("<b>cat</b>", "кошка")]),
+    ("#separator:comma\n#guid column:1\n#notetype column:2\nabc,Basic,cat,кошка\n", {},
+     [("cat", "кошка")]),
+    ("#deck:Английский\n#tags column:3\ncat;кошка;tag\n", {}, [("cat", "кошка")]),
+    # Строка с # без известного ключа - данные, а не заголовок
+    ("#hashtag,решётка\ncat,кошка\n", {}, [("#hashtag", "решётка"), ("cat", "кошка")]),
+    ("#note: важно;заметка\n", {}, [("#note: важно", "заметка")]),
+    ("#separator:semicolon\n#1;один\n", {}, [("#1", "один")]),
+])
+def test_read_word_pairs(text, options, pairs):
+    assert list(read_word_pairs(text.splitlines(keepends=True), **options)) == pairs
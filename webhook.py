@@ -0,0 +1,242 @@
+"""Приём обновлений Telegram через вебхук.
+
+Запуск: BOT_MODE=webhook python main.py
+
+HTTP-сервер принимает обновления POST-запросами и раскладывает их по
+очередям обработчиков: все обновления одного чата попадают в одну очередь
+и обрабатываются по порядку, разные чаты - параллельно. Когда очередь
+переполнена, сервер отвечает 503 с Retry-After, и Telegram повторит
+доставку позже.
+
+Для локальной проверки WEBHOOK_URL можно не задавать (вебхук в Telegram
+не регистрируется) и отправлять записанные обновления вручную:
+
+    curl -X POST -H "Content-Type: application/json" \\
+         --data @update.json http://localhost:8443/webhook
+
+Тело запроса - одно обновление или список обновлений (как в ответе getUpdates).
+"""
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+import metrics
+
+# Настройки вебхука
+webhook_host = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+webhook_port = int(os.getenv("WEBHOOK_PORT", "8443"))
+webhook_path = os.getenv("WEBHOOK_PATH", "/webhook")
+webhook_url = os.getenv("WEBHOOK_URL")
+webhook_secret = os.getenv("WEBHOOK_SECRET")
+webhook_workers = int(os.getenv("WEBHOOK_WORKERS", "8"))
+webhook_queue_size = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+webhook_enqueue_timeout = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", "1"))
+
+logger = logging.getLogger(__name__)
+
+# Пауза между попытками поставить обновление в заполненную очередь, секунды
+_RESUBMIT_DELAY = 0.05
+
+# Поля обновления, у которых есть чат
+_CHAT_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "business_message", "edited_business_message",
+    "my_chat_member", "chat_member", "chat_join_request"
+)
+
+# Поля обновления, у которых есть только пользователь
+_USER_FIELDS = (
+    "callback_query", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query"
+)
+
+def chat_id_of(update):
+    """Возвращает id чата, к которому относится обновление, или None."""
+    for field in _CHAT_FIELDS:
+        event = getattr(update, field, None)
+        if event is not None:
+            return event.chat.id
+    callback_query = getattr(update, "callback_query", None)
+    if callback_query is not None and callback_query.message is not None:
+        return callback_query.message.chat.id
+    for field in _USER_FIELDS:
+        event = getattr(update, field, None)
+        if event is not None:
+            return event.from_user.id
+    return None
+
+def chat_id_of_json(item):
+    """То же, что chat_id_of, для обновления в виде JSON (dict)."""
+    for field in _CHAT_FIELDS:
+        event = item.get(field)
+        if event is not None:
+            return event["chat"]["id"]
+    callback_query = item.get("callback_query")
+    if callback_query is not None and callback_query.get("message") is not None:
+        return callback_query["message"]["chat"]["id"]
+    for field in _USER_FIELDS:
+        event = item.get(field)
+        if event is not None:
+            return event["from"]["id"]
+    return None
+
+def json_update(item):
+    """Проверяет, что обновление - JSON-объект, и возвращает его без разбора."""
+    if not isinstance(item, dict) or "update_id" not in item:
+        raise TypeError("Обновление должно быть объектом с update_id")
+    return item
+
+class UpdateDispatcher:
+    """Ограниченный пул обработчиков с порядком обновлений внутри чата.
+
+    У каждого из workers потоков своя очередь на queue_size обновлений.
+    Чат всегда попадает в один и тот же поток, поэтому переходы MyStates
+    одного чата выполняются строго по порядку.
+    """
+
+    def __init__(self, handle, workers=webhook_workers, queue_size=webhook_queue_size,
+                 enqueue_timeout=webhook_enqueue_timeout):
+        self.handle = handle
+        self.enqueue_timeout = enqueue_timeout
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(q,), name=f"webhook-worker-{i}", daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Обрабатывает уже принятые обновления и останавливает потоки."""
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def pending(self):
+        """Сколько обновлений ждут обработки."""
+        return sum(q.qsize() for q in self._queues)
+
+    def submit(self, update):
+        """Ставит обновление в очередь его чата.
+
+        Возвращает False, если очередь не освободилась за enqueue_timeout.
+        """
+        key = chat_id_of(update)
+        if key is None:
+            key = update.update_id
+        q = self._queues[hash(key) % len(self._queues)]
+        try:
+            q.put(update, timeout=self.enqueue_timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def _work(self, q):
+        while True:
+            update = q.get()
+            if update is None:
+                return
+            try:
+                self.handle([update])
+            except Exception as e:
+                logger.error("Ошибка при обработке обновления %s: %s", update.update_id, e)
+
+def submit_waiting(dispatcher, update):
+    """Ставит обновление в очередь, пока не найдётся место."""
+    while not dispatcher.submit(update):
+        time.sleep(_RESUBMIT_DELAY)
+
+def make_request_handler(dispatcher, path=webhook_path, secret=webhook_secret, decode=types.Update.de_json):
+    """Создает класс обработчика HTTP-запросов для ThreadingHTTPServer.
+
+    Каждое обновление из тела запроса преобразуется decode и передаётся
+    dispatcher.submit.
+    """
+
+    class WebhookRequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != path:
+                self._reply(404)
+                return
+            token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if secret and not hmac.compare_digest(token, secret):
+                self._reply(403)
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                items = payload if isinstance(payload, list) else [payload]
+                updates = [decode(item) for item in items]
+            except (ValueError, TypeError, KeyError):
+                self._reply(400)
+                return
+
+            if updates and not dispatcher.submit(updates[0]):
+                # Очереди заполнены, ничего не принято: Telegram повторит доставку
+                self._reply(503, {"Retry-After": "1"})
+                return
+            # Часть обновлений уже принята, и повторная доставка обработала бы
+            # их дважды: остальные ждут места в очередях
+            for update in updates[1:]:
+                submit_waiting(dispatcher, update)
+            self._reply(200)
+
+        def _reply(self, code, headers=None):
+            self.send_response(code)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            # Не пишем в консоль строку на каждое обновление
+            pass
+
+    return WebhookRequestHandler
+
+def run_webhook(bot, host=webhook_host, port=webhook_port, path=webhook_path,
+                url=webhook_url, secret=webhook_secret):
+    """Принимает обновления через вебхук, пока процесс не остановят.
+
+    Бот должен быть создан с threaded=False: параллельность и порядок
+    обработки обеспечивает UpdateDispatcher.
+    """
+    dispatcher = UpdateDispatcher(bot.process_new_updates)
+    dispatcher.start()
+    metrics.gauge("webhook_pending_updates", "Принятые обновления, ждущие обработки", dispatcher.pending)
+    try:
+        serve_webhook(bot, dispatcher, host, port, path, url, secret)
+    finally:
+        dispatcher.stop()
+
+def serve_webhook(bot, dispatcher, host=webhook_host, port=webhook_port, path=webhook_path,
+                  url=webhook_url, secret=webhook_secret, decode=types.Update.de_json):
+    """Принимает обновления и передаёт их dispatcher.submit, пока процесс не остановят.
+
+    bot нужен только для регистрации вебхука в Telegram.
+    """
+    server = ThreadingHTTPServer((host, port), make_request_handler(dispatcher, path, secret, decode))
+
+    if url:
+        bot.remove_webhook()
+        bot.set_webhook(url=url.rstrip("/") + path, secret_token=secret,
+                        max_connections=webhook_workers)
+
+    logger.info("Webhook server on %s:%s%s...", host, port, path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,126 @@
+"""Импорт списков слов из CSV, TSV и текстового экспорта Anki.
+
+Запуск:
+
+    python word_import.py words.csv [--user CID] [--delimiter ";"] [--skip-header]
+
+Файл читается построчно и загружается через COPY (handlers_db.import_words),
+поэтому память не зависит от размера списка. Без --user слова попадают в
+общий словарь, который получают новые пользователи; с --user - ещё и в
+словарь пользователя с этим chat id. Те же функции использует бот, когда
+пользователь присылает файл со словами.
+
+В каждой строке первые два поля - слово и перевод. Разделитель
+определяется по первой строке (табуляция, точка с запятой или запятая);
+в экспорте Anki он и другие настройки берутся из заголовков #separator,
+#html и #... column. Строка с # и незнакомым ключом считается данными.
+"""
+import argparse
+import csv
+import html
+import io
+import itertools
+import re
+import sys
+from urllib.request import urlopen
+
+from handlers_db import import_words
+
+# Разделители из заголовка #separator экспорта Anki
+_ANKI_SEPARATORS = {
+    "tab": "\t", "comma": ",", "semicolon": ";", "pipe": "|", "space": " ", "colon": ":"
+}
+
+# Заголовки экспорта Anki (#ключ:значение); строка с другим ключом - уже данные
+_ANKI_HEADERS = {
+    "separator", "html", "tags", "columns", "notetype", "deck",
+    "guid column", "notetype column", "deck column", "tags column"
+}
+
+_TAG = re.compile(r"<[^>]+>")
+
+def _sniff_delimiter(line):
+    for delimiter in ("\t", ";", ","):
+        if delimiter in line:
+            return delimiter
+    return ","
+
+def read_word_pairs(lines, delimiter=None, skip_header=False):
+    """Лениво разбирает строки файла в пары (слово, перевод).
+
+    Строки без перевода пропускаются; нормализация слов - в import_words.
+    """
+    lines = iter(lines)
+    is_html = False
+    skip_columns = set()
+
+    # Заголовки Anki идут в начале файла строками вида #ключ:значение
+    first = None
+    for line in lines:
+        key, colon, value = line[1:].strip().partition(":")
+        key, value = key.strip().lower(), value.strip()
+        if not line.startswith("#") or not colon or key not in _ANKI_HEADERS:
+            first = line
+            break
+        if key == "separator":
+            delimiter = _ANKI_SEPARATORS.get(value.lower(), value)
+        elif key == "html":
+            is_html = value.lower() == "true"
+        elif key.endswith(" column") and value.isdigit():
+            # Служебные столбцы: guid, тип записи, колода, метки
+            skip_columns.add(int(value) - 1)
+    if first is None:
+        return
+
+    if delimiter is None:
+        delimiter = _sniff_delimiter(first)
+    rows = csv.reader(itertools.chain([first], lines), delimiter=delimiter)
+    if skip_header:
+        next(rows, None)
+
+    for row in rows:
+        fields = [field for i, field in enumerate(row) if i not in skip_columns]
+        if len(fields) < 2:
+            continue
+        target_word, translate_word = fields[0], fields[1]
+        if is_html:
+            target_word = html.unescape(_TAG.sub("", target_word))
+            translate_word = html.unescape(_TAG.sub("", translate_word))
+        if target_word.strip() and translate_word.strip():
+            yield target_word, translate_word
+
+def import_file(stream, cid=None, delimiter=None, skip_header=False):
+    """Импортирует слова из бинарного потока (файл, ответ HTTP).
+
+    Возвращает результат handlers_db.import_words.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    return import_words(read_word_pairs(text, delimiter, skip_header), cid=cid)
+
+def import_url(url, cid=None):
+    """Импортирует слова из файла по ссылке, не загружая его в память целиком."""
+    with urlopen(url) as response:
+        return import_file(response, cid=cid)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="файл со словами или - для стандартного ввода")
+    parser.add_argument("--user", type=int, help="chat id пользователя, в чей словарь добавить слова")
+    parser.add_argument("--delimiter", help="разделитель полей (по умолчанию определяется по файлу)")
+    parser.add_argument("--skip-header", action="store_true", help="пропустить первую строку с названиями столбцов")
+    args = parser.parse_args()
+
+    if args.path == "-":
+        result = import_file(sys.stdin.buffer, args.user, args.delimiter, args.skip_header)
+    else:
+        with open(args.path, "rb") as stream:
+            result = import_file(stream, args.user, args.delimiter, args.skip_header)
+
+    if result is None:
+        print(f"Пользователь {args.user} не найден.")
+        sys.exit(1)
+    read, added, linked = result
+    print(f"Прочитано пар: {read}, новых слов: {added}, добавлено в словарь пользователя: {linked}.")
+
+if __name__ == "__main__":
+    main()